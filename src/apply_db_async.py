@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Engine asyncio do apply_db_updates (psycopg 3 AsyncConnection).
+
+Mesmo fluxo do caminho síncrono, mas com todas as bases configuradas
+trabalhando ao mesmo tempo:
+  - TEST: conecta -> catch-up -> NOVO(s) script(s) completo(s), em ordem
+  - DEV : conecta -> catch-up -> (espera o TEST do mesmo sistema) -> fn_atualiza_script
+          de cada novo script, na mesma ordem
+
+Concorrência estruturada: se qualquer alvo falhar (ou estourar o timeout
+configurado), os demais são cancelados — a query em andamento recebe
+cancel no servidor e a transação é desfeita — e o processo sai com o
+mesmo código/mensagem do caminho síncrono.
+
+Selecionado em config.ini:
+    [apply]
+    engine = async
+    target_timeout = 1800      ; segundos por alvo (0 = sem limite; no DEV não conta a espera pelo TEST)
+ou pela variável de ambiente APPLY_ENGINE=async.
+"""
+
+import sys
+import time
+import asyncio
+from pathlib import Path
+from configparser import ConfigParser
+
+import progress
+import run_history
+import apply_db_updates as adb
+
+
+class ApplyError(Exception):
+    """Falha de um alvo; convertida em die() na borda do engine."""
+
+
+async def connect_db(cfg: dict):
+    import psycopg
+    try:
+        extra = {}
+        if adb.session_options(cfg):
+            extra["options"] = adb.session_options(cfg)
+        conn = await psycopg.AsyncConnection.connect(
+            host=cfg["host"], port=cfg["port"],
+            dbname=cfg["dbname"], user=cfg["user"], password=cfg["password"],
+            autocommit=False, **extra
+        )
+        adb.CONN_PARAMS[id(conn)] = (None, cfg)  # retry_budget do alvo
+        return conn
+    except Exception as e:
+        raise ApplyError(f"Falha ao conectar em {cfg['host']}:{cfg['port']}/{cfg['dbname']} - {e}")
+
+
+async def _rollback_quietly(conn):
+    try:
+        await conn.rollback()
+    except Exception:
+        pass
+
+
+async def _cancel_and_rollback(conn):
+    # Tarefa cancelada no meio de um execute: pede cancel ao servidor antes do rollback
+    try:
+        conn.cancel()
+    except Exception:
+        pass
+    await _rollback_quietly(conn)
+
+
+async def get_last_applied_seq(conn):
+    sql = """
+    select nm_arquivo
+      from sistema.tb_sys_controle_versao
+     order by nr_versao_banco desc
+     limit 1
+    """
+    try:
+        async with conn.cursor() as cur:
+            await cur.execute(sql)
+            row = await cur.fetchone()
+    except Exception as e:
+        await _rollback_quietly(conn)
+        raise ApplyError(f"Falha ao consultar controle de versão: {e}")
+    if not row or not row[0]:
+        return 0, ""
+    nm = str(row[0])
+    return adb.parse_seq_from_name(nm), nm
+
+
+async def run_block(conn, cur, sql: str, label: str, block_no: int) -> int:
+    """adb.run_block com AsyncServerCursor: consultas puras consumidas em lotes no servidor."""
+    body = adb.streamable_query(sql)
+    if body is None:
+        await cur.execute(sql)
+        if adb.RESULT_PREVIEW > 0 and cur.description:
+            for n, row in enumerate(await cur.fetchmany(adb.RESULT_PREVIEW)):
+                adb.preview_row(label, block_no, n, cur, row)
+            adb.preview_total(label, block_no, max(cur.rowcount or 0, 0))
+        return max(cur.rowcount or 0, 0)
+    n = 0
+    async with conn.cursor(name=adb.cursor_name()) as scur:
+        scur.itersize = adb.RESULT_FETCH
+        await scur.execute(body)
+        async for row in scur:
+            adb.preview_row(label, block_no, n, scur, row)
+            n += 1
+    adb.preview_total(label, block_no, n)
+    return n
+
+
+async def iter_blocks(blocks):
+    """Blocos em ordem; os lidos do disco (FileBlocks) vêm de uma thread, sem travar o loop."""
+    if not isinstance(blocks, adb.FileBlocks):
+        for b in blocks:
+            yield b
+        return
+    it = iter(blocks)
+    while (b := await asyncio.to_thread(next, it, None)) is not None:
+        yield b
+
+
+async def exec_blocks(conn, blocks, label: str, kind: str = "", target: str = "", script: str = ""):
+    """
+    Mesma semântica do exec_blocks síncrono: uma transação, ROLLBACK em qualquer falha.
+    No catch-up devolve as linhas alteradas por tabela (ver adb.auto_analyze).
+    """
+    t0, rows, status, attempt = time.monotonic(), 0, "fail", 0
+    track = kind == "catchup" and adb.ANALYZE["min_rows"] > 0
+    with progress.script(target or label, script or label, adb.blocks_size(blocks)) as prog:
+        try:
+            while True:
+                attempt += 1
+                rows, i, changes = 0, 0, None
+                if prog and attempt > 1:
+                    prog.start_script(prog.script, prog.script_bytes)
+                try:
+                    async with conn.cursor() as cur:
+                        async for b in iter_blocks(blocks):
+                            i += 1
+                            if not b.strip():
+                                continue
+                            if prog:
+                                prog.block(i, len(b))
+                            rows += await run_block(conn, cur, b, label, i)
+                        if track:
+                            await cur.execute(adb.XACT_CHANGES_SQL)
+                            changes = adb.parse_xact_changes(await cur.fetchall())
+                    await conn.commit()
+                    break
+                except asyncio.CancelledError:
+                    await asyncio.shield(_cancel_and_rollback(conn))
+                    raise
+                except Exception as e:
+                    await _rollback_quietly(conn)
+                    delay = adb.lock_retry_delay(conn, e, attempt, t0)
+                    if delay is None:
+                        raise ApplyError(adb.lock_failure_msg(label, e, i, attempt, t0))
+                    print(f"[RETRY] {label}: {adb.LOCK_SQLSTATES[adb.error_sqlstate(e)]} no bloco {i}; "
+                          f"tentativa {attempt + 1} em {delay:.1f}s.")
+                    await asyncio.sleep(delay)
+            status = "ok"
+            retries = f" após {attempt - 1} retry(s) por lock" if attempt > 1 else ""
+            print(f"[OK] {label}: {len(blocks)} bloco(s) executado(s){retries}.")
+            return changes
+        finally:
+            if kind:
+                adb.record_exec(kind, target, script, blocks, time.monotonic() - t0, rows, status)
+
+
+async def auto_analyze(conn, changes: dict, target: str, script: str):
+    """adb.auto_analyze entre scripts do catch-up (ANALYZE comitado à parte)."""
+    tables = adb.tables_to_analyze(changes)
+    if not tables:
+        return
+    t0 = time.monotonic()
+    try:
+        async with conn.cursor() as cur:
+            for key, _ in tables:
+                await cur.execute(adb.analyze_sql(key))
+        await conn.commit()
+    except Exception as e:
+        await _rollback_quietly(conn)
+        print(f"[WARN] {target.strip()}: ANALYZE após {script} falhou: {e}")
+        return
+    adb.report_analyze(tables, target, script, time.monotonic() - t0)
+
+
+async def apply_pending_repo_scripts(conn, base_dir: Path, sys_label: str):
+    current_seq, current_name = await get_last_applied_seq(conn)
+    repo = await asyncio.to_thread(adb.list_repo_scripts_for_dir, base_dir)  # svn ls no catálogo remote
+    pend = [item for item in repo if item[0] > current_seq]
+    if not pend:
+        print(f"[INFO] {sys_label}: Base já está em dia (último={current_name or 'nenhum'}).")
+        return
+    print(f"[INFO] {sys_label}: Executando {len(pend)} script(s) pendente(s) a partir de {current_seq}...")
+    await asyncio.to_thread(adb.fetch_pending, pend)
+    with progress.catchup(sys_label, pend):
+        for seq, path, name in pend:
+            # blocos lidos sob demanda (um pedaço do arquivo por vez, memória limitada)
+            changes = await exec_blocks(conn, adb.FileBlocks(path), name,
+                                        kind="catchup", target=sys_label, script=name)
+            await auto_analyze(conn, changes, sys_label, name)
+
+
+def _sync_preflight(pg, test_cfg: dict, blocks, script_id: str, sys_label: str):
+    # o preflight usa a API síncrona; roda numa conexão própria fora do loop
+    conn = adb.connect_db(pg, test_cfg)
+    try:
+        adb.new_script_preflight(conn, blocks, script_id, sys_label)
+    finally:
+        adb.close_db(conn)
+
+
+async def run_test_target(pg, test_cfg: dict, base_dir: Path, sys_label: str, scripts):
+    await asyncio.to_thread(adb.snapshot_fast_forward, pg, test_cfg, base_dir, f"{sys_label}/TEST")
+    conn = await connect_db(test_cfg)
+    try:
+        print(f"[{sys_label}][TEST] Verificando e aplicando pendências...")
+        await apply_pending_repo_scripts(conn, base_dir, f"{sys_label}/TEST")
+        for item in scripts:
+            script_id, blocks, content_hash = item["script_id"], item["blocks"], item["content_hash"]
+            label = f"NOVO({script_id})@{sys_label}/TEST"
+            if await asyncio.to_thread(adb.already_applied, test_cfg, "new", content_hash, label, script_id):
+                continue
+            if adb.preflight_enabled():
+                await asyncio.to_thread(_sync_preflight, pg, test_cfg, blocks, script_id, sys_label)
+            await exec_blocks(conn, blocks, label, kind="new", target=f"{sys_label}/TEST", script=script_id)
+            if content_hash:
+                run_history.mark_applied(adb.target_dsn(test_cfg), "new", content_hash, script_id)
+    finally:
+        adb.CONN_PARAMS.pop(id(conn), None)
+        await conn.close()
+
+
+async def run_dev_target(pg, dev_cfg: dict, base_dir: Path, sys_label: str, scripts, test_done: asyncio.Task,
+                         timeout: float = 0):
+    """
+    timeout vale só para o trabalho do próprio DEV (catch-up e marcações): a
+    espera pelo TEST não conta. Se estourar, a falha segue a regra do run_all
+    (a primeira falha cancela os demais alvos, TEST incluído).
+    """
+    label = f"{sys_label}/DEV"
+    state = {}
+
+    async def catchup():
+        await asyncio.to_thread(adb.snapshot_fast_forward, pg, dev_cfg, base_dir, f"{sys_label}/DEV ")
+        state["conn"] = await connect_db(dev_cfg)
+        print(f"[{sys_label}][DEV ] Verificando e aplicando pendências...")
+        await apply_pending_repo_scripts(state["conn"], base_dir, f"{sys_label}/DEV ")
+
+    async def marks():
+        for item in scripts:
+            script_id, content_hash = item["script_id"], item["content_hash"]
+            if await asyncio.to_thread(adb.already_applied, dev_cfg, "mark", content_hash,
+                                       f"{label} fn_atualiza_script({script_id})", script_id):
+                continue
+            try:
+                await exec_blocks(state["conn"], [f"select * from sistema.fn_atualiza_script('{script_id}');"],
+                                  f"{label} fn_atualiza_script({script_id})",
+                                  kind="mark", target=label, script=script_id)
+            except ApplyError as e:
+                raise ApplyError(f"{label} falhou ao atualizar {script_id} via fn_atualiza_script: {e}")
+            print(f"[OK] {label}: {script_id} marcado via fn_atualiza_script.")
+            if content_hash:
+                run_history.mark_applied(adb.target_dsn(dev_cfg), "mark", content_hash, script_id)
+
+    try:
+        t0 = time.monotonic()
+        await _with_timeout(catchup(), timeout, label)
+        spent = time.monotonic() - t0
+        # DEV só é marcado depois que o NOVO script passou em TEST
+        await asyncio.shield(test_done)  # o DEV só observa o TEST; quem cancela os alvos é o run_all
+        await _with_timeout(marks(), max(timeout - spent, 0.001) if timeout else 0, label)
+    finally:
+        conn = state.get("conn")
+        if conn is not None:
+            adb.CONN_PARAMS.pop(id(conn), None)
+            await conn.close()
+
+
+async def _with_timeout(coro, timeout: float, label: str):
+    if not timeout:
+        return await coro
+    try:
+        return await asyncio.wait_for(coro, timeout)
+    except asyncio.TimeoutError:
+        raise ApplyError(f"{label}: tempo limite de {timeout:g}s excedido.")
+
+
+async def run_all(pg, cfg: ConfigParser, inputs, timeout: float):
+    """Dispara todos os alvos; a primeira falha cancela os demais."""
+    tasks = []
+    for system, items in adb.group_by_system(inputs).items():
+        sys_label = system.upper()
+        test_cfg, dev_cfg = adb.load_db_pair(cfg, system)
+        items = [it for it in items
+                 if not adb.applied_on_both(test_cfg, dev_cfg, it["script_id"], sys_label, it["content_hash"])]
+        if not items:
+            continue
+        base_dir = items[0]["base_dir"]
+        t_test = asyncio.create_task(_with_timeout(
+            run_test_target(pg, test_cfg, base_dir, sys_label, items),
+            timeout, f"{sys_label}/TEST"))
+        t_dev = asyncio.create_task(run_dev_target(pg, dev_cfg, base_dir, sys_label, items, t_test, timeout))
+        tasks += [t_test, t_dev]
+
+    if not tasks:
+        return
+    try:
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for t in done:
+            if t.exception() is not None:
+                raise t.exception()
+    finally:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _run_loop(coro):
+    """asyncio.run; no Windows com SelectorEventLoop (psycopg não aceita o ProactorEventLoop padrão)."""
+    if sys.platform != "win32":
+        return asyncio.run(coro)
+    if sys.version_info >= (3, 12):
+        return asyncio.run(coro, loop_factory=asyncio.SelectorEventLoop)
+    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    return asyncio.run(coro)
+
+
+def sync_only_options() -> list:
+    """Opções de [apply] ligadas que só o engine sync implementa (aqui são ignoradas)."""
+    out = []
+    if adb.CATCHUP_GROUP > 1:
+        out.append(f"catchup_group = {adb.CATCHUP_GROUP}")
+    if adb.CONCURRENT_INDEX_WORKERS > 0:
+        out.append(f"concurrent_indexes = {adb.CONCURRENT_INDEX_WORKERS}")
+    if adb.LOCK_SAMPLER["interval"] > 0:
+        out.append(f"lock_sampler = {adb.LOCK_SAMPLER['interval']:g}")
+    executors = {adb.EXECUTOR["default"], *adb.EXECUTOR["systems"].values()} - {"psycopg"}
+    if executors:
+        out.append(f"executor = {', '.join(sorted(executors))}")
+    if adb.EXECUTOR["psql_min_bytes"] > 0:
+        out.append(f"psql_min_bytes = {adb.EXECUTOR['psql_min_bytes']}")
+    return out
+
+
+def run_engine(cfg: ConfigParser, inputs):
+    try:
+        import psycopg  # engine exige psycopg 3
+    except Exception:
+        adb.die("Engine async exige psycopg 3. Instale: python3 -m pip install 'psycopg[binary]'")
+    ignored = sync_only_options()
+    if ignored:
+        print(f"[WARN] engine async ignora {'; '.join(ignored)} (só no engine sync); "
+              f"os blocos seguem um a um pela AsyncConnection.")
+    timeout = float(adb.get_apply_opt(cfg, "target_timeout", "0") or 0)
+    try:
+        _run_loop(run_all(psycopg, cfg, inputs, timeout))
+    except ApplyError as e:
+        adb.die(str(e))
@@ -6,14 +6,15 @@ Aplica atualizações nas bases PostgreSQL antes de enviar o script ao SVN.
 Estrutura do projeto:
 <raiz>/
   ├─ config.ini
-  ├─ gestor.sql / supervisor.sql          (arquivos tratados pelo preprocess)
+  ├─ gestor.sql / supervisor.sql / ...    (arquivos tratados pelo preprocess, ver systems.py)
+  ├─ inbox/<sistema>/*.sql                (lote: mais scripts novos do sistema, opcional)
   └─ src/
      ├─ Scripts/
      │  ├─ Gestor/                        (scripts versionados)
      │  └─ Supervisor/
      └─ apply_db_updates.py               (este arquivo)
 
-Fluxo por sistema presente (gestor.sql e/ou supervisor.sql):
+Fluxo por sistema presente (arquivo fonte na raiz e/ou caixa de entrada; sistemas em paralelo):
  1) Traz TEST e DEV até a última versão disponível em Scripts/<Sistema> (aplica pendentes),
     sempre consultando as bases com:
         select nm_arquivo
@@ -22,6 +23,8 @@ Fluxo por sistema presente (gestor.sql e/ou supervisor.sql):
          limit 1
  2) Executa o NOVO script tratado completo em TEST (conteúdo do arquivo da raiz).
  3) Executa somente: select * from sistema.fn_atualiza_script('<ID>') em DEV (sem “.sql”).
+ Em lote (várias entradas do sistema), 2 e 3 se repetem para cada script, na
+ ordem dos NNNN, sobre as mesmas conexões; o catch-up (1) roda uma vez só.
 
 Sai com código != 0 se algo falhar.
 """
@@ -29,8 +32,26 @@ Sai com código != 0 se algo falhar.
 import os
 import re
 import sys
+import json
+import codecs
+import time
+import random
+import bisect
+import shutil
+import hashlib
+import itertools
+import threading
+import subprocess
 from pathlib import Path
+from contextlib import contextmanager
 from configparser import ConfigParser
+from concurrent.futures import ThreadPoolExecutor
+
+import progress
+import profiling
+import run_history
+import systems
+import svn_catalog
 
 # =================== Constantes / caminhos ===================
 
@@ -39,15 +60,36 @@ END_MARK = "---------- END OFF COMMAND ----------"
 THIS_DIR     = Path(__file__).resolve().parent        # src/
 PROJECT_ROOT = THIS_DIR.parent                        # raiz
 SCRIPTS_DIR  = THIS_DIR / "Scripts"                   # src/Scripts
-GESTOR_DIR   = SCRIPTS_DIR / "Gestor"
-SUPERV_DIR   = SCRIPTS_DIR / "Supervisor"
 CONFIG_PATH  = PROJECT_ROOT / "config.ini"            # config.ini na raiz
 
+# Sistemas registrados ([systems] no config.ini; padrão Gestor/Supervisor)
 SYSTEMS = [
-    {"system": "gestor",     "src_path": PROJECT_ROOT / "gestor.sql",     "base_dir": GESTOR_DIR},
-    {"system": "supervisor", "src_path": PROJECT_ROOT / "supervisor.sql", "base_dir": SUPERV_DIR},
+    {"system": s["name"], "src_path": s["src_path"], "base_dir": s["scripts_dir"]}
+    for s in systems.load()
 ]
 
+# Scripts pendentes por transação no catch-up (1 = um commit por script)
+CATCHUP_GROUP = 1
+
+# Preflight do novo script em TEST (ver db_preflight.py)
+PREFLIGHT = {"mode": "off", "clone": "off"}
+
+# Amostrador de locks/esperas por bloco (ver lock_sampler.py)
+LOCK_SAMPLER = {"interval": 0.0, "min_elapsed": 1.0}
+
+# Reexecuta o novo script mesmo se o mesmo conteúdo já foi aplicado no alvo
+FORCE_REAPPLY = False
+
+# Blocos que retornam linhas: lote do cursor no servidor (0 = cursor comum) e prévia
+RESULT_FETCH = 2000
+RESULT_PREVIEW = 0
+
+# ANALYZE automático entre scripts do catch-up (min_rows = 0 desliga)
+ANALYZE = {"min_rows": 10000, "ratio": 0.1}
+
+# Executor dos blocos (ver "Executores"): padrão, por sistema e limiar para psql
+EXECUTOR = {"default": "psycopg", "systems": {}, "psql_min_bytes": 0, "psql": "", "pipeline_batch": 200}
+
 # =================== Utilidades ===================
 
 def die(msg: str, code: int = 1):
@@ -61,6 +103,73 @@ def load_cfg() -> ConfigParser:
     cfg.read(CONFIG_PATH, encoding="utf-8")
     return cfg
 
+def get_apply_opt(cfg: ConfigParser, key: str, fallback: str = "") -> str:
+    """
+    Opção da seção [apply] do config.ini; a variável de ambiente
+    APPLY_<KEY> (maiúsculas) tem precedência.
+    """
+    env = os.environ.get(f"APPLY_{key.upper()}")
+    if env is not None:
+        return env.strip()
+    return cfg.get("apply", key, fallback=fallback).strip()
+
+def load_apply_opts(cfg: ConfigParser):
+    """Aplica as opções de [apply] nas globais do módulo (main e run_pipeline)."""
+    global CONCURRENT_INDEX_WORKERS, CATCHUP_GROUP, FORCE_REAPPLY, RESULT_FETCH, RESULT_PREVIEW
+    FORCE_REAPPLY = get_apply_opt(cfg, "force", "false").lower() in ("1", "true", "yes", "on")
+    RESULT_FETCH = int(get_apply_opt(cfg, "result_fetch", "2000") or 0)
+    RESULT_PREVIEW = int(get_apply_opt(cfg, "result_preview", "0") or 0)
+    CONCURRENT_INDEX_WORKERS = int(get_apply_opt(cfg, "concurrent_indexes", "0") or 0)
+    CATCHUP_GROUP = int(get_apply_opt(cfg, "catchup_group", "1") or 1)
+    global PREFLIGHT
+    PREFLIGHT = dict(
+        mode=get_apply_opt(cfg, "preflight", "off").lower(),
+        max_cost=float(get_apply_opt(cfg, "preflight_max_cost", "0") or 0),
+        large_rows=int(get_apply_opt(cfg, "large_table_rows", "1000000") or 1000000),
+        clone=get_apply_opt(cfg, "preflight_clone", "off").lower(),
+    )
+    ANALYZE.update(
+        min_rows=int(get_apply_opt(cfg, "analyze_min_rows", "10000") or 0),
+        ratio=float(get_apply_opt(cfg, "analyze_ratio", "0.1") or 0),
+    )
+    LOCK_SAMPLER.update(
+        interval=float(get_apply_opt(cfg, "lock_sampler", "0") or 0),
+        min_elapsed=float(get_apply_opt(cfg, "block_report_min", "1.0") or 1.0),
+    )
+    EXECUTOR.update(
+        default=get_apply_opt(cfg, "executor", "psycopg").lower(),
+        systems={reg["name"]: get_apply_opt(cfg, f"executor_{reg['name']}", "").lower()
+                 for reg in systems.load() if get_apply_opt(cfg, f"executor_{reg['name']}", "")},
+        psql_min_bytes=int(get_apply_opt(cfg, "psql_min_bytes", "0") or 0),
+        psql=get_apply_opt(cfg, "psql_bin", ""),
+        pipeline_batch=max(1, int(get_apply_opt(cfg, "pipeline_batch", "200") or 200)),
+    )
+    for name in (EXECUTOR["default"], *EXECUTOR["systems"].values()):
+        if name not in EXECUTORS:
+            die(f"[apply] executor inválido: {name} (use {', '.join(EXECUTORS)})")
+    try:
+        progress.configure(get_apply_opt(cfg, "progress", "auto"),
+                           float(get_apply_opt(cfg, "progress_interval", "15") or 15))
+    except ValueError as e:
+        die(str(e))
+    if cfg.has_section("snapshots"):
+        import db_snapshots
+        db_snapshots.configure(cfg)
+
+def snapshot_fast_forward(pg, db_cfg: dict, base_dir: Path, label: str):
+    """Restaura snapshot se o alvo estiver muito atrás (ver db_snapshots)."""
+    if "db_snapshots" in sys.modules:
+        sys.modules["db_snapshots"].fast_forward(pg, db_cfg, base_dir, label)
+
+def snapshot_refresh(pg, cfg: ConfigParser, inputs):
+    """Após um run OK, renova os snapshots dos alvos usados (ver db_snapshots)."""
+    if "db_snapshots" not in sys.modules:
+        return
+    for system in dict.fromkeys(item["system"] for item in inputs):
+        test_cfg, dev_cfg = load_db_pair(cfg, system)
+        for db_cfg, tgt in ((test_cfg, "TEST"), (dev_cfg, "DEV")):
+            sys.modules["db_snapshots"].refresh_after_success(pg, db_cfg, f"{system.upper()}/{tgt}")
+
 def get_db_driver():
     """
     Prefere psycopg 3 (psycopg), cai para psycopg2 se necessário.
@@ -78,45 +187,85 @@ def get_db_driver():
 
 def load_db_pair(cfg: ConfigParser, system: str):
     """
-    Lê o par de conexões para um sistema: ('gestor'|'supervisor')
-    Seções:
+    Lê o par de conexões para um sistema registrado (ver systems.py).
+    Seções (padrão):
       gestor     -> db_test_gestor / db_dev_gestor
       supervisor -> db_test_supervisor / db_dev_supervisor
     Retorna tupla (dict_test, dict_dev).
     """
-    sec_test = f"db_test_{system}"
-    sec_dev  = f"db_dev_{system}"
+    reg = systems.by_name(system)
+    sec_test = reg["db_test"]
+    sec_dev  = reg["db_dev"]
     if sec_test not in cfg or sec_dev not in cfg:
         die(f"Seções [{sec_test}] e/ou [{sec_dev}] ausentes em config.ini")
 
     def read_section(sec: str) -> dict:
         s = cfg[sec]
+        # timeouts/orçamento de retry: por seção de base, com padrão em [apply]
+        def opt(key: str, default: str) -> str:
+            return s.get(key, get_apply_opt(cfg, key, default)).strip()
         return dict(
             host=s.get("host", "").strip(),
             port=int(s.get("port", "5432")),
             dbname=s.get("dbname", "").strip(),
             user=s.get("user", "").strip(),
             password=s.get("password", "").strip(),
+            lock_timeout=opt("lock_timeout", ""),
+            statement_timeout=opt("statement_timeout", ""),
+            retry_budget=float(opt("retry_budget", "0") or 0),
         )
 
     return read_section(sec_test), read_section(sec_dev)
 
+# Parâmetros usados em cada conexão aberta (id(conn) -> (driver, cfg)), para
+# abrir conexões auxiliares no mesmo alvo (ex.: índices concorrentes).
+CONN_PARAMS: dict = {}
+
+SESSION_TIMEOUTS = ("lock_timeout", "statement_timeout")
+
+def session_options(cfg: dict) -> str:
+    """lock_timeout/statement_timeout da sessão, no formato 'options' do libpq."""
+    opts = []
+    for key in SESSION_TIMEOUTS:
+        val = str(cfg.get(key, "")).strip()
+        if val:
+            opts.append(f"-c {key}={val.replace(' ', '')}")
+    return " ".join(opts)
+
+def maintenance_cfg(cfg: dict) -> dict:
+    """
+    Parâmetros sem os timeouts de sessão: CREATE INDEX CONCURRENTLY, amostrador
+    de locks e manutenção (snapshots, clone) não devem cair por lock_timeout/
+    statement_timeout pensados para os comandos dos scripts.
+    """
+    return {k: v for k, v in cfg.items() if k not in SESSION_TIMEOUTS}
+
 def connect_db(pg, cfg: dict):
     try:
+        extra = {}
+        if session_options(cfg):
+            extra["options"] = session_options(cfg)
         conn = pg.connect(
             host=cfg["host"], port=cfg["port"],
-            dbname=cfg["dbname"], user=cfg["user"], password=cfg["password"]
+            dbname=cfg["dbname"], user=cfg["user"], password=cfg["password"],
+            **extra
         )
         try:
             conn.autocommit = False
         except Exception:
             pass
+        CONN_PARAMS[id(conn)] = (pg, cfg)
         return conn
     except Exception as e:
         die(f"Falha ao conectar em {cfg['host']}:{cfg['port']}/{cfg['dbname']} - {e}")
 
-# seq de nomes tipo NNNN.0.GXX ou NNNN.0.SXX
-SEQ_RE = re.compile(r'(\d{4})\.0\.[GS][A-Za-z]{2}')
+def close_db(conn):
+    """Fecha uma conexão aberta por connect_db e esquece os parâmetros dela."""
+    CONN_PARAMS.pop(id(conn), None)
+    conn.close()
+
+# seq de nomes tipo NNNN.0.<letra do sistema>XX (ex.: NNNN.0.GXX, NNNN.0.SXX)
+SEQ_RE = re.compile(r'(\d{4})\.0\.[A-Za-z]{3}')
 
 def parse_seq_from_name(name: str) -> int:
     m = SEQ_RE.search(name)
@@ -143,13 +292,25 @@ def get_last_applied_seq(conn):
 
 def list_repo_scripts_for_dir(base_dir: Path):
     """
-    Lista scripts existentes no diretório (Gestor/Supervisor),
-    padrão NNNN.0.[GS]XX.sql
+    Lista scripts existentes no diretório do sistema,
+    padrão NNNN.0.<letra>XX.sql
     Retorna lista de tuplas (seq, path, name) ordenadas por seq.
+    Com [svn] catalog = remote, a lista vem do HEAD do repositório e 'path'
+    aponta para o cache (path@rev), baixado só quando o script for aplicado
+    (ver svn_catalog.ensure_local).
     """
-    pat = re.compile(r'^(\d{4})\.0\.[GS][A-Za-z]{2}\.sql$')
+    pat = re.compile(r'^(\d{4})\.0\.[A-Za-z]{3}\.sql$')
     items = []
-    if base_dir.exists():
+    if svn_catalog.remote():
+        try:
+            entries = svn_catalog.list_remote(base_dir)
+        except RuntimeError as e:
+            die(str(e))
+        for name, rev in entries:
+            m = pat.match(name)
+            if m:
+                items.append((int(m.group(1)), svn_catalog.cache_path(base_dir, name, rev), name))
+    elif base_dir.exists():
         for name in os.listdir(base_dir):
             m = pat.match(name)
             if m:
@@ -167,6 +328,14 @@ def read_text_auto(path: Path) -> str:
             continue
     return path.read_text(encoding="utf-8", errors="replace")
 
+def decode_auto(data: bytes) -> str:
+    for enc in ("cp1252", "utf-8", "latin-1"):
+        try:
+            return data.decode(enc)
+        except UnicodeDecodeError:
+            continue
+    return data.decode("utf-8", errors="replace")
+
 def split_blocks_by_endmark(text: str):
     t = text.replace("\r\n", "\n").replace("\r", "\n")
     if END_MARK in t:
@@ -174,46 +343,826 @@ def split_blocks_by_endmark(text: str):
         return [p for p in parts if p]
     return [t.strip()] if t.strip() else []
 
-def exec_blocks(conn, blocks, label: str):
+# =================== Leitura em streaming (scripts grandes) ===================
+# O catch-up não carrega o arquivo inteiro: lê em pedaços de STREAM_CHUNK
+# caracteres, procura o END_MARK e entrega um bloco por vez ao exec_blocks.
+# A memória fica limitada ao maior bloco, não ao tamanho do script.
+
+STREAM_CHUNK = 1 << 20
+_CP1252_UNDEFINED = re.compile(rb"[\x81\x8d\x8f\x90\x9d]")
+
+def detect_file_encoding(path: Path) -> str:
+    """Mesma escolha de read_text_auto (cp1252, utf-8, latin-1), lendo em pedaços."""
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(STREAM_CHUNK), b""):
+            if _CP1252_UNDEFINED.search(chunk):
+                break
+        else:
+            return "cp1252"
+    dec = codecs.getincrementaldecoder("utf-8")()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(STREAM_CHUNK), b""):
+                dec.decode(chunk)
+        dec.decode(b"", final=True)
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "latin-1"
+
+def iter_file_blocks(path: Path, encoding: str):
+    """
+    Gera os blocos do arquivo (mesmo resultado de split_blocks_by_endmark).
+    O modo texto já normaliza \\r\\n e \\r para \\n, inclusive entre pedaços.
+    """
+    keep = len(END_MARK) - 1
+    parts, carry = [], ""   # carry: fim do pedaço que pode ser início de um END_MARK
+    with open(path, "r", encoding=encoding) as f:
+        for chunk in iter(lambda: f.read(STREAM_CHUNK), ""):
+            data = carry + chunk
+            pos = 0
+            while True:
+                k = data.find(END_MARK, pos)
+                if k < 0:
+                    break
+                parts.append(data[pos:k])
+                block = "".join(parts).strip()
+                parts = []
+                if block:
+                    yield block
+                pos = k + len(END_MARK)
+            cut = max(pos, len(data) - keep)
+            parts.append(data[pos:cut])
+            carry = data[cut:]
+    parts.append(carry)
+    block = "".join(parts).strip()
+    if block:
+        yield block
+
+class FileBlocks:
+    """
+    Blocos de um script lidos sob demanda. Pode ser iterado de novo (o retry
+    por lock relê o arquivo); len() e nbytes refletem a última iteração.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.encoding = None
+        self.count = 0
+        self.nbytes = 0
+
+    def __iter__(self):
+        if self.encoding is None:
+            self.encoding = detect_file_encoding(self.path)
+        self.count = self.nbytes = 0
+        for block in iter_file_blocks(self.path, self.encoding):
+            self.count += 1
+            self.nbytes += len(block)
+            yield block
+
+    def __len__(self):
+        return self.count
+
+# =================== Índices em paralelo (opt-in) ===================
+# Com [apply] concurrent_indexes = N (> 0), blocos CREATE INDEX independentes
+# saem da transação principal e são criados com CREATE INDEX CONCURRENTLY em
+# até N conexões paralelas (autocommit), depois do commit do resto do script.
+# O bloco final com fn_atualiza_script só roda depois que todos os índices
+# ficaram prontos. Atenção: como CONCURRENTLY não roda em transação, uma falha
+# num índice deixa o restante do script já comitado (o índice inválido é
+# removido e o script NÃO é marcado como aplicado).
+
+CONCURRENT_INDEX_WORKERS = 0
+
+CREATE_INDEX_RE = re.compile(
+    r'^(\s*create\s+(unique\s+)?index)\s+(?!concurrently\b)(?:if\s+not\s+exists\s+)?'
+    r'("(?:[^"]|"")+"|[a-z_][a-z0-9_$]*)\s+on\s+(?!only\b)',
+    re.IGNORECASE,
+)
+_IDENT = r'(?:"(?:[^"]|"")+"|[a-z_][a-z0-9_$]*)'
+INDEX_TABLE_RE = re.compile(rf'\s*({_IDENT}(?:\s*\.\s*{_IDENT})?)', re.IGNORECASE)
+
+def _strip_leading_comments(sql: str) -> str:
+    s = sql.lstrip()
+    while True:
+        if s.startswith("--"):
+            nl = s.find("\n")
+            s = "" if nl < 0 else s[nl + 1:].lstrip()
+        elif s.startswith("/*") and "*/" in s:
+            s = s[s.index("*/") + 2:].lstrip()
+        else:
+            return s
+
+def _index_ident(raw: str) -> str:
+    """Nome como o PostgreSQL guarda (sem aspas = minúsculas)."""
+    if raw.startswith('"'):
+        return raw[1:-1].replace('""', '"')
+    return raw.lower()
+
+def plan_concurrent_indexes(blocks):
+    """
+    Separa os blocos em (principais, índices, finais):
+      - índices: lista de (nº do bloco, nome, sql com CONCURRENTLY, tabela como
+        escrita no script) para blocos
+        de um único CREATE INDEX nomeado que nenhum bloco posterior referencia
+        (UNIQUE só se não houver ON CONFLICT depois, que pode depender dele);
+      - finais: blocos com fn_atualiza_script no fim do script, que só rodam
+        depois dos índices.
+    Sem índices elegíveis, devolve (blocks, [], []).
+    """
+    tail = len(blocks)
+    while tail > 0 and "fn_atualiza_script(" in blocks[tail - 1].lower():
+        tail -= 1
+    main, indexes = [], []
+    for i, b in enumerate(blocks[:tail]):
+        body = _strip_leading_comments(b)
+        m = CREATE_INDEX_RE.match(body)
+        single = ";" not in body.rstrip().rstrip(";")
+        if m and single:
+            raw_name = m.group(3)
+            later = [x.lower() for x in blocks[i + 1:]]
+            name_l = _index_ident(raw_name).lower()
+            referenced = any(re.search(rf'(?<![\w$"]){re.escape(name_l)}(?![\w$])', x) for x in later)
+            unique_dep = bool(m.group(2)) and any("on conflict" in x for x in later)
+            table = INDEX_TABLE_RE.match(body, m.end())
+            if not referenced and not unique_dep and table:
+                sql = m.group(1) + " CONCURRENTLY" + body[m.end(1):]
+                indexes.append((i + 1, _index_ident(raw_name), sql.rstrip().rstrip(";"), table.group(1)))
+                continue
+        main.append(b)
+    if not indexes:
+        return blocks, [], []
+    return main, indexes, blocks[tail:]
+
+def _drop_invalid_index(conn, name: str, table: str):
+    """
+    Remove o índice inválido deixado pelo CREATE INDEX CONCURRENTLY que
+    falhou: só o de mesmo nome NA tabela do comando (resolvida pelo
+    search_path da conexão, como o próprio CREATE), nunca um homônimo de
+    outro esquema.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            "select quote_ident(n.nspname) || '.' || quote_ident(c.relname)"
+            "  from pg_index i"
+            "  join pg_class c on c.oid = i.indexrelid"
+            "  join pg_namespace n on n.oid = c.relnamespace"
+            " where not i.indisvalid and c.relname = %s and i.indrelid = to_regclass(%s)",
+            (name, table),
+        )
+        for (qualified,) in cur.fetchall():
+            cur.execute(f"drop index concurrently if exists {qualified}")
+            print(f"[WARN] índice inválido removido: {qualified}")
+
+def _build_index(pg, db_cfg: dict, block_no: int, name: str, sql: str, table: str):
+    """Cria um índice em conexão própria (autocommit, sem timeouts de sessão). Retorna mensagem de erro ou None."""
+    conn = connect_db(pg, maintenance_cfg(db_cfg))
+    try:
+        conn.autocommit = True
+        t0 = time.monotonic()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(sql)
+        except Exception as e:
+            try:
+                _drop_invalid_index(conn, name, table)
+            except Exception as e2:
+                print(f"[WARN] falha limpando índice inválido {name}: {e2}", file=sys.stderr)
+            return f"bloco {block_no} ({name}): {e}"
+        print(f"[OK]   índice {name} (bloco {block_no}) em {time.monotonic() - t0:.1f}s")
+        return None
+    finally:
+        close_db(conn)
+
+def exec_index_builds(conn, indexes, label: str):
+    pg, db_cfg = CONN_PARAMS[id(conn)]
+    workers = min(CONCURRENT_INDEX_WORKERS, len(indexes))
+    print(f"[INFO] {label}: criando {len(indexes)} índice(s) CONCURRENTLY em {workers} conexão(ões)...")
+    t0 = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        errors = [e for e in ex.map(lambda it: _build_index(pg, db_cfg, *it), indexes) if e]
+    if errors:
+        die(f"Falha criando índice(s) em {label} (script não foi marcado como aplicado): " + "; ".join(errors))
+    print(f"[OK] {label}: {len(indexes)} índice(s) criado(s) em {time.monotonic() - t0:.1f}s.")
+
+# =================== Blocos que retornam linhas ===================
+# "select * from sistema.fn_verifica_script(...)" e conferências soltas
+# ("select * from tabela") não são baixadas inteiras para a memória: uma
+# consulta pura vira um cursor no servidor (DECLARE) consumido em lotes de
+# RESULT_FETCH linhas, que só são contadas. Todas as linhas são lidas (funções
+# chamadas no SELECT rodam como antes). Blocos com vários comandos, SELECT INTO
+# ou CTE que altera dados seguem pelo cursor comum.
+
+QUERY_RE = re.compile(r"^(select|with|values|table)\b", re.IGNORECASE)
+QUERY_WRITE_RE = re.compile(r"\b(insert|update|delete|merge|into)\b", re.IGNORECASE)
+_CURSOR_IDS = itertools.count(1)
+PREVIEW_WIDTH = 60
+
+def streamable_query(sql: str):
+    """Corpo do bloco se ele for UMA consulta pura (cabe num DECLARE CURSOR); senão None."""
+    if RESULT_FETCH <= 0:
+        return None
+    body = _strip_leading_comments(sql).rstrip().rstrip(";").rstrip()
+    if not QUERY_RE.match(body) or ";" in body or QUERY_WRITE_RE.search(body):
+        return None
+    return body
+
+def cursor_name() -> str:
+    return f"sync_blk_{os.getpid()}_{next(_CURSOR_IDS)}"
+
+def _cell(value) -> str:
+    text = "NULL" if value is None else str(value).replace("\n", " ")
+    return text if len(text) <= PREVIEW_WIDTH else text[:PREVIEW_WIDTH - 1] + "…"
+
+def preview_row(label: str, block_no: int, n: int, cur, row):
+    """Mostra a n-ésima linha do resultado se ainda couber na prévia ([apply] result_preview)."""
+    if n >= RESULT_PREVIEW:
+        return
+    if n == 0:
+        print(f"[RESULT] {label} bloco {block_no}: " + " | ".join(d[0] for d in cur.description))
+    print("    " + " | ".join(_cell(v) for v in row))
+
+def preview_total(label: str, block_no: int, n: int):
+    if RESULT_PREVIEW > 0 and n > RESULT_PREVIEW:
+        print(f"    ... +{n - RESULT_PREVIEW} linha(s) ({n} no total, bloco {block_no} de {label})")
+
+def run_block(conn, cur, sql: str, label: str, block_no: int) -> int:
+    """Executa um bloco e devolve as linhas afetadas/lidas (sem guardar resultados grandes)."""
+    body = streamable_query(sql)
+    if body is None:
+        cur.execute(sql)
+        if RESULT_PREVIEW > 0 and cur.description:
+            for n, row in enumerate(cur.fetchmany(RESULT_PREVIEW)):
+                preview_row(label, block_no, n, cur, row)
+            preview_total(label, block_no, max(cur.rowcount or 0, 0))
+        return max(cur.rowcount or 0, 0)
+    n = 0
+    with conn.cursor(name=cursor_name()) as scur:
+        scur.itersize = RESULT_FETCH
+        scur.execute(body)
+        for row in scur:
+            preview_row(label, block_no, n, scur, row)
+            n += 1
+    preview_total(label, block_no, n)
+    return n
+
+def exec_blocks(conn, blocks, label: str, kind: str = "", target: str = "", script: str = ""):
     """
     Executa uma lista de blocos em uma única transação.
     Se qualquer bloco falhar, ROLLBACK e aborta.
+    kind/target/script: se informados, a execução vai para o histórico
+    (run_history) com duração, bytes, blocos e linhas afetadas.
+    Retorna {rows, changes?}; no catch-up, changes traz as linhas alteradas
+    por tabela (pg_stat_xact_user_tables) para o auto_analyze.
     """
+    t0 = time.monotonic()
+    stats = {"rows": 0}
+    if kind == "catchup" and ANALYZE["min_rows"] > 0:
+        stats["changes"] = {}  # linhas alteradas por tabela (ver auto_analyze)
+    status = "fail"
+    executor = choose_executor(conn, blocks, target)
     try:
-        with conn.cursor() as cur:
-            for i, b in enumerate(blocks, 1):
-                if not b.strip():
-                    continue
-                cur.execute(b)
-        conn.commit()
-        print(f"[OK] {label}: {len(blocks)} bloco(s) executado(s).")
-    except Exception as e:
-        conn.rollback()
-        die(f"Falha executando {label}: {e}")
+        with progress.script(target or label, script or label, blocks_size(blocks)):
+            _run_executor(conn, blocks, label, stats, executor)
+        status = "ok"
+        return stats
+    finally:
+        if kind:
+            record_exec(kind, target, script, blocks, time.monotonic() - t0, stats["rows"], status)
+
+def _run_executor(conn, blocks, label: str, stats: dict, executor: str):
+    if executor == "psql":
+        _exec_psql(conn, blocks, label, stats)
+        return
+    if CONCURRENT_INDEX_WORKERS > 0 and id(conn) in CONN_PARAMS:
+        blocks = list(blocks)  # o plano precisa ver o script inteiro
+        main, indexes, final = plan_concurrent_indexes(blocks)
+        if indexes:
+            _exec_transaction(conn, main, label, stats, executor)
+            exec_index_builds(conn, indexes, label)
+            if final:
+                _exec_transaction(conn, final, f"{label} (final)", stats, executor)
+            return
+    _exec_transaction(conn, blocks, label, stats, executor)
+
+def record_exec(kind: str, target: str, script: str, blocks, duration_s: float, rows: int, status: str):
+    nbytes = blocks.nbytes if isinstance(blocks, FileBlocks) else sum(len(b) for b in blocks)
+    run_history.record("apply_db_updates", kind, duration_s, status=status,
+                       system=target.split("/")[0], target=target, script=script,
+                       nbytes=nbytes, blocks=len(blocks), rows=rows)
+
+# =================== Contenção de locks ===================
+# lock_timeout (55P03) e deadlock (40P01) são contenção, não erro de SQL: a
+# transação é refeita com backoff exponencial + jitter enquanto couber no
+# retry_budget (segundos) da base. statement_timeout (57014) e os demais
+# erros continuam abortando na hora.
+
+LOCK_SQLSTATES = {"55P03": "lock_timeout", "40P01": "deadlock"}
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY  = 30.0
+
+def error_sqlstate(e) -> str:
+    return getattr(e, "sqlstate", None) or getattr(e, "pgcode", None) or ""
+
+def lock_retry_delay(conn, e, attempt: int, started: float):
+    """Espera antes da próxima tentativa, ou None se o erro não for de lock / estourou o orçamento."""
+    if error_sqlstate(e) not in LOCK_SQLSTATES:
+        return None
+    budget = CONN_PARAMS.get(id(conn), (None, {}))[1].get("retry_budget", 0)
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+    if time.monotonic() - started + delay > budget:
+        return None
+    return delay
+
+def lock_failure_msg(label: str, e, block_no: int, attempt: int, started: float) -> str:
+    if error_sqlstate(e) in LOCK_SQLSTATES:
+        return (f"Falha executando {label}: {LOCK_SQLSTATES[error_sqlstate(e)]} no bloco {block_no} "
+                f"após {attempt} tentativa(s) em {time.monotonic() - started:.0f}s: {e}")
+    if block_no:
+        return f"Falha executando {label}: bloco {block_no}: {e}"
+    return f"Falha executando {label}: {e}"
+
+def start_lock_sampler(conn):
+    """Amostrador de locks/esperas numa 2ª conexão (ver lock_sampler.py), se ligado."""
+    if LOCK_SAMPLER["interval"] <= 0 or id(conn) not in CONN_PARAMS or CONN_PARAMS[id(conn)][0] is None:
+        return None
+    import lock_sampler
+    pg, db_cfg = CONN_PARAMS[id(conn)]
+    return lock_sampler.start(lambda: connect_db(pg, maintenance_cfg(db_cfg)), conn, LOCK_SAMPLER["interval"], close=close_db)
+
+SAMPLERS: dict = {}   # id(conn) -> amostrador compartilhado pelo catch-up da conexão (ver lock_sampling)
+
+@contextmanager
+def lock_sampling(conn):
+    """Um amostrador (uma só 2ª conexão) para todas as transações do catch-up da conexão."""
+    sampler = start_lock_sampler(conn)
+    if sampler is None:
+        yield
+        return
+    SAMPLERS[id(conn)] = sampler
+    try:
+        yield
+    finally:
+        SAMPLERS.pop(id(conn), None)
+        sampler.stop()
+
+def report_lock_samples(sampler, label: str, shared):
+    """Resumo do amostrador ao fim da transação; o compartilhado segue vivo para a próxima."""
+    if sampler is not shared:
+        sampler.stop()
+    sampler.report(label, LOCK_SAMPLER["min_elapsed"])
+    sampler.reset()
+
+def _exec_transaction(conn, blocks, label: str, stats: dict = None, executor: str = "psycopg"):
+    started = time.monotonic()
+    attempt = 0
+    prog = progress.current()
+    while True:
+        attempt += 1
+        rows, i, tb, changes = 0, 0, time.monotonic(), None
+        if prog and attempt > 1:
+            prog.start_script(prog.script, prog.script_bytes)
+        shared = SAMPLERS.get(id(conn))
+        sampler = (shared or start_lock_sampler(conn)) if executor == "psycopg" else None
+        try:
+            with conn.cursor() as cur:
+                if executor == "pipeline":
+                    rows = _run_pipelined(conn, cur, blocks, label)
+                    i = len(blocks)
+                else:
+                    for i, b in enumerate(blocks, 1):
+                        if not b.strip():
+                            continue
+                        if prog:
+                            prog.block(i, len(b))
+                        if sampler:
+                            sampler.enter_block(i)
+                            tb = time.monotonic()
+                        rows += run_block(conn, cur, b, label, i)
+                        if sampler:
+                            sampler.leave_block(i, time.monotonic() - tb)
+                if stats is not None and "changes" in stats:
+                    changes = xact_changes(cur)
+            conn.commit()
+            break
+        except Exception as e:
+            if sampler and i:
+                sampler.leave_block(i, time.monotonic() - tb)
+            i = getattr(e, "block_no", i)
+            conn.rollback()
+            delay = lock_retry_delay(conn, e, attempt, started)
+            if delay is None:
+                die(lock_failure_msg(label, e, i, attempt, started))
+            print(f"[RETRY] {label}: {LOCK_SQLSTATES[error_sqlstate(e)]} no bloco {i}; "
+                  f"tentativa {attempt + 1} em {delay:.1f}s ({time.monotonic() - started:.0f}s gastos).")
+            time.sleep(delay)
+        finally:
+            if sampler:
+                report_lock_samples(sampler, label, shared)
+    if stats is not None:
+        stats["rows"] += rows
+        for key, (changed, live) in (changes or {}).items():
+            stats["changes"][key] = (stats["changes"].get(key, (0, 0))[0] + changed, live)
+    retries = f" após {attempt - 1} retry(s) por lock" if attempt > 1 else ""
+    print(f"[OK] {label}: {len(blocks)} bloco(s) executado(s){retries}.")
+
+# =================== Executores ===================
+# Como os blocos de exec_blocks chegam ao servidor ([apply] executor, por
+# sistema em executor_<sistema>; scripts com psql_min_bytes ou mais vão para
+# o psql):
+#   psycopg  : cursor.execute bloco a bloco (padrão; amostrador de locks, prévia);
+#   pipeline : psycopg 3 em modo pipeline — lotes de pipeline_batch blocos sem
+#              esperar a resposta de cada um (consultas puras saem do lote e
+#              usam o cursor no servidor, como no psycopg);
+#   psql     : o script é enviado em fluxo para
+#              `psql -X --single-transaction -v ON_ERROR_STOP=1 -f -` (conexão
+#              própria, pouca memória/CPU no Python); sem estatísticas por
+#              tabela para o auto_analyze.
+# Em todos, a transação é única, o retry por lock vale igual e a falha é
+# reportada com o número do bloco (entre END OFF COMMAND) que falhou.
+
+EXECUTORS = ("psycopg", "pipeline", "psql")
+_EXECUTOR_WARNED = set()
+
+def _warn_once(key: str, msg: str):
+    if key not in _EXECUTOR_WARNED:
+        _EXECUTOR_WARNED.add(key)
+        print(f"[WARN] {msg}")
+
+def blocks_size(blocks) -> int:
+    if isinstance(blocks, FileBlocks):
+        return blocks.path.stat().st_size
+    return sum(len(b) for b in blocks)
+
+def pipeline_supported(conn) -> bool:
+    if not hasattr(conn, "pipeline"):
+        return False  # psycopg2
+    try:
+        import psycopg
+        return psycopg.Pipeline.is_supported()
+    except Exception:
+        return False
+
+def choose_executor(conn, blocks, target: str = "") -> str:
+    """Executor do script: o do sistema do alvo (ou o padrão), psql acima do limiar de tamanho."""
+    name = EXECUTOR["systems"].get(target.split("/")[0].strip().lower(), EXECUTOR["default"])
+    if name != "psql" and EXECUTOR["psql_min_bytes"] > 0 and blocks_size(blocks) >= EXECUTOR["psql_min_bytes"]:
+        name = "psql"
+    if name == "psql" and CONN_PARAMS.get(id(conn), (None, None))[1] is None:
+        _warn_once("psql", "executor psql precisa dos parâmetros da conexão; usando psycopg.")
+        name = "psycopg"
+    if name == "pipeline" and not pipeline_supported(conn):
+        _warn_once("pipeline", "executor pipeline exige psycopg 3 com libpq >= 14; usando psycopg.")
+        name = "psycopg"
+    return name
+
+def _pipeline_ok(cur) -> bool:
+    from psycopg import pq
+    res = getattr(cur, "pgresult", None)
+    return res is not None and res.status in (pq.ExecStatus.COMMAND_OK, pq.ExecStatus.TUPLES_OK)
+
+def _run_pipelined(conn, cur, blocks, label: str) -> int:
+    """
+    Executa os blocos em lotes no modo pipeline. Numa falha, o bloco culpado
+    é o primeiro do lote sem resultado OK (gravado em e.block_no).
+    """
+    rows, batch = 0, []
+    prog = progress.current()
+
+    def flush():
+        nonlocal rows
+        curs, no = [], 0
+        try:
+            with conn.pipeline():
+                for no, b in batch:
+                    c = conn.cursor()
+                    c.execute(b)
+                    curs.append((no, c))
+        except Exception as e:
+            e.block_no = next((n for n, c in curs if not _pipeline_ok(c)), no)
+            raise
+        finally:
+            rows += sum(max(c.rowcount or 0, 0) for _, c in curs if _pipeline_ok(c))
+            for _, c in curs:
+                c.close()
+            batch.clear()
+
+    for i, b in enumerate(blocks, 1):
+        if not b.strip():
+            continue
+        if prog:
+            prog.block(i, len(b))
+        if streamable_query(b) is not None:
+            if batch:
+                flush()
+            try:
+                rows += run_block(conn, cur, b, label, i)
+            except Exception as e:
+                e.block_no = i
+                raise
+            continue
+        batch.append((i, b))
+        if len(batch) >= EXECUTOR["pipeline_batch"]:
+            flush()
+    if batch:
+        flush()
+    return rows
+
+class PsqlError(Exception):
+    """Erro reportado pelo psql; sqlstate/block_no como nos erros do driver."""
+
+    def __init__(self, msg: str, sqlstate: str = "", block_no: int = 0):
+        super().__init__(msg)
+        self.sqlstate = sqlstate
+        self.block_no = block_no
+
+PSQL_ERROR_RE = re.compile(r"^psql:[^:]*:(\d+): (?:ERROR|FATAL|PANIC):\s+(?:([0-9A-Z]{5}): )?(.*)$")
+PSQL_ROWS_RE = re.compile(r"^(?:INSERT \d+|UPDATE|DELETE|MERGE|COPY) (\d+)$|^\((\d+) rows?\)$")
+
+def psql_command(db_cfg: dict):
+    exe = EXECUTOR["psql"] or shutil.which("psql") or "psql"
+    # sem -q: as tags (INSERT 0 n, UPDATE n, ...) dão as linhas afetadas
+    cmd = [exe, "-X", "--single-transaction", "-v", "ON_ERROR_STOP=1", "-v", "VERBOSITY=verbose",
+           "-P", "pager=off", "-h", db_cfg["host"], "-p", str(db_cfg["port"]), "-U", db_cfg["user"],
+           "-d", db_cfg["dbname"], "-f", "-"]
+    if RESULT_FETCH > 0:
+        cmd[1:1] = ["-v", f"FETCH_COUNT={RESULT_FETCH}"]
+    env = dict(os.environ, PGPASSWORD=db_cfg["password"], PGCLIENTENCODING="UTF8")
+    if session_options(db_cfg):
+        env["PGOPTIONS"] = session_options(db_cfg)
+    return cmd, env
+
+def _psql_once(db_cfg: dict, blocks, label: str) -> int:
+    """Uma tentativa: envia os blocos ao psql e devolve as linhas; PsqlError se falhar."""
+    cmd, env = psql_command(db_cfg)
+    try:
+        proc = subprocess.Popen(cmd, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, text=True, encoding="utf-8", errors="replace")
+    except OSError as e:
+        die(f"{label}: não foi possível executar o psql ({cmd[0]}): {e}")
+    rows, errors = [0], []
+    starts, numbers = [], []   # 1ª linha de cada bloco enviado e o nº do bloco (END OFF COMMAND)
+
+    def drain_out():
+        for line in proc.stdout:
+            m = PSQL_ROWS_RE.match(line.strip())
+            if m:
+                rows[0] += int(m.group(1) or m.group(2))
+
+    def drain_err():
+        for line in proc.stderr:
+            m = PSQL_ERROR_RE.match(line.rstrip("\n"))
+            if m:
+                errors.append((int(m.group(1)), m.group(2) or "", m.group(3)))
+            elif errors and line.strip():
+                errors.append((0, "", line.strip()))  # DETAIL/HINT/LOCATION do erro
+
+    readers = [threading.Thread(target=drain_out, daemon=True), threading.Thread(target=drain_err, daemon=True)]
+    for t in readers:
+        t.start()
+    line_no, prog = 1, progress.current()
+    if prog:
+        prog.start_script(prog.script, prog.script_bytes)
+    try:
+        for i, b in enumerate(blocks, 1):   # mesma numeração dos outros executores
+            if not b.strip():
+                continue
+            if prog:
+                prog.block(i, len(b))  # ritmo de envio (limitado pelo pipe do psql)
+            starts.append(line_no)
+            numbers.append(i)
+            chunk = b + "\n;\n"
+            proc.stdin.write(chunk)
+            line_no += chunk.count("\n")
+        proc.stdin.close()
+    except BrokenPipeError:
+        pass  # psql parou no erro (ON_ERROR_STOP); o motivo vem no stderr
+    code = proc.wait()
+    for t in readers:
+        t.join()
+    if code == 0:
+        return rows[0]
+    if not errors:
+        raise PsqlError(f"psql saiu com código {code}")
+    line, sqlstate, msg = errors[0]
+    detail = " ".join(m for n, _, m in errors[1:] if n == 0 and not m.startswith("LOCATION:"))
+    pos = bisect.bisect_right(starts, line) if line else 0
+    block_no = numbers[pos - 1] if pos else 0
+    raise PsqlError(f"{msg} {detail}".strip(), sqlstate, block_no)
+
+def _exec_psql(conn, blocks, label: str, stats: dict = None):
+    """Executor psql: mesma semântica de _exec_transaction (transação única, retry por lock)."""
+    db_cfg = CONN_PARAMS[id(conn)][1]
+    conn.commit()  # nada pendente na conexão do driver antes da sessão do psql
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            rows = _psql_once(db_cfg, blocks, label)
+            break
+        except PsqlError as e:
+            delay = lock_retry_delay(conn, e, attempt, started)
+            if delay is None:
+                die(lock_failure_msg(label, e, e.block_no, attempt, started))
+            print(f"[RETRY] {label}: {LOCK_SQLSTATES[error_sqlstate(e)]} no bloco {e.block_no}; "
+                  f"tentativa {attempt + 1} em {delay:.1f}s ({time.monotonic() - started:.0f}s gastos).")
+            time.sleep(delay)
+    if stats is not None:
+        stats["rows"] += rows
+    retries = f" após {attempt - 1} retry(s) por lock" if attempt > 1 else ""
+    print(f"[OK] {label}: {len(blocks)} bloco(s) executado(s) via psql{retries}.")
+
+def apply_full_script_file(conn, file_path: Path, target: str = ""):
+    stats = exec_blocks(conn, FileBlocks(file_path), f"{file_path.name}", kind="catchup", target=target,
+                        script=file_path.name)
+    auto_analyze(conn, stats.get("changes"), target, file_path.name)
+
+# =================== ANALYZE automático no catch-up ===================
+# Um script que carrega/reescreve muitos dados deixa as estatísticas do
+# planner velhas para os scripts seguintes (e para o novo script em TEST).
+# Antes do commit de cada script, pg_stat_xact_user_tables diz quantas linhas
+# a transação inseriu/alterou/apagou por tabela; as que passaram de
+# [apply] analyze_min_rows e de analyze_ratio x linhas vivas recebem ANALYZE
+# antes do próximo script. O tempo vai para o histórico (kind 'analyze').
+
+XACT_CHANGES_SQL = """
+select x.schemaname, x.relname, x.n_tup_ins + x.n_tup_upd + x.n_tup_del, coalesce(s.n_live_tup, 0)
+  from pg_stat_xact_user_tables x
+  join pg_stat_user_tables s on s.relid = x.relid
+ where x.n_tup_ins + x.n_tup_upd + x.n_tup_del > 0
+"""
 
-def apply_full_script_file(conn, file_path: Path):
-    text = read_text_auto(file_path)
-    blocks = split_blocks_by_endmark(text)
-    exec_blocks(conn, blocks, f"{file_path.name}")
+def parse_xact_changes(rows) -> dict:
+    return {(r[0], r[1]): (int(r[2]), int(r[3])) for r in rows}
+
+def xact_changes(cur) -> dict:
+    """{(schema, tabela): (linhas alteradas na transação corrente, linhas vivas)}"""
+    cur.execute(XACT_CHANGES_SQL)
+    return parse_xact_changes(cur.fetchall())
+
+def tables_to_analyze(changes: dict, before: dict = None) -> list:
+    """[((schema, tabela), linhas alteradas)] acima do limiar; 'before' desconta um retrato anterior."""
+    out = []
+    for key, (changed, live) in (changes or {}).items():
+        changed -= (before or {}).get(key, (0, 0))[0]
+        if ANALYZE["min_rows"] > 0 and changed >= ANALYZE["min_rows"] and changed >= ANALYZE["ratio"] * live:
+            out.append((key, changed))
+    return out
+
+def analyze_sql(key) -> str:
+    return "analyze " + ".".join('"' + part.replace('"', '""') + '"' for part in key)
+
+def report_analyze(tables, target: str, script: str, duration_s: float):
+    names = ", ".join(f"{k[0]}.{k[1]} ({n})" for k, n in tables)
+    print(f"[ANALYZE] {target.strip()}: {names} após {script} em {duration_s:.1f}s.")
+    run_history.record("apply_db_updates", "analyze", duration_s, system=target.split("/")[0],
+                       target=target, script=script, blocks=len(tables), rows=sum(n for _, n in tables))
+
+def auto_analyze(conn, changes: dict, target: str, script: str, before: dict = None, cur=None):
+    """
+    ANALYZE das tabelas muito alteradas pelo script. Sem 'cur', roda e comita
+    à parte (entre scripts); com 'cur' (catch-up agrupado), roda na transação
+    corrente sob savepoint. Falha de ANALYZE só gera aviso.
+    """
+    tables = tables_to_analyze(changes, before)
+    if not tables:
+        return
+    t0 = time.monotonic()
+    try:
+        if cur is None:
+            with conn.cursor() as c:
+                for key, _ in tables:
+                    c.execute(analyze_sql(key))
+            conn.commit()
+        else:
+            cur.execute("savepoint sp_analyze")
+            for key, _ in tables:
+                cur.execute(analyze_sql(key))
+            cur.execute("release savepoint sp_analyze")
+    except Exception as e:
+        if cur is None:
+            conn.rollback()
+        else:
+            cur.execute("rollback to savepoint sp_analyze")
+        print(f"[WARN] {target.strip()}: ANALYZE após {script} falhou: {e}")
+        return
+    report_analyze(tables, target, script, time.monotonic() - t0)
 
-def apply_full_script_text(conn, text: str, label: str):
-    blocks = split_blocks_by_endmark(text)
-    exec_blocks(conn, blocks, label)
+def fetch_pending(pend):
+    """Catálogo remote: baixa (svn cat) para o cache só os scripts pendentes."""
+    try:
+        svn_catalog.ensure_local(pend)
+    except RuntimeError as e:
+        die(str(e))
 
-def apply_pending_repo_scripts(conn, base_dir: Path, sys_label: str):
+def apply_pending_repo_scripts(conn, base_dir: Path, sys_label: str, only_names=None):
     """
     Atualiza a base executando scripts pendentes do diretório correspondente.
     Usa SEMPRE o último script aplicado consultando a base.
+    only_names: se informado, restringe o catch-up a esses arquivos (usado pelo
+    pipeline para adiantar o que já estava local enquanto o svn atualiza).
     """
     current_seq, current_name = get_last_applied_seq(conn)
     repo = list_repo_scripts_for_dir(base_dir)
+    if only_names is not None:
+        repo = [item for item in repo if item[2] in only_names]
     pend = [item for item in repo if item[0] > current_seq]
     if not pend:
         print(f"[INFO] {sys_label}: Base já está em dia (último={current_name or 'nenhum'}).")
         return
     print(f"[INFO] {sys_label}: Executando {len(pend)} script(s) pendente(s) a partir de {current_seq}...")
-    for seq, path, name in pend:
-        apply_full_script_file(conn, path)
+    fetch_pending(pend)
+    with progress.catchup(sys_label, pend), lock_sampling(conn):
+        if CATCHUP_GROUP <= 1:
+            for seq, path, name in pend:
+                apply_full_script_file(conn, path, target=sys_label)
+            return
+        for i in range(0, len(pend), CATCHUP_GROUP):
+            apply_pending_group(conn, pend[i:i + CATCHUP_GROUP], sys_label)
+
+def apply_pending_group(conn, group, sys_label: str):
+    """
+    Catch-up agrupado ([apply] catchup_group = N): aplica N scripts
+    consecutivos numa única transação, com um SAVEPOINT por script.
+    Se um script falha, volta só até o savepoint dele, comita os anteriores
+    do grupo (já aplicados com sucesso) e aborta apontando o script.
+    Script que pede outro executor (psql por [executor] ou psql_min_bytes,
+    pipeline) fecha o grupo até ali e roda sozinho pelo executor dele.
+    """
+    done = []
+    prog = progress.current()
+    sampler = SAMPLERS.get(id(conn))
+    with conn.cursor() as cur:
+        seen = xact_changes(cur) if ANALYZE["min_rows"] > 0 else None
+        for seq, path, name in group:
+            blocks = FileBlocks(path)
+            if choose_executor(conn, blocks, sys_label) != "psycopg":
+                conn.commit()
+                apply_full_script_file(conn, path, target=sys_label)
+                done.append(name)
+                if seen is not None:
+                    seen = {}   # transação nova: nada alterado ainda
+                continue
+            t0, attempt = time.monotonic(), 0
+            while True:
+                attempt += 1
+                rows, i = 0, 0
+                if prog:
+                    prog.start_script(name, blocks_size(blocks))
+                cur.execute("savepoint sp_catchup")
+                try:
+                    for i, b in enumerate(blocks, 1):
+                        if b.strip():
+                            if prog:
+                                prog.block(i, len(b))
+                            if sampler:
+                                sampler.enter_block(i)
+                                tb = time.monotonic()
+                            rows += run_block(conn, cur, b, f"{name} ({sys_label})", i)
+                            if sampler:
+                                sampler.leave_block(i, time.monotonic() - tb)
+                    cur.execute("release savepoint sp_catchup")
+                    err = None
+                except Exception as e:
+                    err = e
+                    if sampler and i:
+                        sampler.leave_block(i, time.monotonic() - tb)
+                    delay = lock_retry_delay(conn, e, attempt, t0)
+                    if delay is not None:
+                        # contenção: desfaz só este script e tenta de novo
+                        cur.execute("rollback to savepoint sp_catchup")
+                        print(f"[RETRY] {name} ({sys_label}): {LOCK_SQLSTATES[error_sqlstate(e)]} no bloco {i}; "
+                              f"tentativa {attempt + 1} em {delay:.1f}s.")
+                        time.sleep(delay)
+                        continue
+                break
+            if sampler:
+                report_lock_samples(sampler, f"{name} ({sys_label})", sampler)
+            if err is None:
+                record_exec("catchup", sys_label, name, blocks, time.monotonic() - t0, rows, "ok")
+            else:
+                record_exec("catchup", sys_label, name, blocks, time.monotonic() - t0, rows, "fail")
+                try:
+                    cur.execute("rollback to savepoint sp_catchup")
+                    conn.commit()
+                    if done:
+                        print(f"[INFO] {sys_label}: {len(done)} script(s) do grupo mantido(s) ({done[0]} .. {done[-1]}).")
+                except Exception:
+                    conn.rollback()
+                    done = []
+                die(lock_failure_msg(f"{name} ({sys_label})", err, i, attempt, t0))
+            done.append(name)
+            if prog:
+                prog.end_script()
+            print(f"[OK] {name}: {len(blocks)} bloco(s) executado(s).")
+            if seen is not None:
+                now = xact_changes(cur)
+                auto_analyze(conn, now, sys_label, name, before=seen, cur=cur)
+                seen = now
+    conn.commit()
+    print(f"[OK] {sys_label}: commit de {len(done)} script(s) ({done[0]} .. {done[-1]}).")
+
+VERIFICA_RE = re.compile(r"fn_verifica_script\(\s*'([^']+)'\s*\)", re.IGNORECASE)
 
 def extract_script_id_from_text(text: str) -> str:
     """
@@ -221,7 +1170,13 @@ def extract_script_id_from_text(text: str) -> str:
     procurando:  fn_verifica_script('<ID>')
     Retorna o ID sem “.sql”.
     """
-    m = re.search(r"fn_verifica_script\(\s*'([^']+)'\s*\)", text, flags=re.IGNORECASE)
+    return _script_id_from_match(VERIFICA_RE.search(text))
+
+def extract_script_id_from_blocks(blocks) -> str:
+    """Idem, bloco a bloco (para no primeiro fn_verifica_script)."""
+    return _script_id_from_match(next(filter(None, map(VERIFICA_RE.search, blocks)), None))
+
+def _script_id_from_match(m) -> str:
     if not m:
         die("Não foi possível encontrar fn_verifica_script('<ID>') no novo arquivo.")
     script_id = m.group(1).strip()
@@ -230,75 +1185,281 @@ def extract_script_id_from_text(text: str) -> str:
         die(f"ID de script inválido: '{script_id}'. Esperado algo como 'NNNN.0.GXX' ou 'NNNN.0.SXX'.")
     return script_id
 
+def _file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(STREAM_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def load_manifest(key: str, src_path: Path):
+    """
+    Manifesto gravado pelo preprocess (src/.target_<chave>.json, ver systems.input_key).
+    Só é usado se descrever exatamente os bytes do arquivo (tamanho + sha256,
+    lido em pedaços); qualquer divergência devolve None e o arquivo é varrido
+    como antes.
+    """
+    path = THIS_DIR / f".target_{key}.json"
+    try:
+        man = json.loads(path.read_text(encoding="utf-8"))
+        size = src_path.stat().st_size
+    except (OSError, ValueError):
+        return None
+    if (man.get("version") != 1 or man.get("bytes") != size
+            or not SEQ_RE.search(str(man.get("script_id", "")))
+            or man.get("sha256") != _file_sha256(src_path)):
+        return None
+    return man
+
+class ManifestBlocks(FileBlocks):
+    """
+    FileBlocks que lê só os intervalos de bytes do manifesto (sem varrer
+    END_MARKs), um bloco por vez.
+    """
+
+    def __init__(self, path: Path, man: dict):
+        super().__init__(path)
+        self.encoding = man["encoding"]
+        self.ranges = man["blocks"]
+
+    def __iter__(self):
+        self.count = self.nbytes = 0
+        with open(self.path, "rb") as f:
+            for start, stop in self.ranges:
+                f.seek(start)
+                b = f.read(stop - start).decode(self.encoding).replace("\r\n", "\n").replace("\r", "\n").strip()
+                if b:
+                    self.count += 1
+                    self.nbytes += len(b)
+                    yield b
+
+def script_content_hash(blocks) -> str:
+    """
+    sha256 do conteúdo executável do novo script. O comentário de cabeçalho
+    (autor/data/IP) é ignorado: o preprocess o regrava a cada run.
+    """
+    h = hashlib.sha256()
+    for i, b in enumerate(blocks):
+        h.update((_strip_leading_comments(b) if i == 0 else b).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
 def load_new_inputs():
     """
-    Lê os possíveis novos scripts diretamente dos arquivos na RAIZ
-    (gestor.sql e/ou supervisor.sql), sem depender de sidecars.
-    Retorna lista: {system, script_id, content, base_dir}
+    Lê os possíveis novos scripts diretamente dos arquivos de entrada
+    (arquivo da raiz e caixa de entrada de cada sistema, ver systems.inputs).
+    Se o manifesto do preprocess bater com o arquivo, ID e intervalos dos
+    blocos vêm dele; senão, o arquivo é varrido. Os blocos ficam no disco
+    (FileBlocks/ManifestBlocks) e são lidos sob demanda a cada execução.
+    Retorna lista: {system, script_id, blocks, content_hash, base_dir, src_path}
     """
     results = []
-    for t in SYSTEMS:
-        src_path = t["src_path"]
-        if src_path.exists():
-            content = read_text_auto(src_path)  # ANSI/cp1252 preferido
-            script_id = extract_script_id_from_text(content)
-            results.append(dict(system=t["system"], script_id=script_id,
-                                content=content, base_dir=t["base_dir"] ))
+    for reg in systems.load():
+        for src_path in systems.inputs(reg):
+            man = load_manifest(systems.input_key(reg, src_path), src_path)
+            if man:
+                script_id, blocks = man["script_id"], ManifestBlocks(src_path, man)
+            else:
+                blocks = FileBlocks(src_path)  # ANSI/cp1252 preferido (detect_file_encoding)
+                script_id = extract_script_id_from_blocks(blocks)
+            results.append(dict(system=reg["name"], script_id=script_id, blocks=blocks,
+                                content_hash=script_content_hash(blocks), base_dir=reg["scripts_dir"],
+                                src_path=src_path))
     return results
 
+def group_by_system(inputs) -> dict:
+    """{sistema: [scripts em ordem de NNNN]} — lote aplicado em sequência."""
+    groups = {}
+    for item in inputs:
+        groups.setdefault(item["system"], []).append(item)
+    for items in groups.values():
+        items.sort(key=lambda it: parse_seq_from_name(it["script_id"]))
+    return groups
+
 # =================== Pipeline principal ===================
 
-def process_for_system(pg, cfg: ConfigParser, system: str, script_id: str, content: str, base_dir: Path):
-    # Lê par de conexões do sistema
-    test_cfg, dev_cfg = load_db_pair(cfg, system)
+def preflight_enabled() -> bool:
+    return PREFLIGHT["mode"] in ("report", "enforce") or PREFLIGHT["clone"] in ("report", "enforce")
 
-    # Conecta
-    test_conn = connect_db(pg, test_cfg)
-    dev_conn  = connect_db(pg, dev_cfg)
+def new_script_preflight(test_conn, blocks, script_id: str, sys_label: str):
+    """
+    Preflights do novo script antes da execução real em TEST (ver db_preflight.py):
+    clone só-esquema ([apply] preflight_clone) e EXPLAIN de custo ([apply] preflight).
+    """
+    if not preflight_enabled():
+        return
+    import db_preflight
+    label = f"NOVO({script_id})@{sys_label}/TEST"
+    if PREFLIGHT["clone"] in ("report", "enforce"):
+        db_preflight.schema_preflight(test_conn, blocks, label, PREFLIGHT["clone"])
+    if PREFLIGHT["mode"] in ("report", "enforce"):
+        db_preflight.cost_preflight(test_conn, blocks, label, PREFLIGHT["mode"],
+                                    PREFLIGHT["max_cost"], PREFLIGHT["large_rows"])
 
-    sys_label = system.upper()
+# =================== Idempotência (rerun do mesmo conteúdo) ===================
+# Cada novo script aplicado com sucesso grava (alvo, tipo, hash) no histórico
+# local (run_history). Se o post_sync falhar e o run for repetido com o mesmo
+# conteúdo, TEST/DEV não reexecutam; [apply] force = true / APPLY_FORCE=1 força.
 
-    # 1) Trazer TEST e DEV até o último script do diretório do sistema
-    print(f"[{sys_label}][TEST] Verificando e aplicando pendências...")
-    apply_pending_repo_scripts(test_conn, base_dir, f"{sys_label}/TEST")
+def target_dsn(db_cfg: dict) -> str:
+    return f"{db_cfg['host']}:{db_cfg['port']}/{db_cfg['dbname']}"
 
-    print(f"[{sys_label}][DEV ] Verificando e aplicando pendências...")
-    apply_pending_repo_scripts(dev_conn, base_dir, f"{sys_label}/DEV ")
+def already_applied(db_cfg: dict, kind: str, content_hash: str, label: str = "",
+                    script_id: str = "", conn=None) -> bool:
+    """
+    O histórico local diz que este conteúdo já rodou no alvo? Com script_id,
+    só vale se o alvo também tiver o registro em tb_sys_controle_versao (a base
+    pode ter sido restaurada/recriada depois): senão, executa de novo.
+    conn: conexão síncrona já aberta no alvo; sem ela, abre uma só para conferir.
+    """
+    if FORCE_REAPPLY or not content_hash:
+        return False
+    hit = run_history.applied_at(target_dsn(db_cfg), kind, content_hash)
+    if hit and script_id and not version_registered(db_cfg, script_id, conn):
+        print(f"[WARN] {label or target_dsn(db_cfg)}: histórico local diz aplicado em {hit[0]}, mas "
+              f"{script_id} não está em sistema.tb_sys_controle_versao; executando de novo.")
+        return False
+    if hit and label:
+        print(f"[SKIP] {label}: mesmo conteúdo já aplicado em {hit[0]} (run {hit[1]}); "
+              f"use APPLY_FORCE=1 para reexecutar.")
+    return bool(hit)
+
+def version_registered(db_cfg: dict, script_id: str, conn=None) -> bool:
+    """script_id (com ou sem .sql) consta em sistema.tb_sys_controle_versao do alvo?"""
+    own = conn is None
+    if own:
+        conn = connect_db(get_db_driver()[0], maintenance_cfg(db_cfg))
+    try:
+        with conn.cursor() as cur:
+            cur.execute("select 1 from sistema.tb_sys_controle_versao where nm_arquivo in (%s, %s)",
+                        (script_id, f"{script_id}.sql"))
+            found = cur.fetchone() is not None
+        conn.rollback()  # não deixa a conexão "idle in transaction"
+        return found
+    finally:
+        if own:
+            close_db(conn)
 
-    # 2) Executar NOVO script completo em TEST
-    apply_full_script_text(test_conn, content, f"NOVO({script_id})@{sys_label}/TEST")
+def _conn_cfg(conn) -> dict:
+    return CONN_PARAMS.get(id(conn), (None, None))[1]
 
-    # 3) Executar SOMENTE fn_atualiza_script('<ID>') em DEV (sem .sql)
+def apply_new_script_test(test_conn, blocks, script_id: str, sys_label: str, content_hash: str = ""):
+    db_cfg = _conn_cfg(test_conn)
+    label = f"NOVO({script_id})@{sys_label}/TEST"
+    if db_cfg and already_applied(db_cfg, "new", content_hash, label, script_id, test_conn):
+        return
+    new_script_preflight(test_conn, blocks, script_id, sys_label)
+    exec_blocks(test_conn, blocks, label, kind="new", target=f"{sys_label}/TEST", script=script_id)
+    if db_cfg and content_hash:
+        run_history.mark_applied(target_dsn(db_cfg), "new", content_hash, script_id)
+
+def mark_script_dev(dev_conn, script_id: str, sys_label: str, content_hash: str = ""):
+    db_cfg = _conn_cfg(dev_conn)
+    if db_cfg and already_applied(db_cfg, "mark", content_hash, f"{sys_label}/DEV fn_atualiza_script({script_id})",
+                                  script_id, dev_conn):
+        return
     stmt = f"select * from sistema.fn_atualiza_script('{script_id}');"
+    t0 = time.monotonic()
     try:
         with dev_conn.cursor() as cur:
             cur.execute(stmt)
         dev_conn.commit()
+        record_exec("mark", f"{sys_label}/DEV", script_id, [stmt], time.monotonic() - t0, 0, "ok")
         print(f"[OK] {sys_label}/DEV: {script_id} marcado via fn_atualiza_script.")
     except Exception as e:
         dev_conn.rollback()
+        record_exec("mark", f"{sys_label}/DEV", script_id, [stmt], time.monotonic() - t0, 0, "fail")
         die(f"{sys_label}/DEV falhou ao atualizar {script_id} via fn_atualiza_script: {e}")
+    if db_cfg and content_hash:
+        run_history.mark_applied(target_dsn(db_cfg), "mark", content_hash, script_id)
+
+def applied_on_both(test_cfg: dict, dev_cfg: dict, script_id: str, sys_label: str,
+                    content_hash: str = "") -> bool:
+    """Rerun do mesmo conteúdo (ex.: post_sync falhou): nada a fazer nas bases."""
+    if (already_applied(test_cfg, "new", content_hash, script_id=script_id)
+            and already_applied(dev_cfg, "mark", content_hash, script_id=script_id)):
+        print(f"[SKIP] {sys_label}: {script_id} com o mesmo conteúdo já aplicado em TEST e DEV; "
+              f"nada a fazer nas bases (APPLY_FORCE=1 para reexecutar).")
+        return True
+    return False
+
+def apply_on_connections(test_conn, dev_conn, scripts, base_dir: Path, sys_label: str):
+    """
+    Catch-up de TEST/DEV e, para cada novo script (em ordem), execução em TEST
+    e marcação em DEV — tudo sobre as conexões já abertas.
+    scripts: [{script_id, blocks, content_hash}]
+    """
+    # 1) Trazer TEST e DEV até o último script do diretório do sistema
+    print(f"[{sys_label}][TEST] Verificando e aplicando pendências...")
+    apply_pending_repo_scripts(test_conn, base_dir, f"{sys_label}/TEST")
+
+    print(f"[{sys_label}][DEV ] Verificando e aplicando pendências...")
+    apply_pending_repo_scripts(dev_conn, base_dir, f"{sys_label}/DEV ")
+
+    for item in scripts:
+        # 2) Executar NOVO script completo em TEST
+        apply_new_script_test(test_conn, item["blocks"], item["script_id"], sys_label, item["content_hash"])
+
+        # 3) Executar SOMENTE fn_atualiza_script('<ID>') em DEV (sem .sql)
+        mark_script_dev(dev_conn, item["script_id"], sys_label, item["content_hash"])
+
+def process_for_system(pg, cfg: ConfigParser, system: str, scripts, base_dir: Path):
+    """scripts: novos scripts do sistema em ordem (um ou vários, em lote)."""
+    # Lê par de conexões do sistema
+    test_cfg, dev_cfg = load_db_pair(cfg, system)
+
+    sys_label = system.upper()
+
+    scripts = [it for it in scripts
+               if not applied_on_both(test_cfg, dev_cfg, it["script_id"], sys_label, it["content_hash"])]
+    if not scripts:
+        return
+
+    # 0) Base muito atrás: restaura snapshot antes do catch-up (opcional)
+    snapshot_fast_forward(pg, test_cfg, base_dir, f"{sys_label}/TEST")
+    snapshot_fast_forward(pg, dev_cfg,  base_dir, f"{sys_label}/DEV ")
+
+    # Conecta
+    test_conn = connect_db(pg, test_cfg)
+    dev_conn  = connect_db(pg, dev_cfg)
+
+    apply_on_connections(test_conn, dev_conn, scripts, base_dir, sys_label)
 
     # Fecha conexões
-    test_conn.close()
-    dev_conn.close()
+    close_db(test_conn)
+    close_db(dev_conn)
 
 def main():
     cfg = load_cfg()
     pg, ver = get_db_driver()
     print(f"[INFO] Usando driver: {'psycopg3' if ver == 3 else 'psycopg2'}")
 
-    # Carrega os novos scripts diretamente dos arquivos da RAIZ
+    # Carrega os novos scripts diretamente dos arquivos de entrada (raiz/caixa de entrada)
     inputs = load_new_inputs()
     if not inputs:
-        print("[INFO] Nenhum novo arquivo tratado encontrado (gestor.sql/supervisor.sql na raiz).")
+        print(f"[INFO] Nenhum novo arquivo tratado encontrado ({systems.describe_inputs()}).")
         return
 
-    # Processa cada sistema separadamente
-    for item in inputs:
-        process_for_system(pg, cfg, item["system"], item["script_id"], item["content"], item["base_dir"])
+    load_apply_opts(cfg)
+
+    if get_apply_opt(cfg, "engine", "sync").lower() == "async":
+        # Todos os alvos em paralelo (asyncio + psycopg 3 AsyncConnection)
+        import apply_db_async
+        apply_db_async.run_engine(cfg, inputs)
+    else:
+        # Sistemas são independentes (pastas/bases próprias): um thread por sistema
+        groups = group_by_system(inputs)
+        with ThreadPoolExecutor(max_workers=len(groups)) as ex:
+            futs = [ex.submit(process_for_system, pg, cfg, system, items, items[0]["base_dir"])
+                    for system, items in groups.items()]
+            for f in futs:
+                f.result()  # die() em um sistema propaga o SystemExit
+
+    snapshot_refresh(pg, cfg, inputs)
+    run_history.warn_regressions()
 
     print("[OK] apply_db_updates finalizado com sucesso.")
 
 if __name__ == "__main__":
-    main()
+    with profiling.stage("apply_db_updates"), run_history.stage("apply_db_updates"):
+        main()
@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Preflight do NOVO script antes da execução real em TEST.
+
+Custo (EXPLAIN): cada bloco DML (insert/update/delete/merge/with) do novo
+script passa por EXPLAIN (FORMAT JSON, VERBOSE), sem ANALYZE, numa transação
+READ ONLY em TEST. O plano é cruzado com pg_class (linhas estimadas e
+tamanho) para listar o ranking de custo, as linhas estimadas e os seq scans
+em tabelas grandes. Blocos que dependem de objetos criados pelo próprio
+script não podem ser avaliados e aparecem como tal.
+
+Clone só-esquema: o novo script roda antes numa cópia SEM DADOS de TEST
+(<dbname>__preflight no mesmo servidor, criada com pg_dump --schema-only +
+pg_restore, levando só os dados de sistema.tb_sys_controle_versao), numa
+transação desfeita no fim. Erros de sintaxe, objeto inexistente e tipo
+(SQLSTATE classes 42, 0A e 22) aparecem em segundos, antes dos minutos da
+execução real em TEST. Erros que dependem de dados (violação de chave,
+RAISE de função...) não valem no clone e são só listados; se o bloco que
+falhou assim era DDL (create/alter/drop...), os erros seguintes também viram
+aviso (podem ser consequência do objeto que não foi criado). O clone
+é reaproveitado enquanto a impressão digital do esquema (catálogo: tabelas,
+colunas, funções, índices, restrições, gatilhos, tipos, extensões) for igual
+à de TEST após o catch-up — scripts só de dados não o invalidam; só a tabela
+de versão é copiada de novo. Se o esquema mudou, é recriado. Se mesmo recriado
+a impressão digital do clone não bate com a de TEST (erros ignorados pelo
+pg_restore), o par (TEST, clone) fica gravado como base aceita no COMMENT ON
+DATABASE do clone e os runs seguintes comparam com ele. Requer CREATEDB
+e pg_dump/pg_restore (PATH ou [snapshots] bin_dir); falha ao montar o clone só
+gera aviso.
+
+Configuração ([apply] no config.ini ou APPLY_<OPÇÃO>):
+    preflight          = off      ; off | report | enforce
+    preflight_max_cost = 0        ; enforce: aborta se algum bloco passar disso (0 = sem limite)
+    large_table_rows   = 1000000  ; seq scan em tabela com mais linhas que isso é destacado
+    preflight_clone    = off      ; off | report | enforce (aborta antes de TEST em erro do script)
+"""
+
+import re
+import json
+import time
+import tempfile
+import subprocess
+from pathlib import Path
+
+import apply_db_updates as adb
+import db_snapshots as snaps
+
+DML_RE = re.compile(r"^(insert|update|delete|merge|with)\b", re.IGNORECASE)
+DDL_RE = re.compile(r"^(create|alter|drop|comment|grant|revoke|do)\b", re.IGNORECASE)
+TOP_N = 10
+
+
+def _walk(plan, out):
+    out.append(plan)
+    for child in plan.get("Plans", []) or []:
+        _walk(child, out)
+    return out
+
+
+def _table_stats(cur, cache: dict, schema: str, relname: str):
+    """(linhas estimadas, bytes) da relação; sem schema no plano, resolve pelo search_path."""
+    key = (schema, relname)
+    if key not in cache:
+        if schema:
+            cur.execute(
+                "select c.reltuples::bigint, pg_total_relation_size(c.oid)"
+                "  from pg_class c join pg_namespace n on n.oid = c.relnamespace"
+                " where n.nspname = %s and c.relname = %s",
+                (schema, relname),
+            )
+        else:
+            cur.execute(
+                "select c.reltuples::bigint, pg_total_relation_size(c.oid)"
+                "  from pg_class c where c.oid = to_regclass(quote_ident(%s))",
+                (relname,),
+            )
+        row = cur.fetchone()
+        cache[key] = (int(row[0]), int(row[1])) if row else (0, 0)
+    return cache[key]
+
+
+def explain_blocks(conn, blocks, large_rows: int):
+    """
+    Retorna (avaliados, não_avaliados):
+      avaliados: [{bloco, comando, custo, linhas, seq_scans: [(tabela, linhas, bytes)]}]
+      não_avaliados: [(bloco, erro)]
+    Tudo numa transação READ ONLY, desfeita no final.
+    """
+    results, skipped, cache = [], [], {}
+    try:
+        with conn.cursor() as cur:
+            cur.execute("set transaction read only")
+            for i, b in enumerate(blocks, 1):
+                body = adb._strip_leading_comments(b)
+                m = DML_RE.match(body)
+                if not m:
+                    continue
+                cur.execute("savepoint sp_preflight")
+                try:
+                    # VERBOSE: só assim o plano traz o "Schema" de cada relação
+                    cur.execute("explain (format json, verbose) " + body.rstrip().rstrip(";"))
+                    raw = cur.fetchone()[0]
+                except Exception as e:
+                    cur.execute("rollback to savepoint sp_preflight")
+                    skipped.append((i, str(e).strip().splitlines()[0] if str(e).strip() else type(e).__name__))
+                    continue
+                doc = json.loads(raw) if isinstance(raw, str) else raw
+                top = doc[0]["Plan"]
+                scans = []
+                for node in _walk(top, []):
+                    if node.get("Node Type") == "Seq Scan" and node.get("Relation Name"):
+                        schema = node.get("Schema", "")
+                        ntup, nbytes = _table_stats(cur, cache, schema, node["Relation Name"])
+                        if ntup >= large_rows:
+                            scans.append((f"{schema}.{node['Relation Name']}" if schema else node["Relation Name"],
+                                          ntup, nbytes))
+                results.append(dict(bloco=i, comando=m.group(1).upper(), custo=float(top.get("Total Cost", 0)),
+                                    linhas=int(top.get("Plan Rows", 0)), seq_scans=scans))
+    finally:
+        conn.rollback()
+    return results, skipped
+
+
+def cost_preflight(conn, blocks, label: str, mode: str, max_cost: float, large_rows: int):
+    """Imprime o relatório; em modo enforce aborta (die) acima de max_cost."""
+    t0 = time.monotonic()
+    results, skipped = explain_blocks(conn, blocks, large_rows)
+    print(f"[PREFLIGHT] {label}: {len(results)} bloco(s) DML avaliado(s) em {time.monotonic() - t0:.1f}s"
+          + (f", {len(skipped)} não avaliado(s)" if skipped else "") + ".")
+    ranking = sorted(results, key=lambda r: r["custo"], reverse=True)
+    for r in ranking[:TOP_N]:
+        print(f"  bloco {r['bloco']:>5} {r['comando']:<6} custo={r['custo']:>14.0f} linhas_est={r['linhas']:>12}")
+        for tbl, ntup, nbytes in r["seq_scans"]:
+            print(f"      SEQ SCAN em {tbl} (~{ntup} linhas, {nbytes / 1024 / 1024:.0f} MiB)")
+    for i, err in skipped[:TOP_N]:
+        print(f"  bloco {i:>5} não avaliado: {err}")
+    if mode == "enforce" and max_cost > 0:
+        over = [r for r in ranking if r["custo"] > max_cost]
+        if over:
+            adb.die(f"{label}: preflight recusou o script — {len(over)} bloco(s) acima do custo {max_cost:.0f} "
+                    f"(maior: bloco {over[0]['bloco']}, custo {over[0]['custo']:.0f}).")
+
+
+# =================== Clone só-esquema ===================
+
+SCRIPT_ERROR_CLASSES = ("42", "0A", "22")   # sintaxe/objeto/tipo, não suportado, dado literal inválido
+VERSION_TABLE = "sistema.tb_sys_controle_versao"
+
+
+def clone_name(dbname: str) -> str:
+    return f"{dbname}__preflight"
+
+
+def _lit(value: str) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+# Definições (sem dono/ACL: o clone é restaurado com --no-owner --no-privileges)
+# de tudo fora dos esquemas do sistema, em ordem estável; o md5 do conjunto
+# diz se o clone ainda tem o esquema de TEST.
+FINGERPRINT_SQL = """
+with ns as (
+    select oid, nspname from pg_namespace
+     where nspname not in ('pg_catalog', 'information_schema')
+       and nspname not like 'pg\\_toast%' and nspname not like 'pg\\_temp%'
+), defs as (
+    select 'n ' || nspname as d from ns
+    union all
+    select 'r ' || n.nspname || '.' || c.relname || ' ' || c.relkind
+           || coalesce(' ' || case when c.relkind in ('v', 'm') then pg_get_viewdef(c.oid) end, '')
+      from pg_class c join ns n on n.oid = c.relnamespace
+     where c.relkind in ('r', 'p', 'v', 'm', 'S', 'f', 'c')
+    union all
+    select 'a ' || n.nspname || '.' || c.relname || '.' || a.attname || ' '
+           || format_type(a.atttypid, a.atttypmod) || ' ' || a.attnotnull
+           || coalesce(' ' || pg_get_expr(d.adbin, d.adrelid), '')
+      from pg_attribute a
+      join pg_class c on c.oid = a.attrelid
+      join ns n on n.oid = c.relnamespace
+      left join pg_attrdef d on d.adrelid = a.attrelid and d.adnum = a.attnum
+     where a.attnum > 0 and not a.attisdropped and c.relkind in ('r', 'p', 'v', 'm', 'f', 'c')
+    union all
+    select 'i ' || pg_get_indexdef(i.indexrelid)
+      from pg_index i join pg_class c on c.oid = i.indexrelid join ns n on n.oid = c.relnamespace
+    union all
+    select 'c ' || n.nspname || '.' || coalesce(r.relname, t.typname, '') || '.' || k.conname || ' '
+           || pg_get_constraintdef(k.oid)
+      from pg_constraint k join ns n on n.oid = k.connamespace
+      left join pg_class r on r.oid = k.conrelid
+      left join pg_type t on t.oid = k.contypid
+    union all
+    select 'f ' || n.nspname || '.' || p.proname || '(' || pg_get_function_identity_arguments(p.oid) || ') '
+           || md5(pg_get_functiondef(p.oid))
+      from pg_proc p join ns n on n.oid = p.pronamespace
+     where p.prokind in ('f', 'p', 'w')
+    union all
+    select 't ' || pg_get_triggerdef(g.oid)
+      from pg_trigger g join pg_class c on c.oid = g.tgrelid join ns n on n.oid = c.relnamespace
+     where not g.tgisinternal
+    union all
+    select 'y ' || n.nspname || '.' || t.typname || ' ' || t.typtype
+           || coalesce(' ' || (select string_agg(e.enumlabel, ',' order by e.enumsortorder)
+                                 from pg_enum e where e.enumtypid = t.oid), '')
+      from pg_type t join ns n on n.oid = t.typnamespace
+     where t.typtype in ('e', 'd', 'r')
+    union all
+    select 'x ' || extname || ' ' || extversion from pg_extension
+)
+select md5(coalesce(string_agg(d, E'\\n' order by d), '')) from defs
+"""
+
+
+def schema_fingerprint(conn) -> str:
+    """md5 das definições do esquema da base (ver FINGERPRINT_SQL)."""
+    with conn.cursor() as cur:
+        cur.execute(FINGERPRINT_SQL)
+        row = cur.fetchone()
+    conn.rollback()
+    return str(row[0])
+
+
+def _clone_fingerprint(pg, clone_cfg: dict):
+    """Impressão digital do clone, ou None se ele não existir/não responder."""
+    try:
+        conn = pg.connect(host=clone_cfg["host"], port=clone_cfg["port"], dbname=clone_cfg["dbname"],
+                          user=clone_cfg["user"], password=clone_cfg["password"])
+    except Exception:
+        return None
+    try:
+        return schema_fingerprint(conn)
+    except Exception:
+        return None
+    finally:
+        conn.close()
+
+
+BASELINE_TAG = "sync_preflight:"
+
+
+def accepted_baseline(maint, clone: str):
+    """(impressão de TEST, impressão do clone) aceitas no último rebuild, ou None."""
+    with maint.cursor() as cur:
+        cur.execute("select shobj_description(oid, 'pg_database') from pg_database where datname = %s", (clone,))
+        row = cur.fetchone()
+    note = (row[0] or "") if row else ""
+    if not note.startswith(BASELINE_TAG):
+        return None
+    parts = note[len(BASELINE_TAG):].split(":")
+    return tuple(parts) if len(parts) == 2 else None
+
+
+def accept_baseline(maint, clone: str, test_fp: str, clone_fp: str):
+    """Grava o par no COMMENT ON DATABASE do clone (recriar de novo não mudaria o resultado)."""
+    with maint.cursor() as cur:
+        cur.execute(f"comment on database {snaps._qi(clone)} is {_lit(BASELINE_TAG + test_fp + ':' + clone_fp)}")
+
+
+def copy_versions(test_conn, pg, clone_cfg: dict):
+    """Traz as linhas de tb_sys_controle_versao de TEST para o clone (e acerta os seriais)."""
+    with test_conn.cursor() as cur:
+        cur.execute(f"select * from {VERSION_TABLE}")
+        cols = [d[0] for d in cur.description]
+        rows = cur.fetchall()
+    test_conn.rollback()
+    names = ", ".join(snaps._qi(c) for c in cols)
+    conn = adb.connect_db(pg, adb.maintenance_cfg(clone_cfg))
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"delete from {VERSION_TABLE}")
+            if rows:
+                cur.executemany(f"insert into {VERSION_TABLE} ({names}) overriding system value"
+                                f" values ({', '.join(['%s'] * len(cols))})", rows)
+            for c in cols:
+                cur.execute("select pg_get_serial_sequence(%s, %s)", (VERSION_TABLE, c))
+                seq = cur.fetchone()[0]
+                if seq:
+                    cur.execute(f"select setval(%s, coalesce(max({snaps._qi(c)}), 0) + 1, false)"
+                                f"  from {VERSION_TABLE}", (seq,))
+        conn.commit()
+    finally:
+        adb.close_db(conn)
+
+
+def _restore(cmd, db_cfg: dict):
+    """pg_restore tolerando erros ignorados (ex.: COMMENT ON SCHEMA public sem ser dono)."""
+    print("+", " ".join(cmd))
+    res = subprocess.run(cmd, env=snaps._pg_env(db_cfg), text=True,
+                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    out = (res.stdout or "").strip()
+    if res.returncode != 0:
+        if "errors ignored on restore" not in out:
+            raise RuntimeError(out or f"pg_restore saiu com {res.returncode}")
+        print(f"[PREFLIGHT][warn] pg_restore: {out.splitlines()[-1]}")
+
+
+def rebuild_clone(pg, maint, db_cfg: dict, clone: str):
+    """DROP/CREATE do clone (mesma codificação/locale de TEST) + esquema + tabela de versão."""
+    with maint.cursor() as cur:
+        cur.execute("select pg_encoding_to_char(encoding), datcollate, datctype from pg_database"
+                    " where datname = %s", (db_cfg["dbname"],))
+        enc, collate, ctype = cur.fetchone()
+        cur.execute("select pg_terminate_backend(pid) from pg_stat_activity"
+                    " where datname = %s and pid <> pg_backend_pid()", (clone,))
+        cur.execute(f"drop database if exists {snaps._qi(clone)}")
+        cur.execute(f"create database {snaps._qi(clone)} template template0 encoding {_lit(enc)}"
+                    f" lc_collate {_lit(collate)} lc_ctype {_lit(ctype)}")
+    with tempfile.TemporaryDirectory(prefix="sync_preflight_") as tmp:
+        schema, data = Path(tmp) / "schema.dump", Path(tmp) / "versao.dump"
+        dump = [snaps._tool("pg_dump"), *snaps._conn_args(db_cfg), "-Fc"]
+        snaps._run_tool([*dump, "--schema-only", "-f", str(schema), db_cfg["dbname"]], db_cfg)
+        snaps._run_tool([*dump, "--data-only", f"--table={VERSION_TABLE}", "-f", str(data), db_cfg["dbname"]],
+                        db_cfg)
+        for archive in (schema, data):
+            _restore([snaps._tool("pg_restore"), *snaps._conn_args(db_cfg), "--no-owner", "--no-privileges",
+                      "-d", clone, str(archive)], db_cfg)
+
+
+def run_on_clone(pg, clone_cfg: dict, blocks, stop_on_error: bool):
+    """
+    Executa os blocos no clone (uma transação, SAVEPOINT por bloco, ROLLBACK no fim).
+    Retorna (erros_do_script, dependentes_de_dados): [(bloco, sqlstate, mensagem)].
+    Depois de um bloco DDL que falhou por depender de dados, os erros seguintes
+    também contam como dependentes (o objeto dele pode não existir no clone).
+    """
+    errors, data_dep = [], []
+    ddl_failed = False
+    conn = adb.connect_db(pg, clone_cfg)
+    try:
+        with conn.cursor() as cur:
+            for i, b in enumerate(blocks, 1):
+                if not b.strip():
+                    continue
+                cur.execute("savepoint sp_clone")
+                try:
+                    cur.execute(b)
+                    cur.execute("release savepoint sp_clone")
+                except Exception as e:
+                    cur.execute("rollback to savepoint sp_clone")
+                    state = adb.error_sqlstate(e)
+                    msg = str(e).strip().splitlines()[0] if str(e).strip() else type(e).__name__
+                    if state[:2] in SCRIPT_ERROR_CLASSES and not ddl_failed:
+                        errors.append((i, state, msg))
+                        if stop_on_error:
+                            break
+                    else:
+                        data_dep.append((i, state, msg))
+                        ddl_failed = ddl_failed or bool(DDL_RE.match(adb._strip_leading_comments(b)))
+    finally:
+        try:
+            conn.rollback()
+        finally:
+            adb.close_db(conn)
+    return errors, data_dep
+
+
+def schema_preflight(test_conn, blocks, label: str, mode: str):
+    """Roda o novo script no clone só-esquema de TEST; em modo enforce aborta (die) em erro do script."""
+    pg, db_cfg = adb.CONN_PARAMS.get(id(test_conn), (None, None))
+    if pg is None:
+        return
+    t0 = time.monotonic()
+    fingerprint = schema_fingerprint(test_conn)
+    clone = clone_name(db_cfg["dbname"])
+    clone_cfg = dict(db_cfg, dbname=clone)
+    maint = snaps._maint_conn(pg, db_cfg)
+    try:
+        # um run por vez em cada clone (vários desenvolvedores / sistemas)
+        with maint.cursor() as cur:
+            cur.execute("select pg_advisory_lock(hashtext(%s))", (f"sync_preflight:{clone}",))
+        try:
+            current = _clone_fingerprint(pg, clone_cfg)
+            if current is None or (current != fingerprint
+                                   and accepted_baseline(maint, clone) != (fingerprint, current)):
+                print(f"[PREFLIGHT] {label}: esquema de TEST mudou; recriando clone só-esquema {clone}...")
+                rebuild_clone(pg, maint, db_cfg, clone)
+                current = _clone_fingerprint(pg, clone_cfg)
+                if current is None:
+                    raise RuntimeError(f"{clone} não responde depois de recriado")
+                if current != fingerprint:
+                    print(f"[PREFLIGHT][warn] {label}: clone recriado ainda difere do esquema de TEST (erros "
+                          f"ignorados no pg_restore); aceito como base até o esquema de TEST mudar de novo.")
+                    accept_baseline(maint, clone, fingerprint, current)
+            else:
+                copy_versions(test_conn, pg, clone_cfg)
+        except Exception as e:
+            print(f"[PREFLIGHT][warn] {label}: clone só-esquema indisponível ({e}); seguindo sem ele.")
+            return
+        errors, data_dep = run_on_clone(pg, clone_cfg, blocks, stop_on_error=(mode == "enforce"))
+    finally:
+        adb.close_db(maint)
+
+    print(f"[PREFLIGHT] {label}: clone só-esquema em {time.monotonic() - t0:.1f}s — "
+          f"{len(errors)} erro(s) do script, {len(data_dep)} bloco(s) dependente(s) de dados.")
+    for i, state, msg in errors[:TOP_N]:
+        print(f"  bloco {i:>5} ERRO {state}: {msg}")
+    for i, state, msg in data_dep[:TOP_N]:
+        print(f"  bloco {i:>5} não avaliável sem dados ({state or '?'}): {msg}")
+    if errors and mode == "enforce":
+        i, state, msg = errors[0]
+        adb.die(f"{label}: o script falhou no clone só-esquema, bloco {i} ({state}): {msg} "
+                f"— nada foi executado em TEST.")
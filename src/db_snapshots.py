@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Snapshots versionados das bases TEST/DEV para catch-up rápido.
+
+Quando uma base está muito atrás (restaurada de backup antigo, ambiente novo),
+em vez de reexecutar centenas de scripts um a um, o apply_db_updates restaura
+o snapshot mais próximo da versão do repositório e reexecuta só o delta.
+
+Cada snapshot é etiquetado com a versão (nm_arquivo / NNNN) em que a base
+estava e pertence a UMA base (host/porta/dbname) — TEST e DEV nunca trocam
+snapshots entre si. Dois formatos:
+  - dump     : arquivo pg_dump custom (-Fc) em <dir>/<host>_<porta>_<dbname>/<nm_arquivo>.dump,
+               restaurado com pg_restore --jobs N;
+  - template : base <dbname>__snap_<NNNN> no mesmo servidor, restaurada com
+               CREATE DATABASE ... TEMPLATE <snap> (mais rápido, mas exige
+               que ninguém esteja conectado na base de origem ao criar).
+
+A restauração vai para uma base à parte (<dbname>__restore); a base alvo só
+é trocada (ALTER DATABASE ... RENAME) depois que o restore terminou bem. Se
+o pg_restore falhar (disco, versão, role ausente), o alvo fica intacto.
+
+Configuração (config.ini):
+    [snapshots]
+    enabled       = true
+    mode          = dump          ; dump | template
+    dir           = /caminho      ; (dump) padrão: src/.snapshots
+    far_behind    = 100           ; nº de scripts pendentes que dispara a restauração
+    jobs          = 4             ; pg_restore --jobs
+    refresh_every = 200           ; cria snapshot novo após runs OK a cada N scripts
+    keep          = 3             ; snapshots mantidos por base
+    bin_dir       =               ; pasta de pg_dump/pg_restore (opcional)
+
+ATENÇÃO: na troca, as sessões abertas na base alvo são derrubadas e a base
+antiga é apagada.
+"""
+
+import os
+import re
+import shutil
+import subprocess
+import time
+from pathlib import Path
+from configparser import ConfigParser
+
+import apply_db_updates as adb
+
+OPTS: dict = {}
+
+SNAP_NAME_RE = re.compile(r"__snap_(\d{4})$")
+
+RESTORE_SUFFIX = "__restore"   # base onde o snapshot é restaurado antes da troca
+OLD_SUFFIX = "__old"           # base alvo antiga, durante a troca
+
+
+def configure(cfg: ConfigParser):
+    """Lê [snapshots]; sem enabled = true o módulo fica inerte."""
+    OPTS.clear()
+    if not cfg.getboolean("snapshots", "enabled", fallback=False):
+        return
+    sec = cfg["snapshots"]
+    OPTS.update(
+        mode=sec.get("mode", "dump").strip().lower(),
+        dir=Path(sec.get("dir", "").strip() or adb.THIS_DIR / ".snapshots"),
+        far_behind=sec.getint("far_behind", 100),
+        jobs=sec.getint("jobs", 4),
+        refresh_every=sec.getint("refresh_every", 200),
+        keep=sec.getint("keep", 3),
+        bin_dir=sec.get("bin_dir", "").strip(),
+    )
+    if OPTS["mode"] not in ("dump", "template"):
+        adb.die(f"[snapshots] mode inválido: {OPTS['mode']} (use dump ou template)")
+
+
+def enabled() -> bool:
+    return bool(OPTS)
+
+
+# =================== Utilidades ===================
+
+def _qi(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+def _tool(name: str) -> str:
+    if OPTS.get("bin_dir"):
+        return str(Path(OPTS["bin_dir"]) / name)
+    return shutil.which(name) or name
+
+def _pg_env(db_cfg: dict) -> dict:
+    env = os.environ.copy()
+    env["PGPASSWORD"] = db_cfg["password"]
+    return env
+
+def _conn_args(db_cfg: dict):
+    return ["-h", db_cfg["host"], "-p", str(db_cfg["port"]), "-U", db_cfg["user"]]
+
+def _run_tool(cmd, db_cfg: dict):
+    print("+", " ".join(cmd))
+    res = subprocess.run(cmd, env=_pg_env(db_cfg), text=True,
+                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    if res.returncode != 0:
+        raise RuntimeError((res.stdout or "").strip() or f"{cmd[0]} saiu com {res.returncode}")
+
+def _maint_conn(pg, db_cfg: dict):
+    """Conexão autocommit na base de manutenção 'postgres' do mesmo servidor."""
+    conn = adb.connect_db(pg, dict(adb.maintenance_cfg(db_cfg), dbname="postgres"))
+    conn.autocommit = True
+    return conn
+
+def _dump_dir(db_cfg: dict) -> Path:
+    return OPTS["dir"] / f"{db_cfg['host']}_{db_cfg['port']}_{db_cfg['dbname']}"
+
+def _current_version(pg, db_cfg: dict):
+    conn = adb.connect_db(pg, adb.maintenance_cfg(db_cfg))
+    try:
+        return adb.get_last_applied_seq(conn)
+    finally:
+        adb.close_db(conn)
+
+
+# =================== Listagem ===================
+
+def list_snapshots(pg, db_cfg: dict):
+    """Retorna [(seq, referência)] do alvo, ordenado por seq."""
+    snaps = []
+    if OPTS["mode"] == "dump":
+        d = _dump_dir(db_cfg)
+        if d.exists():
+            for p in d.glob("*.dump"):
+                seq = adb.parse_seq_from_name(p.stem)
+                if seq:
+                    snaps.append((seq, p))
+    else:
+        conn = _maint_conn(pg, db_cfg)
+        try:
+            with conn.cursor() as cur:
+                cur.execute("select datname from pg_database where datname like %s",
+                            (db_cfg["dbname"] + "__snap_%",))
+                for (name,) in cur.fetchall():
+                    m = SNAP_NAME_RE.search(name)
+                    if m and name[:m.start()] == db_cfg["dbname"]:
+                        snaps.append((int(m.group(1)), name))
+        finally:
+            adb.close_db(conn)
+    snaps.sort(key=lambda t: t[0])
+    return snaps
+
+
+# =================== Restauração ===================
+
+def _drop_database(cur, name: str):
+    cur.execute(
+        "select pg_terminate_backend(pid) from pg_stat_activity where datname = %s and pid <> pg_backend_pid()",
+        (name,),
+    )
+    cur.execute(f"drop database if exists {_qi(name)}")
+
+def _restore_staging(pg, db_cfg: dict, ref) -> str:
+    """Restaura o snapshot em <dbname>__restore (recriada). Retorna o nome dela."""
+    staging = db_cfg["dbname"] + RESTORE_SUFFIX
+    conn = _maint_conn(pg, db_cfg)
+    try:
+        with conn.cursor() as cur:
+            _drop_database(cur, staging)
+            if OPTS["mode"] == "template":
+                cur.execute(
+                    "select pg_terminate_backend(pid) from pg_stat_activity where datname = %s",
+                    (ref,),
+                )
+                cur.execute(f"create database {_qi(staging)} template {_qi(ref)}")
+            else:
+                cur.execute(f"create database {_qi(staging)}")
+    finally:
+        adb.close_db(conn)
+    if OPTS["mode"] == "dump":
+        try:
+            _run_tool([_tool("pg_restore"), *_conn_args(db_cfg), "--no-owner",
+                       "--jobs", str(max(1, OPTS["jobs"])), "-d", staging, str(ref)], db_cfg)
+        except Exception:
+            _discard_staging(pg, db_cfg, staging)
+            raise
+    return staging
+
+def _discard_staging(pg, db_cfg: dict, staging: str):
+    try:
+        conn = _maint_conn(pg, db_cfg)
+        try:
+            with conn.cursor() as cur:
+                _drop_database(cur, staging)
+        finally:
+            adb.close_db(conn)
+    except (Exception, SystemExit) as e:
+        print(f"[SNAP][warn] não foi possível remover {staging}: {e}")
+
+def _swap_in(pg, db_cfg: dict, staging: str):
+    """
+    Troca a base alvo pela restaurada (renomeações, rápidas). Só aqui as sessões
+    na base alvo são derrubadas; se a segunda renomeação falhar, desfaz a primeira.
+    """
+    dbname = db_cfg["dbname"]
+    old = dbname + OLD_SUFFIX
+    conn = _maint_conn(pg, db_cfg)
+    try:
+        with conn.cursor() as cur:
+            _drop_database(cur, old)
+            cur.execute(
+                "select pg_terminate_backend(pid) from pg_stat_activity where datname = %s and pid <> pg_backend_pid()",
+                (dbname,),
+            )
+            cur.execute(f"alter database {_qi(dbname)} rename to {_qi(old)}")
+            try:
+                cur.execute(f"alter database {_qi(staging)} rename to {_qi(dbname)}")
+            except Exception:
+                cur.execute(f"alter database {_qi(old)} rename to {_qi(dbname)}")
+                raise
+            try:
+                _drop_database(cur, old)
+            except Exception as e:
+                print(f"[SNAP][warn] base anterior mantida como {old}: {e}")
+    finally:
+        adb.close_db(conn)
+
+def restore_snapshot(pg, db_cfg: dict, ref):
+    """Restaura à parte e só então troca a base alvo (o alvo não fica vazio se o restore falhar)."""
+    staging = _restore_staging(pg, db_cfg, ref)
+    try:
+        _swap_in(pg, db_cfg, staging)
+    except Exception:
+        _discard_staging(pg, db_cfg, staging)
+        raise
+
+def fast_forward(pg, db_cfg: dict, base_dir: Path, label: str):
+    """
+    Chamado antes do catch-up: se o alvo estiver a >= far_behind scripts do
+    repositório e houver snapshot entre a versão atual e o HEAD local,
+    restaura o mais recente deles. O catch-up normal aplica o delta depois.
+    """
+    if not enabled():
+        return
+    cur_seq, cur_name = _current_version(pg, db_cfg)
+    repo = adb.list_repo_scripts_for_dir(base_dir)
+    pend = [item for item in repo if item[0] > cur_seq]
+    if len(pend) < OPTS["far_behind"]:
+        return
+    head = repo[-1][0]
+    cands = [s for s in list_snapshots(pg, db_cfg) if cur_seq < s[0] <= head]
+    if not cands:
+        print(f"[SNAP] {label}: {len(pend)} script(s) atrás, mas sem snapshot utilizável; catch-up normal.")
+        return
+    seq, ref = cands[-1]
+    print(f"[SNAP] {label}: {len(pend)} script(s) atrás (último={cur_name or 'nenhum'}); "
+          f"restaurando snapshot {seq:04d} ({OPTS['mode']})...")
+    t0 = time.monotonic()
+    try:
+        restore_snapshot(pg, db_cfg, ref)
+    except Exception as e:
+        adb.die(f"{label}: falha restaurando snapshot {seq:04d}: {e}")
+    new_seq, new_name = _current_version(pg, db_cfg)
+    print(f"[SNAP] {label}: restaurado em {time.monotonic() - t0:.1f}s; base agora em {new_name or new_seq}. "
+          f"Delta: {len([i for i in repo if i[0] > new_seq])} script(s).")
+
+
+# =================== Criação / renovação ===================
+
+def create_snapshot(pg, db_cfg: dict, seq: int, name: str):
+    if OPTS["mode"] == "template":
+        snap = f"{db_cfg['dbname']}__snap_{seq:04d}"
+        conn = _maint_conn(pg, db_cfg)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"create database {_qi(snap)} template {_qi(db_cfg['dbname'])}")
+        finally:
+            adb.close_db(conn)
+        return snap
+    d = _dump_dir(db_cfg)
+    d.mkdir(parents=True, exist_ok=True)
+    stem = re.sub(r"(?i)\.sql$", "", name) or f"{seq:04d}"
+    final = d / f"{stem}.dump"
+    tmp = final.with_suffix(".dump.tmp")
+    _run_tool([_tool("pg_dump"), *_conn_args(db_cfg), "-Fc", "-f", str(tmp), db_cfg["dbname"]], db_cfg)
+    os.replace(tmp, final)
+    return final
+
+def drop_snapshot(pg, db_cfg: dict, ref):
+    if OPTS["mode"] == "template":
+        conn = _maint_conn(pg, db_cfg)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"drop database if exists {_qi(ref)}")
+        finally:
+            adb.close_db(conn)
+    else:
+        Path(ref).unlink(missing_ok=True)
+
+def refresh_after_success(pg, db_cfg: dict, label: str):
+    """
+    Depois de um run OK: cria snapshot novo se não houver nenhum ou se o mais
+    recente estiver refresh_every scripts atrás; mantém só os 'keep' últimos.
+    Falhas aqui só geram aviso (o run em si já deu certo).
+    """
+    if not enabled() or OPTS["refresh_every"] <= 0:
+        return
+    try:
+        seq, name = _current_version(pg, db_cfg)
+        snaps = list_snapshots(pg, db_cfg)
+        if not seq or (snaps and seq - snaps[-1][0] < OPTS["refresh_every"]):
+            return
+        print(f"[SNAP] {label}: criando snapshot da versão {name or seq}...")
+        t0 = time.monotonic()
+        create_snapshot(pg, db_cfg, seq, name)
+        print(f"[SNAP] {label}: snapshot criado em {time.monotonic() - t0:.1f}s.")
+        snaps = list_snapshots(pg, db_cfg)
+        for _, ref in snaps[:max(0, len(snaps) - max(1, OPTS["keep"]))]:
+            drop_snapshot(pg, db_cfg, ref)
+    except SystemExit:
+        print(f"[SNAP][warn] {label}: não foi possível renovar o snapshot (conexão).")
+    except Exception as e:
+        print(f"[SNAP][warn] {label}: não foi possível renovar o snapshot: {e}")
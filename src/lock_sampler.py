@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Amostrador de locks/esperas durante a execução de scripts.
+
+Enquanto exec_blocks roda, uma thread com uma SEGUNDA conexão consulta
+pg_stat_activity/pg_locks da sessão que aplica o script a cada N segundos e
+acumula, por bloco: eventos de espera (wait_event_type/wait_event), tipos de
+lock mantidos, sessões que bloqueiam a nossa e quantas sessões a nossa está
+bloqueando. No fim da transação, cada bloco lento ganha uma linha com esse
+resumo — dá para separar "script lento" de "script esperando o QA". No
+catch-up, o mesmo amostrador (e a mesma conexão) serve a todos os scripts da
+base: reset() entre uma transação e a próxima.
+
+Configuração ([apply] no config.ini ou APPLY_<OPÇÃO>):
+    lock_sampler     = 0     ; intervalo em segundos (0 = desligado)
+    block_report_min = 1.0   ; só reporta blocos que levaram pelo menos isso
+"""
+
+import threading
+from collections import Counter
+
+SAMPLE_SQL = """
+select a.wait_event_type, a.wait_event,
+       pg_blocking_pids(a.pid),
+       (select count(*) from pg_stat_activity b where a.pid = any(pg_blocking_pids(b.pid))),
+       (select array_agg(distinct l.locktype || ':' || l.mode) from pg_locks l
+         where l.pid = a.pid and l.granted)
+  from pg_stat_activity a
+ where a.pid = %s
+"""
+
+BLOCKERS_SQL = """
+select pid, coalesce(usename, ''), coalesce(application_name, ''), left(coalesce(query, ''), 80)
+  from pg_stat_activity
+ where pid = any(%s)
+"""
+
+
+def backend_pid(conn) -> int:
+    info = getattr(conn, "info", None)
+    if info is not None and hasattr(info, "backend_pid"):
+        return info.backend_pid            # psycopg 3
+    return conn.get_backend_pid()          # psycopg2
+
+
+class BlockStats:
+    __slots__ = ("samples", "waits", "held", "blockers", "blocking", "elapsed")
+
+    def __init__(self):
+        self.samples = 0
+        self.waits = Counter()
+        self.held = set()
+        self.blockers = {}
+        self.blocking = 0
+        self.elapsed = 0.0
+
+    def summary(self) -> str:
+        parts = []
+        if self.waits:
+            parts.append("esperas: " + ", ".join(f"{w} x{n}" for w, n in self.waits.most_common(3)))
+        if self.blockers:
+            parts.append("bloqueado por: " + "; ".join(
+                f"pid {pid} ({desc})" for pid, desc in list(self.blockers.items())[:3]))
+        if self.blocking:
+            parts.append(f"bloqueando até {self.blocking} sessão(ões)")
+        if self.held:
+            parts.append("locks: " + ", ".join(sorted(self.held)[:4]))
+        return " | ".join(parts) if parts else f"sem esperas ({self.samples} amostra(s))"
+
+
+class LockSampler(threading.Thread):
+    """Thread de amostragem; use enter_block/leave_block em volta de cada execute."""
+
+    def __init__(self, conn_factory, pid: int, interval: float, close=None):
+        super().__init__(daemon=True)
+        self.conn_factory = conn_factory
+        self.close = close or (lambda conn: conn.close())
+        self.pid = pid
+        self.interval = interval
+        self.block = 0
+        self.blocks = {}
+        self._halt = threading.Event()
+        self._lock = threading.Lock()
+
+    def enter_block(self, n: int):
+        with self._lock:
+            self.block = n
+            self.blocks.setdefault(n, BlockStats())
+
+    def leave_block(self, n: int, elapsed: float):
+        with self._lock:
+            self.blocks.setdefault(n, BlockStats()).elapsed = elapsed
+            self.block = 0
+
+    def reset(self):
+        """Esquece os blocos já reportados (próxima transação na mesma sessão)."""
+        with self._lock:
+            self.block = 0
+            self.blocks = {}
+
+    def stop(self):
+        self._halt.set()
+        self.join(timeout=self.interval + 5)
+
+    def run(self):
+        try:
+            conn = self.conn_factory()
+            conn.autocommit = True
+        except BaseException as e:  # connect_db pode chamar die()
+            print(f"[LOCKS][warn] amostrador desativado: {e}")
+            return
+        try:
+            with conn.cursor() as cur:
+                while not self._halt.wait(self.interval):
+                    self._sample(cur)
+        except Exception as e:
+            print(f"[LOCKS][warn] amostrador interrompido: {e}")
+        finally:
+            self.close(conn)
+
+    def _sample(self, cur):
+        cur.execute(SAMPLE_SQL, (self.pid,))
+        row = cur.fetchone()
+        if not row:
+            return
+        wtype, wevent, blocked_by, blocking, held = row
+        blockers = {}
+        if blocked_by:
+            cur.execute(BLOCKERS_SQL, (list(blocked_by),))
+            for pid, user, app, query in cur.fetchall():
+                blockers[pid] = f"{user}/{app}: {' '.join(query.split())}"
+        with self._lock:
+            if not self.block:
+                return
+            st = self.blocks[self.block]
+            st.samples += 1
+            if wtype:
+                st.waits[f"{wtype}/{wevent}"] += 1
+            st.held.update(held or [])
+            st.blockers.update(blockers)
+            st.blocking = max(st.blocking, int(blocking or 0))
+
+    def report(self, label: str, min_elapsed: float):
+        with self._lock:
+            items = sorted(self.blocks.items())
+        for n, st in items:
+            contended = st.blockers or any(w.startswith("Lock/") for w in st.waits)
+            if st.elapsed >= min_elapsed or contended:
+                print(f"[LOCKS] {label} bloco {n}: {st.elapsed:.1f}s | {st.summary()}")
+
+
+def start(conn_factory, conn, interval: float, close=None):
+    sampler = LockSampler(conn_factory, backend_pid(conn), interval, close)
+    sampler.start()
+    return sampler
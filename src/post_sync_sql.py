@@ -1,14 +1,14 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-Gera os arquivos numerados em src/Scripts/(Gestor|Supervisor),
+Gera os arquivos numerados em src/Scripts/<Sistema> (sistemas em systems.py),
 faz svn add/commit (se a pasta for working copy) e integra com o
 backup criado pelo preprocess_sql.py.
 
 Estrutura esperada:
 <raiz>/
   ├─ config.ini
-  ├─ gestor.sql / supervisor.sql     (arquivos de entrada)
+  ├─ gestor.sql / supervisor.sql / ... (arquivos de entrada)
   └─ src/
      ├─ Scripts/                     (WC do SVN aqui)
      │  ├─ Gestor/
@@ -22,17 +22,25 @@ Estrutura esperada:
 import re
 import os
 import sys
+import json
+import hashlib
+import threading
 import subprocess
+import xml.etree.ElementTree as ET
 from pathlib import Path
 from configparser import ConfigParser
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import profiling
+import run_history
+import systems
+import svn_catalog
 
 # === Caminhos (nova estrutura) ===
 THIS_DIR      = Path(__file__).resolve().parent       # src/
 PROJECT_ROOT  = THIS_DIR.parent                       # raiz do projeto
 SCRIPTS_DIR   = THIS_DIR / "Scripts"                  # src/Scripts
-GESTOR_DIR    = SCRIPTS_DIR / "Gestor"
-SUPERV_DIR    = SCRIPTS_DIR / "Supervisor"
 CONFIG_PATH   = PROJECT_ROOT / "config.ini"           # config.ini na raiz
 
 # Backups gerenciados pelo preprocess_sql.py
@@ -42,12 +50,11 @@ PENDING_FILE  = BACKUP_DIR / "pending.txt"
 # Config svn local (anti-proxy)
 SVN_CFG_DIR   = THIS_DIR / ".svnconfig_noproxy"
 
-# Fontes na RAIZ do projeto
-GESTOR_SRC_PATH     = PROJECT_ROOT / "gestor.sql"
-SUPERVISOR_SRC_PATH = PROJECT_ROOT / "supervisor.sql"
-
 CREATED_FILES: list[Path] = []  # coletar criados para mensagem de commit
 
+# svn add mexe no wc.db da working copy: um sistema por vez
+WC_LOCK = threading.Lock()
+
 # ======================== BACKUP HELPERS ========================
 
 def _clean_cstyle_header_markers(content_bytes: bytes) -> bytes:
@@ -88,6 +95,31 @@ def _clean_cstyle_header_markers(content_bytes: bytes) -> bytes:
     return cleaned.encode("cp1252", errors="replace")
 
 
+def _load_manifest(name: str, content_bytes: bytes):
+    """
+    Manifesto do preprocess (src/.target_<chave>.json, ver systems.input_key), se descrever
+    exatamente estes bytes; senão None (volta ao caminho de decodificar tudo).
+    """
+    try:
+        man = json.loads((THIS_DIR / f".target_{name}.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if (man.get("version") != 1 or man.get("bytes") != len(content_bytes)
+            or man.get("sha256") != hashlib.sha256(content_bytes).hexdigest()):
+        return None
+    return man
+
+def _clean_header_from_manifest(content_bytes: bytes, man: dict) -> bytes:
+    """
+    Mesmo efeito de _clean_cstyle_header_markers para arquivo cp1252, mas só
+    no trecho do cabeçalho indicado pelo manifesto (sem decodificar o resto).
+    """
+    end = man.get("header_end")
+    if end is None:
+        end = len(content_bytes)
+    return content_bytes[:end].replace(b"/*", b" ").replace(b"*/", b" ") + content_bytes[end:]
+
+
 def _load_pending_entries():
     """
     Lê o pending.txt no formato 'orig_abs_path|backup_abs_path' por linha.
@@ -192,8 +224,8 @@ def load_config():
     return username, password, initials
 
 def ensure_dirs():
-    GESTOR_DIR.mkdir(parents=True, exist_ok=True)
-    SUPERV_DIR.mkdir(parents=True, exist_ok=True)
+    for reg in systems.load():
+        reg["scripts_dir"].mkdir(parents=True, exist_ok=True)
 
 def is_wc(path: Path) -> bool:
     # Consideramos a raiz da WC como src/Scripts/
@@ -256,18 +288,139 @@ def next_seq_for(folder: Path, letter: str) -> int:
     """
     pat = re.compile(rf"^(\d{{4}})\.0\.{letter}[A-Za-z]{{2}}\.sql$")
     max_n = 0
-    if folder.exists():
-        for name in os.listdir(folder):
-            m = pat.match(name)
-            if m:
-                n = int(m.group(1))
-                if n > max_n:
-                    max_n = n
+    names = os.listdir(folder) if folder.exists() else []
+    try:
+        names += [n for n, _ in svn_catalog.list_remote(folder)]  # [svn] catalog = remote
+    except RuntimeError as e:
+        print(f"ERRO: {e}", file=sys.stderr)
+        sys.exit(2)
+    for name in names:
+        m = pat.match(name)
+        if m:
+            n = int(m.group(1))
+            if n > max_n:
+                max_n = n
     return max_n + 1
 
-def write_file_bytes(dest_folder: Path, letter: str, initials: str, content_bytes: bytes) -> Path:
-    seq = next_seq_for(dest_folder, letter)
-    fname = f"{seq:04d}.0.{letter}{initials}.sql"
+# ===================== RESERVA DE SEQUÊNCIA =====================
+# Alocação otimista: o preprocess escolhe o NNNN olhando só a pasta local.
+# Aqui conferimos o número contra o HEAD do repositório antes do commit e,
+# depois do commit, verificamos se outro desenvolvedor não levou o mesmo
+# número numa revisão anterior. Se perdemos, o arquivo é renumerado (o ID em
+# fn_verifica_script/fn_atualiza_script é reescrito) e recommitado, sem
+# reexecutar o script nas bases: só o registro em tb_sys_controle_versao de
+# TEST/DEV passa para o ID novo (ver sync_version_rows).
+
+MAX_SEQ_RETRIES = 5
+
+# Renumerações feitas depois da etapa de bases: (pasta do sistema, ID antigo, ID novo)
+RENUMBERED: list = []
+
+VERSION_TABLE = "sistema.tb_sys_controle_versao"
+
+SCRIPT_NAME_RE = re.compile(r"^(\d{4})\.0\.([A-Za-z])([A-Za-z]{2})\.sql$")
+SCRIPT_ID_RE   = re.compile(rb"fn_verifica_script\(\s*'([^']+)'\s*\)", re.IGNORECASE)
+
+# Saídas do `svn commit` que indicam corrida com outro commit (não erro de SQL/rede)
+COMMIT_CONFLICT_RE = re.compile(
+    r"out[- ]of[- ]date|already exists|E155011|E160020|E160024|E160028|E170004",
+    re.IGNORECASE,
+)
+
+def extract_script_id(content_bytes: bytes):
+    """Retorna o ID (sem .sql) de fn_verifica_script('<ID>') ou None."""
+    m = SCRIPT_ID_RE.search(content_bytes)
+    if not m:
+        return None
+    return re.sub(r"\.sql$", "", m.group(1).decode("ascii", errors="replace").strip(), flags=re.IGNORECASE)
+
+def rewrite_script_id(content_bytes: bytes, old_id: str, new_id: str) -> bytes:
+    """
+    Troca o ID nas chamadas fn_verifica_script/fn_atualiza_script.
+    Trabalha direto nos bytes (o ID é ASCII) para não mexer no ANSI do resto.
+    """
+    pat = re.compile(
+        rb"(fn_(?:verifica|atualiza)_script\(\s*')" + re.escape(old_id.encode("ascii"))
+        + rb"(?:\.sql)?('\s*\))",
+        re.IGNORECASE,
+    )
+    return pat.sub(lambda m: m.group(1) + new_id.encode("ascii") + m.group(2), content_bytes)
+
+def svn_list_remote(folder: Path, username: str, password: str, cfg_dir: Path, env: dict):
+    """
+    Lista a pasta no HEAD do repositório (svn list --xml).
+    Retorna lista de (nome, revisão_do_commit) ou None se não conseguir listar.
+    """
+    res = subprocess.run(
+        ["svn", "list", "--xml", "-r", "HEAD", *svn_opts_base(username, password, cfg_dir), str(folder)],
+        text=True, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+    if res.returncode != 0:
+        print(f"⚠️ svn list falhou em {folder.name}: {(res.stderr or '').strip()}")
+        return None
+    try:
+        root = ET.fromstring(res.stdout)
+    except ET.ParseError:
+        return None
+    entries = []
+    for e in root.iter("entry"):
+        commit = e.find("commit")
+        rev = int(commit.get("revision", "0")) if commit is not None else 0
+        entries.append(((e.findtext("name") or "").strip(), rev))
+    return entries
+
+def seq_owners(entries, letter: str) -> dict:
+    """{seq: [(revisão, nome), ...]} para os scripts da letra informada."""
+    owners = {}
+    for name, rev in entries:
+        m = SCRIPT_NAME_RE.match(name)
+        if m and m.group(2).upper() == letter.upper():
+            owners.setdefault(int(m.group(1)), []).append((rev, name))
+    return owners
+
+def reserve_seq(dest_folder: Path, letter: str, wanted: int, own_name: str,
+                username: str, password: str, cfg_dir: Path, env: dict) -> int:
+    """
+    Confirma 'wanted' se ninguém (além de nós) o usa no HEAD remoto nem na pasta
+    local; senão devolve o próximo número livre (maior conhecido + 1).
+    """
+    taken = {}
+    for name in (os.listdir(dest_folder) if dest_folder.exists() else []):
+        m = SCRIPT_NAME_RE.match(name)
+        if m and m.group(2).upper() == letter.upper() and name != own_name:
+            taken[int(m.group(1))] = name
+    if is_wc(SCRIPTS_DIR):
+        entries = svn_list_remote(dest_folder, username, password, cfg_dir, env) or []
+        for seq, items in seq_owners(entries, letter).items():
+            for _, name in items:
+                if name != own_name:
+                    taken[seq] = name
+    if wanted > 0 and wanted not in taken:
+        return wanted
+    return max([wanted, *taken.keys()]) + 1
+
+def renumber_content(content_bytes: bytes, letter: str, initials: str, new_seq: int):
+    """Reescreve o ID do conteúdo para o novo NNNN. Retorna (nome_arquivo, bytes)."""
+    new_id = f"{new_seq:04d}.0.{letter}{initials}"
+    old_id = extract_script_id(content_bytes)
+    if old_id and old_id != new_id:
+        content_bytes = rewrite_script_id(content_bytes, old_id, new_id)
+        print(f"[seq] ID reescrito: {old_id} -> {new_id}")
+    return f"{new_id}.sql", content_bytes
+
+def write_file_bytes(dest_folder: Path, letter: str, initials: str, content_bytes: bytes,
+                     username: str = "", password: str = "", cfg_dir: Path = SVN_CFG_DIR,
+                     env: dict = None, script_id: str = None, min_seq: int = 0) -> Path:
+    # O ID gravado pelo preprocess é a sequência pretendida (alocação otimista);
+    # min_seq mantém a ordem do lote se um script anterior foi renumerado
+    script_id = script_id or extract_script_id(content_bytes)
+    wanted = int(script_id[:4]) if script_id and script_id[:4].isdigit() else next_seq_for(dest_folder, letter)
+    wanted = max(wanted, min_seq)
+    own_name = f"{wanted:04d}.0.{letter}{initials}.sql"
+    seq = reserve_seq(dest_folder, letter, wanted, own_name, username, password, cfg_dir, env)
+    if seq != wanted:
+        print(f"[seq] {wanted:04d} já está em uso no repositório; usando {seq:04d}.")
+    fname, content_bytes = renumber_content(content_bytes, letter, initials, seq)
     out_path = dest_folder / fname
     out_path.write_bytes(content_bytes)  # preserva a codificação original (ANSI cp1252)
     try:
@@ -282,13 +435,209 @@ def svn_add_if_wc(path: Path, username: str, password: str, cfg_dir: Path, env:
     if is_wc(SCRIPTS_DIR):
         # Rodamos dentro de src/Scripts/ para que os caminhos fiquem relativos
         rel = path.relative_to(SCRIPTS_DIR)
-        run(["svn", "add", "--force", str(rel), *svn_opts_base(username, password, cfg_dir)],
-            cwd=SCRIPTS_DIR, check=False, env=env)
+        with WC_LOCK:
+            run(["svn", "add", "--force", str(rel), *svn_opts_base(username, password, cfg_dir)],
+                cwd=SCRIPTS_DIR, check=False, env=env)
+
+def plan_batch_renumber(seqs, taken, must_move=()) -> list:
+    """
+    Novos NNNN para os arquivos de um lote (seqs, na ordem do lote), mantendo
+    a ordem em que TEST/DEV os executaram: quem não colidiu (fora de taken e
+    de must_move) e continua acima do anterior fica com o número; os demais
+    vão para depois de tudo o que é conhecido (maior de taken + 1), sempre
+    acima do anterior.
+    """
+    top = max(taken, default=0)
+    out, floor = [], 0
+    for i, seq in enumerate(seqs):
+        if seq in taken or i in must_move or seq < floor:
+            seq = max(floor, top + 1)
+        out.append(seq)
+        floor = seq + 1
+    return out
+
+def _batch_groups() -> dict:
+    """{(pasta, letra): [índices em CREATED_FILES, na ordem do lote]}"""
+    groups = {}
+    for i, path in enumerate(CREATED_FILES):
+        m = SCRIPT_NAME_RE.match(path.name)
+        if m:
+            groups.setdefault((path.parent, m.group(2).upper()), []).append(i)
+    return groups
+
+def _taken_seqs(folder: Path, letter: str, own_names: set,
+                username: str, password: str, cfg_dir: Path, env: dict) -> set:
+    """NNNN da letra usados por outros arquivos (pasta local + HEAD remoto), fora os do nosso lote."""
+    taken = set()
+    for name in (os.listdir(folder) if folder.exists() else []):
+        m = SCRIPT_NAME_RE.match(name)
+        if m and m.group(2).upper() == letter and name not in own_names:
+            taken.add(int(m.group(1)))
+    entries = svn_list_remote(folder, username, password, cfg_dir, env) or []
+    for seq, items in seq_owners(entries, letter).items():
+        if any(name not in own_names for _, name in items):
+            taken.add(seq)
+    return taken
+
+def renumber_batch(committed: bool, username: str, password: str, cfg_dir: Path, env: dict,
+                   lost=()) -> list:
+    """
+    Renumera os arquivos do lote que colidiram, juntos e na ordem original
+    (ver plan_batch_renumber). committed=False: commit recusado por corrida —
+    desfaz o add dos que mudam, atualiza a WC e adiciona de novo.
+    committed=True: os de 'lost' perderam o número para um commit anterior —
+    svn move. Os movidos vão de trás para frente (N+1 -> N+2 antes de
+    N -> N+1) e entram assim em RENUMBERED, que sync_version_rows segue.
+    Retorna ["antigo -> novo", ...].
+    """
+    opts = svn_opts_base(username, password, cfg_dir)
+    renamed = []
+    for (folder, letter), idxs in _batch_groups().items():
+        paths = [CREATED_FILES[i] for i in idxs]
+        own = {p.name for p in paths}
+        if committed:
+            run(["svn", "update", *opts, str(folder)], env=env, check=False)
+        taken = _taken_seqs(folder, letter, own, username, password, cfg_dir, env)
+        seqs = [int(p.name[:4]) for p in paths]
+        new = plan_batch_renumber(seqs, taken, {k for k, p in enumerate(paths) if p in lost})
+        moves = [(k, seq) for k, (old, seq) in enumerate(zip(seqs, new)) if seq != old]
+        if not moves:
+            continue
+        if not committed:
+            contents = {}
+            for k, _ in moves:
+                path = paths[k]
+                contents[k] = path.read_bytes()
+                run(["svn", "revert", str(path.relative_to(SCRIPTS_DIR)), *opts],
+                    cwd=SCRIPTS_DIR, check=False, env=env)
+                path.unlink()
+            run(["svn", "update", *opts, str(folder)], env=env, check=False)
+        for k, seq in reversed(moves):
+            path = paths[k]
+            m = SCRIPT_NAME_RE.match(path.name)
+            content = contents[k] if not committed else path.read_bytes()
+            fname, content = renumber_content(content, m.group(2), m.group(3), seq)
+            new_path = folder / fname
+            if committed:
+                run(["svn", "move", str(path.relative_to(SCRIPTS_DIR)), str(new_path.relative_to(SCRIPTS_DIR)),
+                     *opts], cwd=SCRIPTS_DIR, env=env)
+                new_path.write_bytes(content)
+            else:
+                new_path.write_bytes(content)
+                svn_add_if_wc(new_path, username, password, cfg_dir, env)
+            CREATED_FILES[idxs[k]] = new_path
+            RENUMBERED.append((folder, path.stem, new_path.stem))
+            renamed.append(f"{path.name} -> {new_path.name}")
+    return renamed
+
+def _version_registered(cur, script_id: str) -> bool:
+    cur.execute(f"select 1 from {VERSION_TABLE} where nm_arquivo in (%s, %s)", (script_id, f"{script_id}.sql"))
+    return cur.fetchone() is not None
+
+def _renumber_version_row(adb, conn, folder: Path, old_id: str, new_id: str, label: str, ours=()):
+    """
+    Troca o registro old_id -> new_id (o script não roda de novo) e aplica, como
+    no catch-up, os scripts que ficaram com os números entre old e new e ainda
+    faltam na base — menos os nossos (ours: IDs novos do lote, cujos registros
+    são trocados à parte). Retorna (registro encontrado?, scripts aplicados).
+    """
+    with conn.cursor() as cur:
+        cur.execute(f"update {VERSION_TABLE} set nm_arquivo = replace(nm_arquivo, %s, %s)"
+                    f" where nm_arquivo in (%s, %s)", (old_id, new_id, old_id, f"{old_id}.sql"))
+        found = cur.rowcount > 0
+    conn.commit()
+    if not found:
+        print(f"[seq] {label}: {old_id} não está registrado na base; nada a acertar.")
+        return False, 0
+    print(f"[seq] {label}: controle de versão {old_id} -> {new_id} (script não reexecutado).")
+
+    old_seq, new_seq = int(old_id[:4]), int(new_id[:4])
+    svn_catalog.invalidate(folder)
+    with conn.cursor() as cur:
+        missing = [item for item in adb.list_repo_scripts_for_dir(folder)
+                   if old_seq <= item[0] < new_seq and item[2][:-4] not in ours
+                   and not _version_registered(cur, item[2][:-4])]
+    conn.rollback()
+    if missing:
+        adb.fetch_pending(missing)
+    for seq, path, name in missing:
+        print(f"[seq] {label}: aplicando {name} (ficou com o número {seq:04d} e falta na base)...")
+        adb.apply_full_script_file(conn, path, target=label)
+    return True, len(missing)
+
+def _restamp_versions(conn, script_ids, label: str):
+    """
+    O catch-up escolhe os pendentes por "seq > último aplicado" (ordem de
+    registro): depois de aplicar scripts de outros, os nossos voltam a ser os
+    últimos registros, em ordem.
+    """
+    with conn.cursor() as cur:
+        for script_id in script_ids:
+            cur.execute(f"delete from {VERSION_TABLE} where nm_arquivo in (%s, %s)", (script_id, f"{script_id}.sql"))
+            cur.execute("select * from sistema.fn_atualiza_script(%s)", (script_id,))
+    conn.commit()
+    print(f"[seq] {label}: {', '.join(script_ids)} registrado(s) de novo como último(s) script(s).")
+
+def sync_version_rows():
+    """
+    Renumeração depois da etapa de bases: TEST e DEV registraram o script com
+    o ID antigo. Sem acertar, o próximo catch-up reexecutaria o arquivo
+    renumerado (e pularia o script de quem levou o número).
+    """
+    if not RENUMBERED:
+        return
+    import apply_db_updates as adb
+    cfg = adb.load_cfg()
+    adb.load_apply_opts(cfg)
+    pg, _ = adb.get_db_driver()
+    for reg in systems.load():
+        renames = [(old, new) for folder, old, new in RENUMBERED if folder == reg["scripts_dir"]]
+        if not renames:
+            continue
+        olds = {old for old, _ in renames}
+        news = {new for _, new in renames}
+        for db_cfg, tgt in zip(adb.load_db_pair(cfg, reg["name"]), ("TEST", "DEV")):
+            label = f"{reg['name'].upper()}/{tgt}"
+            conn = adb.connect_db(pg, db_cfg)
+            try:
+                finals, applied = [], 0
+                # em ordem: lote de trás para frente e cadeias N -> N+1 -> N+2 entre tentativas
+                for old_id, new_id in renames:
+                    found, n = _renumber_version_row(adb, conn, reg["scripts_dir"], old_id, new_id, label, news)
+                    applied += n
+                    if found and new_id not in olds:
+                        finals.append(new_id)
+                if applied and finals:
+                    _restamp_versions(conn, sorted(finals), label)
+            finally:
+                adb.close_db(conn)
+    RENUMBERED.clear()
+
+def lost_reservations(username: str, password: str, cfg_dir: Path, env: dict) -> list[Path]:
+    """
+    Pós-commit: arquivos criados cujo NNNN também foi comitado por outro
+    arquivo numa revisão anterior (quem comitou primeiro fica com o número).
+    """
+    lost = []
+    listings = {}
+    for path in CREATED_FILES:
+        m = SCRIPT_NAME_RE.match(path.name)
+        if not m:
+            continue
+        if path.parent not in listings:
+            listings[path.parent] = svn_list_remote(path.parent, username, password, cfg_dir, env) or []
+        owners = seq_owners(listings[path.parent], m.group(2)).get(int(m.group(1)), [])
+        mine = [rev for rev, name in owners if name == path.name]
+        if mine and any(rev < mine[0] for rev, name in owners if name != path.name):
+            lost.append(path)
+    return lost
 
 def svn_commit_if_changes(username: str, password: str, cfg_dir: Path, env: dict) -> bool:
     """
     Tenta commitar alterações na WC.
     Retorna True se houve commit, False se não era WC ou não havia mudanças.
+    Em corrida de sequência com outro desenvolvedor, renumera e tenta de novo
+    (até MAX_SEQ_RETRIES vezes).
     """
     if not is_wc(SCRIPTS_DIR):
         print("ℹ️ Pasta src/Scripts não é uma working copy SVN. Pulando commit.")
@@ -305,16 +654,45 @@ def svn_commit_if_changes(username: str, password: str, cfg_dir: Path, env: dict
         print("ℹ️ Nenhuma alteração para commitar.")
         return False
 
-    when = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    if CREATED_FILES:
-        nomes = ", ".join(p.name for p in CREATED_FILES)
-        msg = f"auto: adiciona {nomes} ({when})"
-    else:
-        msg = f"auto: pós-sync ({when})"
+    RENUMBERED.clear()
+    renamed = []
+    for attempt in range(1, MAX_SEQ_RETRIES + 1):
+        when = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if renamed:
+            msg = f"auto: renumera {', '.join(renamed)} ({when})"
+        elif CREATED_FILES:
+            nomes = ", ".join(p.name for p in CREATED_FILES)
+            msg = f"auto: adiciona {nomes} ({when})"
+        else:
+            msg = f"auto: pós-sync ({when})"
+
+        res = run(["svn", "commit", "-m", msg, *svn_opts_base(username, password, cfg_dir)],
+                  cwd=SCRIPTS_DIR, env=env, check=False, capture=True)
+        if res.returncode != 0:
+            if not COMMIT_CONFLICT_RE.search(res.stdout or ""):
+                sys.exit(res.returncode)
+            if renamed:
+                # renumeração concorrente: atualiza e volta a conferir
+                run(["svn", "update", *svn_opts_base(username, password, cfg_dir)],
+                    cwd=SCRIPTS_DIR, env=env, check=False)
+                continue
+            print(f"[seq] commit recusado por concorrência (tentativa {attempt}); renumerando...")
+            for item in renumber_batch(False, username, password, cfg_dir, env):
+                print(f"[seq] {item}")
+            continue
+
+        lost = lost_reservations(username, password, cfg_dir, env)
+        if not lost:
+            sync_version_rows()
+            return True
+        print(f"[seq] {', '.join(p.name for p in lost)} já havia(m) sido comitado(s) por outro desenvolvedor; "
+              f"renumerando o lote...")
+        renamed = renumber_batch(True, username, password, cfg_dir, env, lost=set(lost))
+        for item in renamed:
+            print(f"[seq] {item}")
 
-    run(["svn", "commit", "-m", msg, *svn_opts_base(username, password, cfg_dir)],
-        cwd=SCRIPTS_DIR, env=env, check=True, capture=True)
-    return True
+    print(f"ERRO: não foi possível reservar sequência após {MAX_SEQ_RETRIES} tentativas.", file=sys.stderr)
+    sys.exit(1)
 
 def delete_sources(paths):
     for p in paths:
@@ -328,19 +706,28 @@ def delete_sources(paths):
 
 # ============================== MAIN ==============================
 
-def process_role(src_path: Path, dest_folder: Path, letter: str, initials: str,
-                 username: str, password: str, cfg_dir: Path, env: dict):
-    if not src_path.exists():
-        return  # nada a fazer
-
-    # LEITURA EM BINÁRIO para preservar ANSI (cp1252)
-    content_bytes = src_path.read_bytes()
-
-    # LIMPA APENAS OS MARCADORES C-STYLE DO CABEÇALHO 
-    content_bytes = _clean_cstyle_header_markers(content_bytes)
+def process_role(reg: dict, initials: str, username: str, password: str, cfg_dir: Path, env: dict):
+    """reg: sistema registrado (systems.load()); cria um arquivo por entrada, em ordem."""
+    dest_folder, letter = reg["scripts_dir"], reg["letter"]
+    floor = 0
+    for src_path in systems.inputs(reg):
+        # LEITURA EM BINÁRIO para preservar ANSI (cp1252)
+        content_bytes = src_path.read_bytes()
+
+        # LIMPA APENAS OS MARCADORES C-STYLE DO CABEÇALHO
+        # (com manifesto válido em cp1252, só o cabeçalho é tocado e o ID vem dele)
+        man = _load_manifest(systems.input_key(reg, src_path), content_bytes)
+        script_id = None
+        if man and man.get("encoding") == "cp1252":
+            content_bytes = _clean_header_from_manifest(content_bytes, man)
+            script_id = man.get("script_id")
+        else:
+            content_bytes = _clean_cstyle_header_markers(content_bytes)
 
-    created = write_file_bytes(dest_folder, letter, initials, content_bytes)
-    svn_add_if_wc(created, username, password, cfg_dir, env)
+        created = write_file_bytes(dest_folder, letter, initials, content_bytes,
+                                   username, password, cfg_dir, env, script_id=script_id, min_seq=floor)
+        svn_add_if_wc(created, username, password, cfg_dir, env)
+        floor = int(created.name[:4]) + 1
 
 def main():
     username, password, initials = load_config()
@@ -349,25 +736,29 @@ def main():
     cfg_dir = make_no_proxy_config_dir()
     env = clean_proxy_env()
 
-    # Registra fontes existentes na RAIZ para decidir o que fazer no final
-    root_sources = []
-    if GESTOR_SRC_PATH.exists(): root_sources.append(GESTOR_SRC_PATH)
-    if SUPERVISOR_SRC_PATH.exists(): root_sources.append(SUPERVISOR_SRC_PATH)
+    # Registra as entradas existentes (raiz e caixas de entrada) para decidir
+    # o que fazer no final: o lote inteiro vai num único commit
+    present = systems.present()
+    root_sources = [src for reg in present for src in systems.inputs(reg)]
 
-    # Cria arquivos numerados (se houver fontes)
-    process_role(GESTOR_SRC_PATH,     GESTOR_DIR, "G", initials, username, password, cfg_dir, env)
-    process_role(SUPERVISOR_SRC_PATH, SUPERV_DIR, "S", initials, username, password, cfg_dir, env)
+    # Cria arquivos numerados (se houver fontes); a reserva do NNNN consulta
+    # o HEAD remoto, então os sistemas rodam em paralelo
+    if present:
+        with ThreadPoolExecutor(max_workers=len(present)) as ex:
+            futs = [ex.submit(process_role, reg, initials, username, password, cfg_dir, env) for reg in present]
+            for f in futs:
+                f.result()
 
     # Tenta o commit
     committed = svn_commit_if_changes(username, password, cfg_dir, env)
 
     if committed:
-        # Sucesso: apagar fontes da raiz E limpar backups
+        # Sucesso: apagar as entradas (raiz/caixa de entrada) E limpar backups
         delete_sources(root_sources)
         for src in root_sources:
             clear_backup_record(src)
     else:
-        # Não comitou (não era WC ou não havia mudanças): restaura fontes originais da raiz
+        # Não comitou (não era WC ou não havia mudanças): restaura as entradas originais
         for src in root_sources:
             restored = restore_backup(src)
             if not restored:
@@ -376,4 +767,5 @@ def main():
     print("🏁 pós-sync finalizado.")
 
 if __name__ == "__main__":
-    main()
+    with profiling.stage("post_sync_sql"), run_history.stage("post_sync_sql"):
+        main()
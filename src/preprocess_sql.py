@@ -1,17 +1,22 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import os, re, sys, socket, subprocess, shutil
+import io, os, re, sys, json, codecs, socket, hashlib, threading, subprocess, shutil
 from pathlib import Path
 from datetime import datetime
 from configparser import ConfigParser
+from array import array
 from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+
+import profiling
+import run_history
+import systems
+import svn_catalog
 
 # ================== Caminhos (projeto reorganizado) ==================
 THIS_DIR      = Path(__file__).resolve().parent     # src/
 PROJECT_ROOT  = THIS_DIR.parent                     # raiz do repo
 SCRIPTS_DIR   = THIS_DIR / "Scripts"                # src/Scripts
-GESTOR_DIR    = SCRIPTS_DIR / "Gestor"
-SUPERV_DIR    = SCRIPTS_DIR / "Supervisor"
 CONFIG_PATH   = PROJECT_ROOT / "config.ini"         # config.ini na raiz
 
 END_MARK        = "---------- END OFF COMMAND ----------"
@@ -20,20 +25,32 @@ TARGET_ENCODING = "cp1252"  # "ANSI" no Windows
 # --- área de backup (mantém compatibilidade com post_sync_sql.py) ---
 BACKUP_DIR   = THIS_DIR / ".preprocess_backup"      # src/.preprocess_backup
 PENDING_FILE = BACKUP_DIR / "pending.txt"
+_PENDING_LOCK = threading.Lock()   # sistemas são tratados em paralelo
+
+# --- manifesto do arquivo tratado (lido por apply_db_updates e post_sync_sql) ---
+MANIFEST_VERSION = 1
+STREAM_CHUNK = 1 << 20   # leitura em pedaços (manifesto de arquivo já tratado)
+HEAD_SLACK   = 256       # bytes lidos depois de header_end para achar o ID (refresh_script_id)
+_ID_RE = re.compile(rb"fn_verifica_script\(\s*'(\d{4})\.0\.([A-Za-z]{3})(?:\.sql)?'\s*\)", re.IGNORECASE)
 
 # =========================== Backups ================================
 
 def make_backup(src: Path) -> Path:
     """
-    Copia os bytes originais do arquivo (na raiz) para src/.preprocess_backup
-    e registra o par (orig|backup) em pending.txt para possível restauração.
+    Copia os bytes originais do arquivo (raiz ou caixa de entrada) para
+    src/.preprocess_backup e registra o par (orig|backup) em pending.txt para
+    possível restauração.
     """
     BACKUP_DIR.mkdir(exist_ok=True)
     stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
-    bkp = BACKUP_DIR / f"{src.name}.bak-{stamp}"
-    shutil.copy2(src, bkp)  # preserva bytes/encoding original
-    with PENDING_FILE.open("a", encoding="utf-8") as f:
-        f.write(f"{src.resolve()}|{bkp.resolve()}\n")
+    with _PENDING_LOCK:
+        # lote: arquivos de mesmo nome em caixas de entrada diferentes
+        bkp, n = BACKUP_DIR / f"{src.name}.bak-{stamp}", 1
+        while bkp.exists():
+            bkp, n = BACKUP_DIR / f"{src.name}.bak-{stamp}-{n}", n + 1
+        shutil.copy2(src, bkp)  # preserva bytes/encoding original
+        with PENDING_FILE.open("a", encoding="utf-8") as f:
+            f.write(f"{src.resolve()}|{bkp.resolve()}\n")
     print(f"[backup] {src.name} -> {bkp.name}")
     return bkp
 
@@ -107,24 +124,25 @@ def get_local_ip():
     return "0.0.0.0"
 
 def detect_system_and_letter(src: Path):
-    name = src.name.lower()
-    if name == "gestor.sql":
-        return "Gestor", "G", GESTOR_DIR
-    if name == "supervisor.sql":
-        return "Supervisor", "S", SUPERV_DIR
-    print(f"ERRO: arquivo não suportado: {src.name} (use gestor.sql ou supervisor.sql)", file=sys.stderr)
-    sys.exit(2)
+    # sistemas vêm do registro ([systems] no config.ini, ver systems.py)
+    s = systems.for_input(src)
+    return s["label"], s["letter"], s["scripts_dir"]
 
 def next_seq_for(folder: Path, letter: str) -> int:
     pat = re.compile(rf"^(\d{{4}})\.0\.{letter}[A-Za-z]{{2}}\.sql$")
     max_n = 0
-    if folder.exists():
-        for name in os.listdir(folder):
-            m = pat.match(name)
-            if m:
-                n = int(m.group(1))
-                if n > max_n:
-                    max_n = n
+    names = os.listdir(folder) if folder.exists() else []
+    try:
+        names += [n for n, _ in svn_catalog.list_remote(folder)]  # [svn] catalog = remote
+    except RuntimeError as e:
+        print(f"ERRO: {e}", file=sys.stderr)
+        sys.exit(2)
+    for name in names:
+        m = pat.match(name)
+        if m:
+            n = int(m.group(1))
+            if n > max_n:
+                max_n = n
     return max_n + 1
 
 def already_processed(txt: str) -> bool:
@@ -150,23 +168,31 @@ def split_sql(text: str):
       - respeita strings, comments, dollar-quoted ($$ ... $$ / $tag$ ... $tag$)
       - considera bloco DO $$...$$ como um comando mesmo sem ';' ao final
       - não retorna statements vazios
+    Não copia os comandos: retorna (texto, spans), onde texto é a entrada com
+    quebras de linha normalizadas e spans é um array('Q') com pares
+    [início, fim) de cada comando já sem os espaços das pontas (o strip()).
     """
     DO_OPEN_RE = re.compile(r'(?is)\bdo\s+(\$[a-zA-Z0-9_]*\$|\$\$)')
     text = text.replace("\r\n", "\n").replace("\r", "\n")
     n = len(text)
     i = 0
 
-    stmts, buf = [], []
+    spans = array("Q")
+    start = 0               # início do comando corrente
     in_line_comment = in_block_comment = in_single = in_double = False
     dq_tag = None           # $tag$ atual (se dentro de dollar-quote)
     do_closing_tag = None   # se estamos num DO $tag$..., guarda $tag$ p/ fechar
 
-    def flush():
-        nonlocal buf
-        stmt = "".join(buf).strip()
-        if stmt:
-            stmts.append(stmt)
-        buf = []
+    def flush(end):
+        nonlocal start
+        s, e = start, end
+        while s < e and text[s].isspace():
+            s += 1
+        while e > s and text[e - 1].isspace():
+            e -= 1
+        if e > s:
+            spans.append(s); spans.append(e)
+        start = end
 
     def starts_dollar_tag(pos):
         if text[pos] != '$': return None
@@ -185,7 +211,6 @@ def split_sql(text: str):
 
         # Comentário de linha
         if in_line_comment:
-            buf.append(c)
             if c == '\n':
                 in_line_comment = False
             i += 1
@@ -193,22 +218,19 @@ def split_sql(text: str):
 
         # Comentário em bloco
         if in_block_comment:
-            buf.append(c)
             if c == '*' and c2 == '/':
-                buf.append(c2); i += 2; in_block_comment = False
+                i += 2; in_block_comment = False
             else:
                 i += 1
             continue
 
         # Dentro de dollar-quote
         if dq_tag:
-            buf.append(c)
             if c == '$' and text[i:i+len(dq_tag)] == dq_tag:
-                buf.extend(list(dq_tag[1:]))  # já adicionou 1 '$'
                 i += len(dq_tag) - 1
                 if do_closing_tag == dq_tag:  # fecha DO $$...$$ mesmo sem ';'
                     do_closing_tag = None
-                    flush()
+                    flush(i + 1)
                 dq_tag = None
             i += 1
             continue
@@ -216,167 +238,395 @@ def split_sql(text: str):
         # Fora de strings/quotes/comments: detectar início de comentários
         if not in_single and not in_double:
             if c == '-' and c2 == '--':
-                buf.append(c); buf.append(c2); i += 2; in_line_comment = True; continue
+                i += 2; in_line_comment = True; continue
             if c == '/' and c2 == '*':
-                buf.append(c); buf.append(c2); i += 2; in_block_comment = True; continue
+                i += 2; in_block_comment = True; continue
 
         # Início de dollar-quote?
         if not in_single and not in_double and c == '$':
             tag = starts_dollar_tag(i)
             if tag:
                 # heurística DO ...
-                back = "".join(buf[-50:]).lower()
+                back = text[max(start, i - 50):i].lower()
                 if re.search(r'(?:^|\W)do\s*$', back):
                     do_closing_tag = tag
                 dq_tag = tag
-                buf.extend(list(tag)); i += len(tag); continue
+                i += len(tag); continue
 
         # Strings
         if not in_double and c == "'":
             in_single = not in_single
-            buf.append(c); i += 1
+            i += 1
             while in_single and i < n:
                 ch = text[i]
-                buf.append(ch); i += 1
+                i += 1
                 if ch == "'":
                     if i < n and text[i] == "'":  # escape ''
-                        buf.append(text[i]); i += 1
+                        i += 1
                     else:
                         in_single = False
             continue
 
         if not in_single and c == '"':
             in_double = not in_double
-            buf.append(c); i += 1
+            i += 1
             continue
 
         # Fim de statement por ';'
         if c == ';' and not (in_single or in_double or in_line_comment or in_block_comment or dq_tag):
-            buf.append(c)
-            flush()
+            flush(i + 1)
             i += 1
             continue
 
-        buf.append(c)
         i += 1
 
     # resto
-    tail = "".join(buf).strip()
-    if tail:
-        stmts.append(tail)
-
-    # Remove statements vazios
-    return [s for s in (st.strip() for st in stmts) if s]
+    flush(n)
+    return text, spans
 
 # =============== GERADOR (sem duplicar separadores) ===============
 
-def build_output(script_id: str, final_name_with_ext: str, sistema: str, author: str, stmts: list[str]):
+_MARK_RUN_RE   = re.compile(rf"(?:{re.escape(END_MARK)}\s*){{2,}}")
+_MARK_LEAD_RE  = re.compile(rf"^(?:{re.escape(END_MARK)}\s*)+")
+_MARK_TRAIL_RE = re.compile(rf"(?:{re.escape(END_MARK)}\s*)+$")
+
+def _stmt_with_marks(stmt: str):
+    """
+    Comando que já traz END_MARKs (arquivo com separadores colados à mão):
+    as marcas das pontas se fundem com os separadores gerados e as repetidas
+    no meio viram uma só — o mesmo que o colapso do arquivo inteiro fazia.
+    Retorna (texto, termina_em_marca).
+    """
+    stmt = _MARK_LEAD_RE.sub("", stmt)
+    m = _MARK_TRAIL_RE.search(stmt)
+    if m:
+        stmt = stmt[:m.start()]
+    return _MARK_RUN_RE.sub(END_MARK + "\n\n", stmt), bool(m)
+
+def build_output(out, script_id: str, final_name_with_ext: str, sistema: str, author: str,
+                 text: str, spans):
     """
+    Escreve o script tratado no stream 'out' (texto), fatia por fatia de
+    'text' conforme os spans de split_sql — sem montar o arquivo em memória.
     script_id: ex '9342.0.GJO' (sem .sql)
     final_name_with_ext: ex '9342.0.GJO.sql' (apenas para mensagens/logs)
     """
     now = datetime.now().strftime("%d/%m/%y %H:%M:%S")
     ip  = get_local_ip()
-
-    parts = []
-    wrote_since_sep = False  # controla se há conteúdo real antes de inserir um END_MARK
-
-    def add(line=""):
-        nonlocal wrote_since_sep
-        parts.append(line)
-        if line.strip() and line.strip() != END_MARK:
-            wrote_since_sep = True
-
-    def sep():
-        nonlocal wrote_since_sep
-        if wrote_since_sep:
-            if not parts or parts[-1].strip() != END_MARK:
-                add(END_MARK)
-            parts.append("")  # linha vazia por legibilidade
-            wrote_since_sep = False
-
-    # Cabeçalho
-    add("/*")
-    add(f"--#AUTOR...: {author}")
-    add(f"--#DATA....: {now} - IP: {ip}")
-    add(f"--#SISTEMA.: {sistema}")
-    add("*/")
-    add("")
-    # Verificação inicial (sem .sql)
-    add(f"select * from sistema.fn_verifica_script('{script_id}');")
-    add("")
-    sep()
-
-    # Comandos
-    for s in stmts:
-        s_clean = s.strip()
-        if not s_clean:
-            continue
-        add(s_clean)
-        sep()
+    sep = END_MARK + "\n\n"
+
+    # Cabeçalho + verificação inicial (sem .sql)
+    out.write("/*\n"
+              f"--#AUTOR...: {author}\n"
+              f"--#DATA....: {now} - IP: {ip}\n"
+              f"--#SISTEMA.: {sistema}\n"
+              "*/\n\n"
+              f"select * from sistema.fn_verifica_script('{script_id}');\n\n"
+              + sep)
+
+    # Comandos (um separador depois de cada um)
+    for k in range(0, len(spans), 2):
+        a, b = spans[k], spans[k + 1]
+        if text.find(END_MARK, a, b) < 0:
+            out.write(text[a:b])
+        else:
+            stmt, merged = _stmt_with_marks(text[a:b])
+            if not stmt.strip():
+                continue
+            out.write(stmt)
+            if merged:
+                out.write(sep)
+                continue
+        out.write("\n" + sep)
 
     # Atualização final (sem .sql)
-    add(f"select * from sistema.fn_atualiza_script('{script_id}');")
-    add("")
-    sep()
+    out.write(f"select * from sistema.fn_atualiza_script('{script_id}');\n\n{END_MARK}\n")
 
-    out = "\n".join(parts).strip() + "\n"
-    # Colapsa separadores duplicados, por via das dúvidas
-    out = re.sub(rf"(?:{re.escape(END_MARK)}\s*){{2,}}", END_MARK + "\n\n", out)
+# ====================== PIPELINE PRINCIPAL ======================
+
+def manifest_path(key: str) -> Path:
+    """key: systems.input_key (nome do sistema para o arquivo da raiz)."""
+    return THIS_DIR / f".target_{key}.json"
+
+class ManifestScan(io.RawIOBase):
+    """
+    Stream binário que repassa os bytes para 'sink' (None: só observa, para
+    um arquivo já tratado lido em pedaços) e calcula pelo caminho o que o
+    manifesto precisa — sha256, tamanho, encoding, header_end e os
+    intervalos dos blocos entre END_MARKs —, sem ter o arquivo em memória.
+    Só a cauda que ainda pode ser o começo de um END_MARK fica pendente.
+    """
+    MARK = END_MARK.encode("ascii")
+    HEAD_RE = re.compile(rb"fn_verifica_script\s*\(", re.IGNORECASE)
+    WS = b" \t\r\n\f\v"
+
+    def __init__(self, sink=None):
+        super().__init__()
+        self.sink = sink
+        self.sha = hashlib.sha256()
+        self.size = 0
+        self.done = 0          # bytes já classificados (antes de 'pending')
+        self.pending = b""
+        self.header_end = None
+        self.blocks = []
+        self.start = self.stop = None
+        # mesma ordem de apply_db_updates.read_text_auto; latin-1 se nenhum servir
+        self.decoders = {enc: codecs.getincrementaldecoder(enc)() for enc in ("cp1252", "utf-8")}
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        b = bytes(b)
+        if self.sink is not None:
+            self.sink.write(b)
+        self.sha.update(b)
+        self.size += len(b)
+        self._decode(b, False)
+        buf, base = self.pending + b, self.done
+        if self.header_end is None:
+            head = self.HEAD_RE.search(buf)
+            if head:
+                self.header_end = base + head.start()
+        pos = 0
+        while True:
+            i = buf.find(self.MARK, pos)
+            if i < 0:
+                break
+            self._content(buf[pos:i], base + pos)
+            self._close_block()
+            pos = i + len(self.MARK)
+        keep = max(pos, len(buf) - len(self.MARK) + 1)
+        self._content(buf[pos:keep], base + pos)
+        self.pending, self.done = buf[keep:], base + keep
+        return len(b)
+
+    def _decode(self, b: bytes, final: bool):
+        for enc, dec in list(self.decoders.items()):
+            try:
+                dec.decode(b, final)
+            except UnicodeDecodeError:
+                del self.decoders[enc]
+
+    def _content(self, seg: bytes, off: int):
+        body = seg.lstrip(self.WS)
+        if not body:
+            return
+        if self.start is None:
+            self.start = off + len(seg) - len(body)
+        self.stop = off + len(seg.rstrip(self.WS))
+
+    def _close_block(self):
+        if self.start is not None:
+            self.blocks.append([self.start, self.stop])
+        self.start = self.stop = None
+
+    def layout(self) -> dict:
+        """Fecha a varredura; retorna os campos do manifesto que dependem dos bytes."""
+        self._content(self.pending, self.done)
+        self.done += len(self.pending)
+        self.pending = b""
+        self._close_block()
+        self._decode(b"", True)
+        return {
+            "sha256": self.sha.hexdigest(),
+            "encoding": next(iter(self.decoders), "latin-1"),
+            "bytes": self.size,
+            "header_end": self.header_end,
+            "blocks": self.blocks,
+        }
+
+def write_manifest(src: Path, script_id: str, layout: Optional[dict] = None) -> Path:
+    """
+    Grava src/.target_<chave>.json descrevendo o arquivo tratado como ele
+    ficou no disco: ID, sistema, sha256, encoding, tamanho, offset (em bytes)
+    do cabeçalho até fn_verifica_script e os intervalos [início, fim) de cada
+    bloco entre END_MARKs. As etapas seguintes confiam nele só se o sha256
+    bater; do contrário voltam a ler e varrer o arquivo inteiro.
+    layout: ManifestScan.layout() de quem acabou de escrever o arquivo; sem
+    ele, o arquivo é lido em pedaços pelo ManifestScan.
+    """
+    reg = systems.for_input(src)
+    name = reg["name"]
+    if layout is None:
+        scan = ManifestScan()
+        with open(src, "rb") as f:
+            for chunk in iter(lambda: f.read(STREAM_CHUNK), b""):
+                scan.write(chunk)
+        layout = scan.layout()
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "script_id": script_id,
+        "system": name,
+        "file": src.name,
+        **layout,
+    }
+    return _store_manifest(src, manifest)
+
+def _store_manifest(src: Path, manifest: dict) -> Path:
+    out = manifest_path(systems.input_key(systems.for_input(src), src))
+    tmp = out.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(manifest), encoding="utf-8")
+    os.replace(tmp, out)
     return out
 
-# ====================== PIPELINE PRINCIPAL ======================
+def _own_manifest(src: Path) -> Optional[dict]:
+    """
+    Manifesto de src se o tamanho bater; o sha256 (arquivo inteiro, em
+    pedaços) só é conferido por quem for reescrever o arquivo.
+    """
+    try:
+        man = json.loads(manifest_path(systems.input_key(systems.for_input(src), src)).read_text(encoding="utf-8"))
+        size = src.stat().st_size
+    except (OSError, ValueError):
+        return None
+    if (man.get("version") != MANIFEST_VERSION or man.get("bytes") != size
+            or man.get("header_end") is None or not man.get("blocks")):
+        return None
+    return man
+
+def _file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(STREAM_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
 
-def process_one(src: Path, author: str, initials: str):
+def process_one(src: Path, author: str, initials: str, min_seq: int = 0):
     """
-    src: caminho do arquivo na RAIZ (PROJECT_ROOT / 'gestor.sql' ou 'supervisor.sql')
-    Gera conteúdo tratado em ANSI no próprio arquivo da raiz
-    e grava o sidecar .target_<sistema>.txt (em src/), contendo o ID sem .sql.
+    src: entrada de um sistema registrado — arquivo fonte na RAIZ (ex.:
+    PROJECT_ROOT / 'gestor.sql') ou arquivo da caixa de entrada (lote).
+    Gera conteúdo tratado em ANSI no próprio arquivo e grava o manifesto
+    .target_<chave>.json (em src/), ver write_manifest.
+    min_seq: menor NNNN aceito (lote: o anterior + 1, para ficarem consecutivos).
     """
+    # Não cria a pasta do sistema: no pipeline o svn checkout/update corre em
+    # paralelo e uma pasta nova em src/Scripts seria tomada por "não é WC"
+    # (next_seq_for aceita pasta ausente; o post_sync cria o que faltar)
     sistema, letter, dest_folder = detect_system_and_letter(src)
-    dest_folder.mkdir(parents=True, exist_ok=True)
 
     raw = src.read_text(encoding="utf-8", errors="replace")
 
     if already_processed(raw):
-        # Já tratado: extrai o ID existente e escreve o sidecar (sem .sql)
-        script_id = extract_existing_script_id(raw)
-        if not script_id:
+        # Já tratado: mantém o ID existente, salvo se o NNNN já estiver ocupado
+        # na pasta do sistema ou ficar abaixo de min_seq (lote): aí é reescrito
+        # como no pipeline (refresh_script_id). Escreve o manifesto (ID sem .sql)
+        old_id = extract_existing_script_id(raw)
+        if not old_id:
             print(f"ERRO: {src.name} parece tratado, mas não encontrei fn_verifica_script('<ID>').", file=sys.stderr)
             sys.exit(2)
-        # grava sidecar com ID (sem .sql) em src/
-        (THIS_DIR / f".target_{sistema.lower()}.txt").write_text(script_id, encoding="utf-8")
+        del raw
+        script_id = refresh_script_id(src, min_seq) or old_id
+        if script_id == old_id:
+            write_manifest(src, script_id)
         print(f"ℹ️ {src.name} já está tratado; ID detectado: {script_id}.")
         return f"{script_id}.sql"
 
     # Ainda não tratado: gera novo nome e conteúdo
-    seq = next_seq_for(dest_folder, letter)
+    seq = max(next_seq_for(dest_folder, letter), min_seq)
     final_name = f"{seq:04d}.0.{letter}{initials}.sql"  # ex: 9342.0.GJO.sql
     script_id  = final_name[:-4]                        # sem .sql
 
     # backup antes de sobrescrever (em src/.preprocess_backup)
     make_backup(src)
 
-    stmts = split_sql(raw)
-    out   = build_output(script_id, final_name, sistema, author, stmts)
-
-    # Salvar como "ANSI" (Windows-1252) — no arquivo da RAIZ
-    src.write_text(out, encoding=TARGET_ENCODING, errors="replace")
+    text, spans = split_sql(raw)
+    del raw  # split_sql só normaliza as quebras; os comandos são fatias de 'text'
+
+    # Salvar como "ANSI" (Windows-1252) — no arquivo da RAIZ (via temporário);
+    # o ManifestScan entre o texto e o arquivo já calcula sha256 e blocos
+    tmp = src.with_name(src.name + ".tmp")
+    with tmp.open("wb") as f:
+        scan = ManifestScan(f)
+        with io.TextIOWrapper(io.BufferedWriter(scan), encoding=TARGET_ENCODING, errors="replace") as out:
+            build_output(out, script_id, final_name, sistema, author, text, spans)
+    os.replace(tmp, src)
     print(f"✅ Tratado {src.name} -> alvo {final_name} ({sistema}) [salvo em {TARGET_ENCODING}]")
 
-    # Sidecar (em src/) deve conter o ID sem .sql
-    (THIS_DIR / f".target_{sistema.lower()}.txt").write_text(script_id, encoding="utf-8")
+    # Manifesto (em src/) descreve o arquivo como ficou no disco
+    write_manifest(src, script_id, scan.layout())
     return final_name
 
+def process_system(reg: dict, author: str, initials: str):
+    """Trata as entradas do sistema em ordem, com NNNN consecutivos. Retorna os nomes finais."""
+    names, floor = [], 0
+    for src in systems.inputs(reg):
+        name = process_one(src, author, initials, floor)
+        names.append(name)
+        floor = int(name[:4]) + 1 if name[:4].isdigit() else floor
+    return names
+
+def refresh_script_id(src: Path, min_seq: int = 0) -> Optional[str]:
+    """
+    Usado pelo pipeline (run_pipeline.py), que trata o arquivo enquanto o svn
+    ainda está atualizando: depois que o svn termina, confere se o NNNN
+    escolhido continua livre na pasta do sistema e, se não estiver, reescreve
+    o ID em fn_verifica_script/fn_atualiza_script (e no manifesto).
+    min_seq: menor NNNN aceito (lote, ver refresh_system).
+    Com o manifesto (.target_<chave>.json), lê só o cabeçalho até
+    fn_verifica_script e, se precisar reescrever, troca o NNNN no lugar — o ID
+    tem tamanho fixo, os offsets dos blocos não mudam — no cabeçalho e no
+    último bloco (fn_atualiza_script), atualizando ID e sha256 do manifesto.
+    Sem manifesto válido, lê o arquivo inteiro.
+    Retorna o ID final (sem .sql) ou None se o arquivo não estiver tratado.
+    """
+    _, letter, dest_folder = detect_system_and_letter(src)
+    man = _own_manifest(src)
+    m = data = None
+    if man:
+        with open(src, "rb") as f:
+            m = _ID_RE.search(f.read(man["header_end"] + HEAD_SLACK))
+    if not m:
+        man, data = None, src.read_bytes()
+        m = _ID_RE.search(data)
+        if not m:
+            return None
+    seq, suffix = int(m.group(1)), m.group(2).decode("ascii")
+    old_id = f"{seq:04d}.0.{suffix}"
+    nxt = max(next_seq_for(dest_folder, letter), min_seq)
+    if seq >= nxt:
+        return old_id
+    new_id = f"{nxt:04d}.0.{suffix}"
+    pat = re.compile(rb"fn_(?:verifica|atualiza)_script\(\s*'(" + re.escape(old_id.encode("ascii"))
+                     + rb")(?:\.sql)?'\s*\)", flags=re.IGNORECASE)
+    if man and man.get("sha256") == _file_sha256(src):
+        start, stop = man["blocks"][-1]
+        with open(src, "r+b") as f:
+            f.seek(start)
+            offsets = [m.start(1)] + [start + mm.start(1) for mm in pat.finditer(f.read(stop - start))]
+            for off in offsets:
+                f.seek(off)
+                f.write(new_id.encode("ascii"))
+        man.update(script_id=new_id, sha256=_file_sha256(src))
+        _store_manifest(src, man)
+    else:
+        data = src.read_bytes() if data is None else data
+        src.write_bytes(pat.sub(lambda mm: mm.group(0).replace(mm.group(1), new_id.encode("ascii")), data))
+        write_manifest(src, new_id)
+    print(f"ℹ️ {src.name}: {old_id} já está ocupado na pasta do sistema (ou abaixo do lote); "
+          f"ID reescrito para {new_id}.")
+    return new_id
+
+def refresh_system(reg: dict):
+    """refresh_script_id de cada entrada do sistema, mantendo os NNNN consecutivos."""
+    floor = 0
+    for src in systems.inputs(reg):
+        script_id = refresh_script_id(src, floor)
+        if script_id:
+            floor = int(script_id[:4]) + 1
+
 def main():
     author, initials = load_config()
-    found = False
-    for fname in ("gestor.sql", "supervisor.sql"):
-        p = PROJECT_ROOT / fname       # procura na RAIZ
-        if p.exists():
-            process_one(p, author, initials); found = True
+    found = systems.present()   # fonte na RAIZ e/ou caixa de entrada
     if not found:
-        print("ℹ️ Nada a tratar (gestor.sql/supervisor.sql não encontrados na raiz).")
+        print(f"ℹ️ Nada a tratar ({systems.describe_inputs()} não encontrados).")
+        return
+    # sistemas são independentes (pasta/letra próprias): trata em paralelo;
+    # as entradas de um mesmo sistema, em ordem (NNNN consecutivos)
+    with ThreadPoolExecutor(max_workers=len(found)) as ex:
+        for f in [ex.submit(process_system, reg, author, initials) for reg in found]:
+            f.result()
 
 if __name__ == "__main__":
-    main()
+    with profiling.stage("preprocess_sql"), run_history.stage("preprocess_sql"):
+        main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Perfil opcional de CPU (cProfile) e memória (tracemalloc) por etapa.
+
+Para quando o run está lento do lado do cliente (split em blocos,
+decodificação, limpeza de cabeçalho) e não nas bases. Ligado por etapa:
+
+    python src/preprocess_sql.py --profile            # perfis em src/.profiles/
+    python src/apply_db_updates.py --profile=/tmp/prof
+    ./src/run_sync.sh --profile                       # todas as etapas do run
+    SYNC_PROFILE=1 ./src/run_sync.sh                  # idem (ou SYNC_PROFILE=/dir)
+
+Cada etapa grava em <dir>/<SYNC_RUN_ID>/:
+    <etapa>.pstats      CPU (python -m pstats <arquivo>, snakeviz, ...)
+    <etapa>.alloc.txt   maiores alocações por linha e por pilha, perto do pico
+                        de memória e no fim da etapa
+    <etapa>.tracemalloc snapshot bruto do pico (tracemalloc.Snapshot.load, para comparar runs)
+
+No modo pipeline (padrão do run_sync.sh) svn, preprocess e bases correm em
+threads sobrepostas no mesmo processo: o perfil sai como uma etapa só,
+"pipeline". Desligado, nada é importado nem instrumentado.
+"""
+
+import os
+import sys
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+
+import run_history
+
+THIS_DIR    = Path(__file__).resolve().parent        # src/
+DEFAULT_DIR = THIS_DIR / ".profiles"
+
+TRACE_FRAMES = 10   # profundidade das pilhas guardadas pelo tracemalloc
+TOP_LINES    = 30
+TOP_TRACES   = 10
+PEAK_CHECK   = 1.0  # segundos entre conferências do uso de memória (snapshot do pico)
+
+
+def requested():
+    """
+    Diretório de saída se o perfil foi pedido (--profile[=DIR] na linha de
+    comando, que é removido de sys.argv, ou SYNC_PROFILE); senão None.
+    """
+    value = os.environ.get("SYNC_PROFILE", "").strip()
+    for arg in list(sys.argv[1:]):
+        if arg == "--profile" or arg.startswith("--profile="):
+            sys.argv.remove(arg)
+            value = arg.partition("=")[2].strip() or "1"
+    if value.lower() in ("", "0", "false", "no", "off"):
+        return None
+    if value.lower() in ("1", "true", "yes", "on"):
+        return DEFAULT_DIR
+    return Path(value).expanduser().resolve()
+
+
+@contextmanager
+def stage(name: str):
+    """Perfila a etapa inteira, se pedido (inclusive quando termina com sys.exit)."""
+    out_dir = requested()
+    if out_dir is None:
+        yield
+        return
+    session = _Session(name, out_dir / run_history.RUN_ID)
+    session.start()
+    try:
+        yield
+    finally:
+        session.stop()
+
+
+class _Session:
+    def __init__(self, name: str, out_dir: Path):
+        self.name, self.out_dir = name, out_dir
+        self.lock = threading.Lock()
+        self.threads = []   # (thread, Profile) das threads criadas durante a etapa
+        self.peak_snapshot, self.peak_current = None, 0
+        self.done = threading.Event()
+
+    def start(self):
+        import cProfile
+        import tracemalloc
+        tracemalloc.start(TRACE_FRAMES)
+        self.watcher = threading.Thread(target=self._watch_peak, name="profiling", daemon=True)
+        self.watcher.start()
+        self.new_profile = cProfile.Profile
+        self.main = self.new_profile()
+        # A partir do 3.12 o cProfile usa sys.monitoring e já enxerga todas as
+        # threads; antes disso cada thread nova precisa do seu próprio Profile
+        if sys.version_info < (3, 12):
+            threading.setprofile(self._thread_hook)
+        self.main.enable()
+
+    def _thread_hook(self, frame, event, arg):
+        prof = self.new_profile()
+        with self.lock:
+            self.threads.append((threading.current_thread(), prof))
+        prof.enable()   # substitui este hook na thread
+
+    def _watch_peak(self):
+        """Guarda um snapshot sempre que o uso atual passa 10% do maior já visto."""
+        import tracemalloc
+        while not self.done.wait(PEAK_CHECK):
+            current, _ = tracemalloc.get_traced_memory()
+            if current > self.peak_current * 1.1:
+                self.peak_snapshot, self.peak_current = tracemalloc.take_snapshot(), current
+
+    def stop(self):
+        import pstats
+        import tracemalloc
+        self.main.disable()
+        threading.setprofile(None)
+        self.done.set()
+        self.watcher.join()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        if self.peak_snapshot is None or current >= self.peak_current:
+            self.peak_snapshot, self.peak_current = snapshot, current
+        try:
+            self.out_dir.mkdir(parents=True, exist_ok=True)
+            stats = pstats.Stats(self.main)
+            with self.lock:
+                # threads ainda vivas (ex.: daemons) seguem medindo: ficam de fora
+                for thread, prof in self.threads:
+                    if not thread.is_alive():
+                        stats.add(prof)
+            cpu_path = self.out_dir / f"{self.name}.pstats"
+            stats.dump_stats(str(cpu_path))
+            alloc_path = self._write_alloc(snapshot, current, peak)
+            print(f"[PROFILE] {self.name}: CPU em {cpu_path} | memória (pico {_mib(peak)}) em {alloc_path}")
+        except Exception as e:
+            print(f"[PROFILE][warn] não foi possível gravar o perfil de {self.name}: {e}", file=sys.stderr)
+
+    def _write_alloc(self, snapshot, current: int, peak: int) -> Path:
+        peak_snapshot = _filtered(self.peak_snapshot)
+        peak_snapshot.dump(str(self.out_dir / f"{self.name}.tracemalloc"))
+        lines = [f"# {self.name} — run {run_history.RUN_ID}",
+                 f"pico: {_mib(peak)} | ainda alocado ao fim: {_mib(current)}", ""]
+        lines += _top(peak_snapshot, f"perto do pico ({_mib(self.peak_current)} em uso)")
+        if self.peak_snapshot is not snapshot:
+            lines += _top(_filtered(snapshot), "no fim da etapa")
+
+        path = self.out_dir / f"{self.name}.alloc.txt"
+        path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        return path
+
+
+def _filtered(snapshot):
+    import tracemalloc
+    return snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ))
+
+
+def _top(snapshot, title: str) -> list:
+    import linecache
+    lines = [f"== {title}", f"Maiores alocações por linha (top {TOP_LINES}):"]
+    for i, st in enumerate(snapshot.statistics("lineno")[:TOP_LINES], 1):
+        frame = st.traceback[0]
+        lines.append(f"{i:3}. {frame.filename}:{frame.lineno}: {_mib(st.size)} em {st.count} bloco(s)")
+        src = linecache.getline(frame.filename, frame.lineno).strip()
+        if src:
+            lines.append(f"       {src}")
+    lines.append(f"Maiores pilhas (top {TOP_TRACES}):")
+    for i, st in enumerate(snapshot.statistics("traceback")[:TOP_TRACES], 1):
+        lines.append(f"{i:3}. {_mib(st.size)} em {st.count} bloco(s)")
+        lines += [f"       {ln}" for ln in st.traceback.format(most_recent_first=True)]
+    return lines + [""]
+
+
+def _mib(nbytes: int) -> str:
+    return f"{nbytes / 1024 / 1024:.1f} MiB"
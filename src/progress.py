@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Progresso ao vivo do catch-up e da execução de scripts nas bases.
+
+Cada catch-up (e cada script avulso, como o novo script em TEST) ganha um
+acompanhamento com: scripts feitos/total, blocos/s, bytes/s, há quanto
+tempo o bloco atual está rodando e ETA pelos bytes que faltam nos scripts
+pendentes. O custo por bloco é só atualizar alguns contadores; quem mede e
+escreve é uma thread à parte:
+  - log : uma linha [PROGRESS] por alvo a cada progress_interval segundos
+          (só para o que já passou desse tempo — scripts rápidos não poluem);
+  - tty : uma linha de status atualizada no lugar, com todos os alvos ativos
+          (a saída normal apaga a linha antes de escrever).
+
+Configuração ([apply] no config.ini ou APPLY_<OPÇÃO>):
+    progress          = auto   ; auto (tty se a saída for terminal, senão log) | tty | log | off
+    progress_interval = 15     ; segundos entre linhas [PROGRESS] no modo log
+"""
+
+import sys
+import time
+import shutil
+import threading
+import contextvars
+from contextlib import contextmanager
+
+OPTS = {"mode": "off", "interval": 15.0}
+TTY_REFRESH = 1.0
+
+_CURRENT = contextvars.ContextVar("progress_tracker", default=None)   # por thread / tarefa asyncio
+_ACTIVE: list = []
+_LOCK = threading.RLock()
+_TICKER = None
+_STATUS = None
+
+
+def configure(mode: str, interval: float):
+    """Lê o modo; no tty passa a controlar a linha de status do sys.stdout."""
+    global _STATUS
+    mode = (mode or "auto").strip().lower()
+    if mode == "auto":
+        mode = "tty" if getattr(sys.stdout, "isatty", lambda: False)() else "log"
+    if mode not in ("tty", "log", "off"):
+        raise ValueError(f"[apply] progress inválido: {mode} (use auto, tty, log ou off)")
+    OPTS.update(mode=mode, interval=max(1.0, interval))
+    if mode == "tty" and _STATUS is None:
+        _STATUS = _StatusStream(sys.stdout)
+        sys.stdout = _STATUS
+
+
+def enabled() -> bool:
+    return OPTS["mode"] != "off"
+
+
+def current():
+    """Acompanhamento ativo nesta thread/tarefa (ou None)."""
+    return _CURRENT.get()
+
+
+# =================== Formatação ===================
+
+def _fmt_rate(nbytes: float) -> str:
+    if nbytes >= 1024 * 1024:
+        return f"{nbytes / 1024 / 1024:.1f} MiB/s"
+    return f"{nbytes / 1024:.1f} KiB/s"
+
+
+def _fmt_secs(secs: float) -> str:
+    secs = int(secs)
+    if secs >= 3600:
+        return f"{secs // 3600}h{secs % 3600 // 60:02d}m"
+    if secs >= 60:
+        return f"{secs // 60}m{secs % 60:02d}s"
+    return f"{secs}s"
+
+
+class Tracker:
+    """Contadores de um alvo; atualizados pela thread que executa, lidos pelo ticker."""
+
+    __slots__ = ("label", "scripts", "total_bytes", "started", "printed", "done", "done_bytes",
+                 "blocks", "script", "script_bytes", "block_no", "block_started", "block_bytes")
+
+    def __init__(self, label: str, scripts: int, total_bytes: int):
+        self.label, self.scripts, self.total_bytes = label.strip(), scripts, total_bytes
+        self.started = self.printed = time.monotonic()
+        self.done = self.done_bytes = self.blocks = 0
+        self.script, self.script_bytes = "", 0
+        self.block_no, self.block_started, self.block_bytes = 0, self.started, 0
+
+    def start_script(self, name: str, nbytes: int):
+        """Início (ou nova tentativa, após retry por lock) de um script."""
+        self.script, self.script_bytes = name, nbytes
+        self.block_no, self.block_bytes = 0, 0
+
+    def block(self, block_no: int, nbytes: int):
+        self.block_no = block_no
+        self.block_started = time.monotonic()
+        self.block_bytes += nbytes
+        self.blocks += 1
+
+    def end_script(self):
+        self.done += 1
+        self.done_bytes += self.script_bytes
+        self.script, self.block_no, self.block_bytes = "", 0, 0
+
+    def line(self, now: float) -> str:
+        elapsed = max(now - self.started, 1e-6)
+        done_bytes = self.done_bytes + min(self.block_bytes, self.script_bytes or self.block_bytes)
+        rate = done_bytes / elapsed
+        parts = [f"{self.label}: {self.done}/{self.scripts} script(s)"]
+        if self.script and self.block_no:
+            parts.append(f"{self.script} bloco {self.block_no} há {_fmt_secs(now - self.block_started)}")
+        parts.append(f"{self.blocks / elapsed:.1f} blocos/s")
+        parts.append(_fmt_rate(rate))
+        left = max(self.total_bytes - done_bytes, 0)
+        if rate > 0 and left:
+            parts.append(f"ETA {_fmt_secs(left / rate)}")
+        return " | ".join(parts)
+
+
+# =================== Ticker / saída ===================
+
+class _StatusStream:
+    """sys.stdout no modo tty: apaga a linha de status antes de qualquer saída normal."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.shown = 0
+
+    def _clear(self):
+        if self.shown:
+            self.stream.write("\r" + " " * self.shown + "\r")
+            self.shown = 0
+
+    def write(self, text):
+        with _LOCK:
+            self._clear()
+            return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def status(self, line: str):
+        with _LOCK:
+            self._clear()
+            if line:
+                width = shutil.get_terminal_size((100, 20)).columns - 1
+                line = line[:width]
+                self.stream.write("\r" + line)
+                self.shown = len(line)
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def _tick():
+    while True:
+        time.sleep(TTY_REFRESH if OPTS["mode"] == "tty" else OPTS["interval"])
+        with _LOCK:
+            trackers = list(_ACTIVE)
+        now = time.monotonic()
+        if OPTS["mode"] == "tty":
+            if trackers:
+                _STATUS.status("  ||  ".join(t.line(now) for t in trackers))
+            continue
+        for t in trackers:
+            if now - t.started >= OPTS["interval"] and now - t.printed >= OPTS["interval"] * 0.9:
+                t.printed = now
+                print(f"[PROGRESS] {t.line(now)}", flush=True)
+
+
+def _register(t: Tracker):
+    global _TICKER
+    with _LOCK:
+        _ACTIVE.append(t)
+        if _TICKER is None:
+            _TICKER = threading.Thread(target=_tick, name="progress", daemon=True)
+            _TICKER.start()
+
+
+def _unregister(t: Tracker):
+    with _LOCK:
+        if t in _ACTIVE:
+            _ACTIVE.remove(t)
+        if not _ACTIVE and _STATUS is not None:
+            _STATUS.status("")
+
+
+def _size(path) -> int:
+    try:
+        return path.stat().st_size
+    except OSError:
+        return 0
+
+
+@contextmanager
+def catchup(label: str, pend):
+    """Acompanha o catch-up de uma base. pend: [(seq, caminho, nome)] dos scripts pendentes."""
+    if not enabled():
+        yield None
+        return
+    t = Tracker(label, len(pend), sum(_size(p) for _, p, _ in pend))
+    _register(t)
+    token = _CURRENT.set(t)
+    try:
+        yield t
+    finally:
+        _CURRENT.reset(token)
+        _unregister(t)
+
+
+@contextmanager
+def script(label: str, name: str, nbytes: int):
+    """Um script: dentro do catch-up em andamento, ou avulso (ex.: novo script em TEST)."""
+    t = _CURRENT.get()
+    if t is None and not enabled():
+        yield None
+        return
+    own = t is None
+    if own:
+        t = Tracker(label, 1, nbytes)
+        _register(t)
+        token = _CURRENT.set(t)
+    t.start_script(name, nbytes)
+    try:
+        yield t
+        t.end_script()
+    finally:
+        if own:
+            _CURRENT.reset(token)
+            _unregister(t)
@@ -0,0 +1,623 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Replay ponta a ponta do run_sync contra um SVN e PostgreSQL locais, para
+medir o pipeline inteiro sem tocar nos servidores reais.
+
+Cada execução monta, num diretório de trabalho descartável:
+  - svnrepo/      repositório `svnadmin create` com K scripts por sistema
+                  (formato do preprocess: cabeçalho, fn_verifica_script,
+                  blocos END OFF COMMAND, fn_atualiza_script). Os K-W mais
+                  antigos entram na r1; os W mais novos, em commits seguintes;
+  - Sync_Scripts/ cópia dos .py de src/ + config.ini apontando para o repo
+                  (file://) e para as bases locais; a working copy já vem
+                  na r1 (W scripts a receber no svn update) e a raiz recebe
+                  os novos scripts brutos (<sistema>.sql + inbox/<sistema>/);
+  - pg<N>/        instâncias PostgreSQL próprias (initdb/pg_ctl, porta livre)
+                  — ou servidores existentes via --pg;
+  - em cada instância, replay_<sistema>_test/_dev com sistema.tb_sys_controle_versao,
+    sistema.fn_verifica_script e sistema.fn_atualiza_script, já marcadas até
+    K-B (B scripts atrás do repositório).
+
+Depois roda src/run_sync.sh da cópia (pipeline ou SYNC_SEQUENTIAL=1) e
+mostra os tempos por etapa e por base gravados no run_history da cópia.
+
+O comando race simula desenvolvedores submetendo ao mesmo tempo: uma cópia
+do projeto por desenvolvedor (iniciais RA, RB, ...), todas escolhendo o
+mesmo NNNN (um hook pre-commit segura os commits até todos chegarem lá).
+Depois confere que o repositório não tem NNNN repetido e que um catch-up em
+cada base não reexecuta nada e deixa tb_sys_controle_versao igual ao HEAD.
+Sai com código != 0 se algo não conferir.
+
+Uso:
+    python src/replay_harness.py run --history 500 --behind 200 --blocks 20 --rows 200
+    python src/replay_harness.py run --pg-instances 2 --set apply.engine=async --json r.json
+    python src/replay_harness.py run --pg 127.0.0.1:5432:postgres:senha --keep
+    python src/replay_harness.py report --work /tmp/replay-xxxx
+    python src/replay_harness.py race --devs 2 --new 2          # corrida de sequência
+    python src/replay_harness.py race --shared-db               # mesmas bases TEST/DEV para todos
+
+Requisitos: bash, svn e svnadmin no PATH; initdb/pg_ctl (ou --pg-bin) quando
+não usar --pg; psycopg/psycopg2 (o mesmo do apply_db_updates).
+ATENÇÃO: com --pg, as bases replay_* do servidor informado são recriadas.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import sqlite3
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+from datetime import datetime
+
+import apply_db_updates as adb
+
+THIS_DIR = Path(__file__).resolve().parent        # src/
+END_MARK = adb.END_MARK
+LETTERS = {"gestor": "G", "supervisor": "S"}
+INITIALS_SEED = "HX"                              # autor dos scripts do histórico
+INITIALS_NEW = "RP"                               # autor dos novos scripts
+
+BASE_SQL = """
+create schema if not exists sistema;
+create schema if not exists replay;
+create table if not exists sistema.tb_sys_controle_versao (
+    nr_versao_banco bigserial primary key,
+    nm_arquivo      text not null unique,
+    dt_atualizacao  timestamp not null default now()
+);
+create or replace function sistema.fn_verifica_script(p_script text) returns text
+language plpgsql as $$
+begin
+    if exists (select 1 from sistema.tb_sys_controle_versao where nm_arquivo = p_script) then
+        raise exception 'Script % já aplicado nesta base.', p_script;
+    end if;
+    return p_script;
+end $$;
+create or replace function sistema.fn_atualiza_script(p_script text) returns text
+language plpgsql as $$
+begin
+    insert into sistema.tb_sys_controle_versao (nm_arquivo) values (p_script)
+        on conflict (nm_arquivo) do nothing;
+    return p_script;
+end $$;
+"""
+
+
+def die(msg: str, code: int = 1):
+    print(f"[replay][ERRO] {msg}", file=sys.stderr)
+    sys.exit(code)
+
+
+def run(cmd, cwd=None, env=None):
+    res = subprocess.run([str(c) for c in cmd], cwd=cwd, env=env, text=True,
+                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    if res.returncode != 0:
+        die(f"{Path(str(cmd[0])).name} falhou ({res.returncode}): {(res.stdout or '').strip()[-2000:]}")
+    return res.stdout or ""
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# =================== Geração dos scripts ===================
+
+def body_blocks(table: str, blocks: int, rows: int, width: int):
+    """Blocos autocontidos (cada script cria e carrega a própria tabela)."""
+    out = [f"create table replay.{table} (id bigint primary key, val text, n int);"]
+    payload = "x" * max(0, width)
+    next_id = 1
+    for _ in range(max(0, blocks - 1)):
+        vals = ",\n".join(f"({i}, '{payload}{i}', {i % 97})" for i in range(next_id, next_id + rows))
+        out.append(f"insert into replay.{table} (id, val, n) values\n{vals};")
+        next_id += rows
+    return out
+
+
+def treated_script(script_id: str, sistema: str, blocks) -> str:
+    """Mesmo formato do preprocess_sql.build_output."""
+    sep = END_MARK + "\n\n"
+    parts = ["/*\n--#AUTOR...: replay\n"
+             f"--#DATA....: {datetime.now():%d/%m/%y %H:%M:%S} - IP: 127.0.0.1\n"
+             f"--#SISTEMA.: {sistema}\n*/\n\n"
+             f"select * from sistema.fn_verifica_script('{script_id}');\n\n" + sep]
+    parts += [b + "\n" + sep for b in blocks]
+    parts.append(f"select * from sistema.fn_atualiza_script('{script_id}');\n\n{END_MARK}\n")
+    return "".join(parts)
+
+
+def registry(names):
+    regs, used = [], set(LETTERS.values())
+    for name in names:
+        letter = LETTERS.get(name)
+        if not letter:
+            letter = next((c for c in name.upper() + "ABCDEFHIJKLMNOPQRTUVWXYZ"
+                           if c.isalpha() and c not in used), None)
+            if not letter:
+                die(f"sem letra livre para o sistema {name}")
+            used.add(letter)
+        regs.append(dict(name=name, label=name.capitalize(), letter=letter))
+    return regs
+
+
+# =================== SVN ===================
+
+def seed_svn(work: Path, regs, args) -> str:
+    repo = work / "svnrepo"
+    run(["svnadmin", "create", repo])
+    url = repo.resolve().as_uri() + "/Scripts"
+    old, new = work / "seed_old" / "Scripts", work / "seed_new"
+    split = max(0, args.history - args.wc_behind)
+    for reg in regs:
+        for folder in (old / reg["label"], new / reg["label"]):
+            folder.mkdir(parents=True, exist_ok=True)
+        for seq in range(1, args.history + 1):
+            script_id = f"{seq:04d}.0.{reg['letter']}{INITIALS_SEED}"
+            blocks = body_blocks(f"t_{reg['letter'].lower()}_{seq:04d}", args.blocks, args.rows, args.width)
+            folder = old if seq <= split else new
+            (folder / reg["label"] / f"{script_id}.sql").write_bytes(
+                treated_script(script_id, reg["label"], blocks).encode("cp1252"))
+    t0 = time.monotonic()
+    run(["svn", "import", "--non-interactive", "-m", "replay: histórico", old, url])
+    for reg in regs:  # os W mais novos chegam no svn update do run
+        if any((new / reg["label"]).iterdir()):
+            run(["svn", "import", "--non-interactive", "-m", f"replay: {reg['label']} recentes",
+                 new / reg["label"], f"{url}/{reg['label']}"])
+    print(f"[replay] svn: {len(regs)} sistema(s) x {args.history} scripts "
+          f"({args.wc_behind} após a r1) em {time.monotonic() - t0:.1f}s")
+    shutil.rmtree(work / "seed_old")
+    shutil.rmtree(work / "seed_new")
+    return url
+
+
+# =================== PostgreSQL ===================
+
+def pg_tool(args, name: str) -> str:
+    if args.pg_bin:
+        return str(Path(args.pg_bin) / name)
+    return shutil.which(name) or name
+
+
+def start_instances(work: Path, args):
+    """initdb + pg_ctl start de N instâncias locais. Retorna [{host, port, user, password, data}]."""
+    out = []
+    for i in range(args.pg_instances):
+        data, port = work / f"pg{i}", free_port()
+        run([pg_tool(args, "initdb"), "-D", data, "-U", "replay", "--auth=trust", "-E", "UTF8", "--locale=C"])
+        opts = f"-p {port} -k {data} -c listen_addresses=127.0.0.1"
+        for extra in args.pg_conf:
+            opts += f" -c {extra}"
+        run([pg_tool(args, "pg_ctl"), "-D", data, "-l", data / "server.log", "-o", opts, "-w", "start"])
+        out.append(dict(host="127.0.0.1", port=port, user="replay", password="", data=data))
+        print(f"[replay] PostgreSQL local em 127.0.0.1:{port} ({data})")
+    return out
+
+
+def stop_instances(instances, args):
+    for inst in instances:
+        if inst.get("data"):
+            subprocess.run([pg_tool(args, "pg_ctl"), "-D", str(inst["data"]), "-m", "fast", "-w", "stop"],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def parse_servers(specs):
+    out = []
+    for spec in specs:
+        host, port, user, password = (spec.split(":", 3) + ["", "", ""])[:4]
+        out.append(dict(host=host or "127.0.0.1", port=int(port or 5432), user=user or "postgres",
+                        password=password, data=None))
+    return out
+
+
+def prepare_db(pg, inst: dict, dbname: str, reg: dict, marked: int):
+    maint = adb.connect_db(pg, dict(inst, dbname="postgres"))
+    maint.autocommit = True
+    with maint.cursor() as cur:
+        cur.execute(f'drop database if exists "{dbname}"')
+        cur.execute(f'create database "{dbname}"')
+    adb.close_db(maint)
+    conn = adb.connect_db(pg, dict(inst, dbname=dbname))
+    with conn.cursor() as cur:
+        cur.execute(BASE_SQL)
+        # histórico já aplicado: só o registro de versão (os scripts são autocontidos)
+        cur.execute("insert into sistema.tb_sys_controle_versao (nm_arquivo)"
+                    " select lpad(g::text, 4, '0') || '.0.' || %s from generate_series(1, %s) g",
+                    (f"{reg['letter']}{INITIALS_SEED}", marked))
+    conn.commit()
+    adb.close_db(conn)
+
+
+# =================== Projeto (cópia do Sync_Scripts) ===================
+
+def build_project(work: Path, regs, url: str, dbs: dict, args,
+                  name: str = "Sync_Scripts", initials: str = INITIALS_NEW) -> Path:
+    proj = work / name
+    src = proj / "src"
+    src.mkdir(parents=True)
+    for f in list(THIS_DIR.glob("*.py")) + [THIS_DIR / "run_sync.sh"]:
+        shutil.copy2(f, src / f.name)
+
+    lines = ["[svn]", f"url = {url}", "",
+             "[user]", "author_name = Replay", f"initials = {initials}", "",
+             "[systems]", "names = " + ", ".join(r["name"] for r in regs), ""]
+    for reg in regs:
+        lines += [f"[system_{reg['name']}]", f"letter = {reg['letter']}", f"label = {reg['label']}", ""]
+        for tgt in ("test", "dev"):
+            inst, dbname = dbs[(reg["name"], tgt)]
+            lines += [f"[db_{tgt}_{reg['name']}]", f"host = {inst['host']}", f"port = {inst['port']}",
+                      f"dbname = {dbname}", f"user = {inst['user']}", f"password = {inst['password']}", ""]
+    extra = {}
+    for item in args.set:
+        key, _, value = item.partition("=")
+        sec, _, opt = key.partition(".")
+        if not sec or not opt:
+            die(f"--set espera secao.opcao=valor: {item}")
+        extra.setdefault(sec, []).append(f"{opt} = {value}")
+    for sec, opts in extra.items():
+        lines += [f"[{sec}]", *opts, ""]
+    (proj / "config.ini").write_text("\n".join(lines), encoding="utf-8")
+
+    # working copy na r1: os scripts mais novos chegam no svn update
+    run(["svn", "checkout", "--non-interactive", "-r", "1", url, src / "Scripts"])
+
+    # novos scripts brutos: o primeiro na raiz, os demais na caixa de entrada (lote)
+    for reg in regs:
+        for k in range(args.new):
+            blocks = body_blocks(f"t_{reg['letter'].lower()}_{initials.lower()}_novo_{k}",
+                                 args.blocks, args.rows, args.width)
+            text = "\n\n".join(blocks) + "\n"
+            if k == 0:
+                path = proj / f"{reg['name']}.sql"
+            else:
+                path = proj / "inbox" / reg["name"] / f"{k:03d}.sql"
+                path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(text, encoding="utf-8")
+    return proj
+
+
+def sync_env(run_id: str, args) -> dict:
+    env = dict(os.environ, SYNC_RUN_ID=run_id, PYTHON=sys.executable)
+    env.pop("SYNC_QUEUE_URL", None)
+    if args.mode == "sequential":
+        env["SYNC_SEQUENTIAL"] = "1"
+    return env
+
+
+def run_sync(proj: Path, run_id: str, args) -> float:
+    env = sync_env(run_id, args)
+    log = proj.parent / "run_sync.log"
+    print(f"[replay] run_sync ({args.mode}) — saída em {log}")
+    t0 = time.monotonic()
+    with log.open("w", encoding="utf-8") as out:
+        res = subprocess.run(["bash", str(proj / "src" / "run_sync.sh")], cwd=proj, env=env,
+                             stdout=out, stderr=subprocess.STDOUT)
+    wall = time.monotonic() - t0
+    if res.returncode != 0:
+        tail = log.read_text(encoding="utf-8", errors="replace").splitlines()[-30:]
+        print("\n".join(tail), file=sys.stderr)
+        die(f"run_sync saiu com {res.returncode} após {wall:.1f}s (log completo em {log})")
+    return wall
+
+
+# =================== Corrida de sequência ===================
+
+PRE_COMMIT_BARRIER = """#!/bin/sh
+# segura cada commit até {devs} chegarem aqui: todos escolhem o NNNN antes de alguém comitar
+dir='{barrier}'
+mkdir -p "$dir"
+: > "$dir/$$"
+i=0
+while [ "$(ls "$dir" | wc -l)" -lt {devs} ] && [ "$i" -lt 1200 ]; do
+    sleep 0.1
+    i=$((i + 1))
+done
+exit 0
+"""
+
+
+def install_barrier(work: Path, devs: int):
+    hook = work / "svnrepo" / "hooks" / "pre-commit"
+    hook.write_text(PRE_COMMIT_BARRIER.format(devs=devs, barrier=work / "barrier"), encoding="utf-8")
+    hook.chmod(0o755)
+
+
+def race_runs(projs, run_id: str, args) -> list:
+    """Roda o run_sync de todas as cópias ao mesmo tempo. Retorna [(cópia, código, log)]."""
+    env = sync_env(run_id, args)
+    procs = []
+    for proj in projs:
+        log = proj.parent / f"run_sync_{proj.name}.log"
+        out = log.open("w", encoding="utf-8")
+        procs.append((proj, log, out, subprocess.Popen(["bash", str(proj / "src" / "run_sync.sh")],
+                                                       cwd=proj, env=env, stdout=out, stderr=subprocess.STDOUT)))
+    print(f"[replay] {len(procs)} run_sync em paralelo ({args.mode}) — saídas em {projs[0].parent}")
+    results = []
+    for proj, log, out, proc in procs:
+        results.append((proj, proc.wait(), log))
+        out.close()
+    return results
+
+
+def check_repo(proj: Path, regs, devs) -> list:
+    """NNNN repetido por letra e scripts novos que não chegaram ao repositório."""
+    problems = []
+    for reg in regs:
+        names = sorted(p.name for p in (proj / "src" / "Scripts" / reg["label"]).glob("*.sql"))
+        seqs = {}
+        for name in names:
+            seqs.setdefault(name[:4], []).append(name)
+        problems += [f"{reg['label']}: NNNN {seq} repetido ({', '.join(n)})" for seq, n in seqs.items() if len(n) > 1]
+        for initials in devs:
+            got = sum(1 for n in names if n.endswith(f".0.{reg['letter']}{initials}.sql"))
+            if got != reg["new"]:
+                problems.append(f"{reg['label']}: {got} script(s) de {initials} no repositório (esperado {reg['new']})")
+    return problems
+
+
+def check_db(pg, inst: dict, dbname: str, folder: Path, label: str) -> list:
+    """Catch-up na base: não pode reexecutar nada e o registro tem que bater com o HEAD."""
+    conn = adb.connect_db(pg, dict(inst, dbname=dbname))
+    problems = []
+    try:
+        try:
+            adb.apply_pending_repo_scripts(conn, folder, label)
+        except SystemExit:
+            conn.rollback()
+            problems.append(f"{label}: catch-up pós-corrida falhou (script reexecutado ou ausente)")
+        with conn.cursor() as cur:
+            cur.execute("select nm_arquivo from sistema.tb_sys_controle_versao")
+            rows = {r[0] for r in cur.fetchall()}
+        conn.rollback()
+    finally:
+        adb.close_db(conn)
+    head = {p.stem for p in folder.glob("*.sql")}
+    if head - rows:
+        problems.append(f"{label}: faltam no controle de versão: {', '.join(sorted(head - rows))}")
+    if rows - head:
+        problems.append(f"{label}: registros sem arquivo no repositório: {', '.join(sorted(rows - head))}")
+    return problems
+
+
+def cmd_race(args) -> int:
+    for tool in ("bash", "svn", "svnadmin"):
+        if not shutil.which(tool):
+            die(f"'{tool}' não encontrado no PATH")
+    if not 2 <= args.devs <= 26:
+        die("--devs deve estar entre 2 e 26")
+    pg, _ = adb.get_db_driver()
+    regs = registry([n.strip().lower() for n in args.systems.split(",") if n.strip()])
+    for reg in regs:
+        reg["new"] = args.new
+    devs = [f"R{chr(ord('A') + i)}" for i in range(args.devs)]
+    work = Path(args.work).resolve() if args.work else Path(tempfile.mkdtemp(prefix="replay-race-"))
+    work.mkdir(parents=True, exist_ok=True)
+    if any(work.iterdir()):
+        die(f"diretório de trabalho não está vazio: {work}")
+    print(f"[replay] diretório de trabalho: {work}")
+
+    instances, problems = [], []
+    try:
+        instances = parse_servers(args.pg) if args.pg else start_instances(work, args)
+        dbs, i = {}, 0   # (iniciais, sistema, alvo) -> (instância, base)
+        for reg in regs:
+            for tgt in ("test", "dev"):
+                for initials in devs:
+                    dbname = f"replay_{reg['name']}_{tgt}" if args.shared_db else \
+                        f"replay_{reg['name']}_{tgt}_{initials.lower()}"
+                    if args.shared_db and initials != devs[0]:
+                        dbs[(initials, reg["name"], tgt)] = dbs[(devs[0], reg["name"], tgt)]
+                        continue
+                    inst = instances[i % len(instances)]
+                    # bases compartilhadas já em dia: o catch-up concorrente não é o que se mede aqui
+                    prepare_db(pg, inst, dbname, reg, args.history - (0 if args.shared_db else args.behind))
+                    dbs[(initials, reg["name"], tgt)] = (inst, dbname)
+                    i += 1
+        url = seed_svn(work, regs, args)
+        install_barrier(work, args.devs)
+        projs = [build_project(work, regs, url,
+                               {(s, t): db for (ini, s, t), db in dbs.items() if ini == initials},
+                               args, name=f"dev_{initials}", initials=initials)
+                 for initials in devs]
+
+        run_id = f"race-{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}"
+        for proj, code, log in race_runs(projs, run_id, args):
+            if code != 0:
+                problems.append(f"{proj.name}: run_sync saiu com {code} (log em {log})")
+                print("\n".join(log.read_text(encoding="utf-8", errors="replace").splitlines()[-20:]),
+                      file=sys.stderr)
+        for proj in projs:
+            log = work / f"run_sync_{proj.name}.log"
+            renum = [ln for ln in log.read_text(encoding="utf-8", errors="replace").splitlines()
+                     if ln.startswith("[seq]")]
+            print(f"[replay] {proj.name}: " + ("; ".join(renum) if renum else "sem renumeração"))
+
+        if not problems:
+            for proj in projs:
+                run(["svn", "update", "--non-interactive", proj / "src" / "Scripts"])
+            problems += check_repo(projs[0], regs, devs)
+            checked = set()
+            for (initials, system, tgt), (inst, dbname) in dbs.items():
+                if (inst["port"], dbname) in checked:
+                    continue
+                checked.add((inst["port"], dbname))
+                reg = next(r for r in regs if r["name"] == system)
+                folder = work / f"dev_{initials}" / "src" / "Scripts" / reg["label"]
+                problems += check_db(pg, inst, dbname, folder, f"{dbname}@{inst['port']}")
+
+        (work / "result.json").write_text(json.dumps(dict(run_id=run_id, devs=devs, problems=problems),
+                                                     ensure_ascii=False, indent=2), encoding="utf-8")
+    finally:
+        stop_instances(instances, args)
+        if not args.keep:
+            shutil.rmtree(work, ignore_errors=True)
+
+    if problems:
+        print("== Corrida: FALHOU ==")
+        for p in problems:
+            print(f"  - {p}")
+        return 1
+    print(f"== Corrida: OK ({args.devs} desenvolvedores x {len(regs)} sistema(s) x {args.new} script(s)) ==")
+    return 0
+
+
+# =================== Relatório ===================
+
+def collect(proj: Path, run_id: str) -> dict:
+    path = proj / "src" / ".run_history.sqlite"
+    if not path.exists():
+        die(f"histórico não encontrado: {path}")
+    conn = sqlite3.connect(path)
+    try:
+        stages = [dict(stage=s, duration_s=d, status=st) for s, d, st in conn.execute(
+            "select stage, duration_s, status from events where run_id = ? and kind = 'stage' order by id",
+            (run_id,))]
+        targets = [dict(target=t, kind=k, scripts=n, duration_s=round(d or 0, 3), bytes=b or 0,
+                        blocks=bl or 0, rows=r or 0)
+                   for t, k, n, d, b, bl, r in conn.execute(
+            "select target, kind, count(*), sum(duration_s), sum(bytes), sum(blocks), sum(rows) from events"
+            " where run_id = ? and kind <> 'stage' group by target, kind order by target, kind", (run_id,))]
+    finally:
+        conn.close()
+    return dict(stages=stages, targets=targets)
+
+
+def print_report(result: dict):
+    sc = result["scale"]
+    print(f"== Replay {result['run_id']} ({result['mode']}) ==")
+    print(f"  sistemas={','.join(sc['systems'])} histórico={sc['history']} atrás(bases)={sc['behind']} "
+          f"atrás(wc)={sc['wc_behind']} novos={sc['new']} blocos={sc['blocks']} linhas/bloco={sc['rows']} "
+          f"instâncias={sc['pg_instances']}")
+    print(f"  total (wall) {result['wall_s']:8.1f}s")
+    print("== Etapas ==")
+    for s in result["stages"]:
+        print(f"  {s['stage']:<18} {s['duration_s']:8.1f}s  {s['status']}")
+    print("== Por base ==")
+    for t in result["targets"]:
+        rate = t["bytes"] / t["duration_s"] / 1024 if t["duration_s"] else 0
+        print(f"  {t['target']:<16} {t['kind']:<8} scripts={t['scripts']:<5} total={t['duration_s']:8.1f}s "
+              f"blocos={t['blocks']:<7} vazão={rate:8.0f} KiB/s")
+
+
+# =================== Comandos ===================
+
+def cmd_run(args) -> int:
+    if args.behind > args.history or args.wc_behind > args.history:
+        die("--behind/--wc-behind não podem passar de --history")
+    for tool in ("bash", "svn", "svnadmin"):
+        if not shutil.which(tool):
+            die(f"'{tool}' não encontrado no PATH")
+    pg, _ = adb.get_db_driver()
+    regs = registry([n.strip().lower() for n in args.systems.split(",") if n.strip()])
+    work = Path(args.work).resolve() if args.work else Path(tempfile.mkdtemp(prefix="replay-"))
+    work.mkdir(parents=True, exist_ok=True)
+    if any(work.iterdir()):
+        die(f"diretório de trabalho não está vazio: {work}")
+    print(f"[replay] diretório de trabalho: {work}")
+
+    instances = []
+    try:
+        instances = parse_servers(args.pg) if args.pg else start_instances(work, args)
+        dbs, i = {}, 0
+        for reg in regs:
+            for tgt in ("test", "dev"):
+                inst = instances[i % len(instances)]
+                dbname = f"replay_{reg['name']}_{tgt}"
+                prepare_db(pg, inst, dbname, reg, args.history - args.behind)
+                dbs[(reg["name"], tgt)] = (inst, dbname)
+                i += 1
+        url = seed_svn(work, regs, args)
+        proj = build_project(work, regs, url, dbs, args)
+
+        run_id = f"replay-{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}"
+        wall = run_sync(proj, run_id, args)
+        result = dict(run_id=run_id, mode=args.mode, wall_s=round(wall, 3), work=str(work),
+                      scale=dict(systems=[r["name"] for r in regs], history=args.history, behind=args.behind,
+                                 wc_behind=args.wc_behind, new=args.new, blocks=args.blocks, rows=args.rows,
+                                 width=args.width, pg_instances=len(instances), set=args.set),
+                      **collect(proj, run_id))
+        (work / "result.json").write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+        if args.json:
+            Path(args.json).write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+        print_report(result)
+    finally:
+        stop_instances(instances, args)
+        if not args.keep:
+            shutil.rmtree(work, ignore_errors=True)
+    return 0
+
+
+def cmd_report(args) -> int:
+    path = Path(args.work) / "result.json"
+    if not path.exists():
+        die(f"{path} não encontrado (use run --keep)")
+    print_report(json.loads(path.read_text(encoding="utf-8")))
+    return 0
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Replay do run_sync contra SVN e PostgreSQL locais.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("run", help="monta o ambiente, roda o run_sync e mostra os tempos")
+    p.add_argument("--systems", default="gestor,supervisor", help="sistemas (padrão: gestor,supervisor)")
+    p.add_argument("--history", type=int, default=200, help="scripts por sistema no repositório")
+    p.add_argument("--behind", type=int, default=50, help="scripts que faltam nas bases TEST/DEV")
+    p.add_argument("--wc-behind", type=int, help="scripts que chegam no svn update (padrão: --behind)")
+    p.add_argument("--new", type=int, default=1, help="novos scripts por sistema (2+ usa a caixa de entrada)")
+    p.add_argument("--blocks", type=int, default=10, help="blocos por script (create + inserts)")
+    p.add_argument("--rows", type=int, default=100, help="linhas por bloco de insert")
+    p.add_argument("--width", type=int, default=32, help="bytes de texto por linha (tamanho do script)")
+    p.add_argument("--mode", choices=("pipeline", "sequential"), default="pipeline")
+    p.add_argument("--pg-instances", type=int, default=1, help="instâncias locais (bases em rodízio)")
+    p.add_argument("--pg-bin", help="pasta de initdb/pg_ctl")
+    p.add_argument("--pg-conf", action="append", default=[], help="parâmetro do servidor local (ex.: fsync=off)")
+    p.add_argument("--pg", action="append", default=[], help="servidor existente host:porta:usuário:senha")
+    p.add_argument("--set", action="append", default=[], help="opção do config.ini da cópia (ex.: apply.engine=async)")
+    p.add_argument("--work", help="diretório de trabalho vazio (padrão: temporário)")
+    p.add_argument("--keep", action="store_true", help="mantém o diretório de trabalho")
+    p.add_argument("--json", help="grava o resultado também neste arquivo")
+    p = sub.add_parser("report", help="mostra de novo o resultado de um run --keep")
+    p.add_argument("--work", required=True)
+    p = sub.add_parser("race", help="desenvolvedores submetendo ao mesmo tempo (corrida pelo NNNN)")
+    p.add_argument("--devs", type=int, default=2, help="desenvolvedores simultâneos (cópias do projeto)")
+    p.add_argument("--systems", default="gestor", help="sistemas (padrão: gestor)")
+    p.add_argument("--history", type=int, default=20, help="scripts por sistema no repositório")
+    p.add_argument("--behind", type=int, default=5, help="scripts que faltam nas bases TEST/DEV")
+    p.add_argument("--new", type=int, default=1, help="novos scripts por desenvolvedor e sistema")
+    p.add_argument("--blocks", type=int, default=3, help="blocos por script (create + inserts)")
+    p.add_argument("--rows", type=int, default=10, help="linhas por bloco de insert")
+    p.add_argument("--width", type=int, default=8, help="bytes de texto por linha")
+    p.add_argument("--mode", choices=("pipeline", "sequential"), default="pipeline")
+    p.add_argument("--shared-db", action="store_true", help="todos usam as mesmas bases TEST/DEV")
+    p.add_argument("--pg-instances", type=int, default=1, help="instâncias locais (bases em rodízio)")
+    p.add_argument("--pg-bin", help="pasta de initdb/pg_ctl")
+    p.add_argument("--pg-conf", action="append", default=[], help="parâmetro do servidor local (ex.: fsync=off)")
+    p.add_argument("--pg", action="append", default=[], help="servidor existente host:porta:usuário:senha")
+    p.add_argument("--set", action="append", default=[], help="opção do config.ini das cópias")
+    p.add_argument("--work", help="diretório de trabalho vazio (padrão: temporário)")
+    p.add_argument("--keep", action="store_true", help="mantém o diretório de trabalho")
+    args = ap.parse_args()
+
+    if args.cmd == "run":
+        if args.wc_behind is None:
+            args.wc_behind = args.behind
+        if args.new < 1 or args.blocks < 1 or args.pg_instances < 1:
+            die("--new, --blocks e --pg-instances devem ser >= 1")
+        return cmd_run(args)
+    if args.cmd == "race":
+        args.wc_behind = 0
+        if args.new < 1 or args.blocks < 1 or args.pg_instances < 1:
+            die("--new, --blocks e --pg-instances devem ser >= 1")
+        return cmd_race(args)
+    return cmd_report(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
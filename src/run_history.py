@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Histórico de execuções (SQLite local) + detecção de regressão de desempenho.
+
+Cada etapa do run_sync (sync_svn, preprocess_sql, apply_db_updates,
+post_sync_sql) e cada script executado nas bases gravam duração, bytes,
+blocos e linhas afetadas em src/.run_history.sqlite. As etapas de um mesmo
+run_sync compartilham o identificador SYNC_RUN_ID (exportado pelo wrapper).
+
+Relatório:
+    python src/run_history.py report                 # tendências por script/base
+    python src/run_history.py report --target GESTOR/TEST --last 20
+    python src/run_history.py regressions [--run ID] # só o que ficou lento
+
+A mesma base guarda, por alvo (host:porta/base), o hash do conteúdo dos novos
+scripts já aplicados com sucesso (tabela applied): um rerun com o mesmo
+conteúdo pula a execução em TEST/DEV. Esse registro vale mesmo com
+enabled = false, pois evita reexecutar scripts.
+
+Configuração opcional (config.ini):
+    [history]
+    enabled         = true
+    path            = /caminho/run_history.sqlite
+    slowdown_factor = 2.0   ; lento = duração > fator x mediana histórica
+    min_samples     = 3     ; amostras mínimas para comparar
+"""
+
+import os
+import sys
+import atexit
+import socket
+import sqlite3
+import threading
+import argparse
+import statistics
+from time import monotonic
+from pathlib import Path
+from datetime import datetime
+from contextlib import contextmanager
+from configparser import ConfigParser
+
+THIS_DIR     = Path(__file__).resolve().parent        # src/
+PROJECT_ROOT = THIS_DIR.parent                        # raiz
+CONFIG_PATH  = PROJECT_ROOT / "config.ini"
+DEFAULT_DB   = THIS_DIR / ".run_history.sqlite"
+
+SCHEMA = """
+create table if not exists events (
+    id          integer primary key autoincrement,
+    run_id      text not null,
+    ts          text not null,
+    host        text,
+    stage       text not null,
+    kind        text not null,      -- stage | catchup | new | mark | analyze
+    system      text,
+    target      text,
+    script      text,
+    duration_s  real,
+    bytes       integer,
+    blocks      integer,
+    rows        integer,
+    status      text not null       -- ok | fail
+);
+create index if not exists ix_events_script on events (script, kind);
+create index if not exists ix_events_target on events (target, kind);
+create index if not exists ix_events_run    on events (run_id);
+create table if not exists applied (
+    dsn          text not null,     -- host:porta/base
+    kind         text not null,     -- new | mark
+    content_hash text not null,
+    script       text,
+    run_id       text,
+    ts           text not null,
+    primary key (dsn, kind, content_hash)
+);
+"""
+
+RUN_ID = os.environ.get("SYNC_RUN_ID") or f"{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}"
+
+_SETTINGS = None
+_CONN = None
+_LOCK = threading.RLock()   # a conexão é compartilhada pelas threads do pipeline/engine async
+_OPEN_STAGES = []           # totais {bytes, blocks, rows} das etapas abertas neste processo
+
+
+def settings() -> dict:
+    global _SETTINGS
+    if _SETTINGS is None:
+        cfg = ConfigParser()
+        if CONFIG_PATH.exists():
+            cfg.read(CONFIG_PATH, encoding="utf-8")
+        _SETTINGS = dict(
+            enabled=(os.environ.get("SYNC_HISTORY", "1") != "0"
+                     and cfg.getboolean("history", "enabled", fallback=True)),
+            path=Path(cfg.get("history", "path", fallback="").strip() or DEFAULT_DB),
+            factor=cfg.getfloat("history", "slowdown_factor", fallback=2.0),
+            min_samples=cfg.getint("history", "min_samples", fallback=3),
+        )
+    return _SETTINGS
+
+
+@contextmanager
+def _db():
+    """
+    Conexão única do processo: aberta (e o schema criado) na primeira vez,
+    fechada na saída; o uso é serializado entre threads.
+    """
+    global _CONN
+    with _LOCK:
+        if _CONN is None:
+            conn = sqlite3.connect(settings()["path"], timeout=10, check_same_thread=False)
+            conn.executescript(SCHEMA)
+            _CONN = conn
+            atexit.register(_close)
+        yield _CONN
+
+
+def _close():
+    global _CONN
+    with _LOCK:
+        if _CONN is not None:
+            _CONN.close()
+            _CONN = None
+
+
+def record(stage: str, kind: str, duration_s: float, status: str = "ok", system: str = "",
+           target: str = "", script: str = "", nbytes: int = 0, blocks: int = 0, rows: int = 0):
+    """Grava um evento. Nunca derruba o fluxo principal por falha do histórico."""
+    if kind != "stage":
+        with _LOCK:
+            for totals in _OPEN_STAGES:
+                totals["bytes"] += nbytes or 0
+                totals["blocks"] += blocks or 0
+                totals["rows"] += rows or 0
+    if not settings()["enabled"]:
+        return
+    try:
+        with _db() as conn, conn:
+            conn.execute(
+                "insert into events (run_id, ts, host, stage, kind, system, target, script,"
+                " duration_s, bytes, blocks, rows, status) values (?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                (RUN_ID, datetime.now().isoformat(timespec="seconds"), socket.gethostname(),
+                 stage, kind, system, target.strip(), script, round(duration_s, 3),
+                 nbytes, blocks, rows, status),
+            )
+    except Exception as e:
+        print(f"[history][warn] não foi possível gravar histórico: {e}", file=sys.stderr)
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Mede a etapa inteira (inclusive quando termina com sys.exit). O evento
+    da etapa leva a soma de bytes, blocos e linhas dos scripts gravados
+    durante ela.
+    """
+    t0 = monotonic()
+    status = "fail"
+    totals = dict(bytes=0, blocks=0, rows=0)
+    with _LOCK:
+        _OPEN_STAGES.append(totals)
+    try:
+        yield
+        status = "ok"
+    except SystemExit as e:
+        status = "ok" if not e.code else "fail"
+        raise
+    finally:
+        with _LOCK:
+            _OPEN_STAGES.remove(totals)
+        record(name, "stage", monotonic() - t0, status=status,
+               nbytes=totals["bytes"], blocks=totals["blocks"], rows=totals["rows"])
+
+
+# =================== Idempotência ===================
+
+def applied_at(dsn: str, kind: str, content_hash: str):
+    """Quando (ts, run_id) esse conteúdo já foi aplicado com sucesso no alvo; None se nunca."""
+    if not settings()["path"].exists():
+        return None
+    try:
+        with _db() as conn:
+            return conn.execute(
+                "select ts, run_id from applied where dsn = ? and kind = ? and content_hash = ?",
+                (dsn, kind, content_hash),
+            ).fetchone()
+    except Exception as e:
+        print(f"[history][warn] não foi possível consultar scripts aplicados: {e}", file=sys.stderr)
+        return None
+
+
+def mark_applied(dsn: str, kind: str, content_hash: str, script: str):
+    try:
+        with _db() as conn, conn:
+            conn.execute(
+                "insert or replace into applied (dsn, kind, content_hash, script, run_id, ts)"
+                " values (?,?,?,?,?,?)",
+                (dsn, kind, content_hash, script, RUN_ID, datetime.now().isoformat(timespec="seconds")),
+            )
+    except Exception as e:
+        print(f"[history][warn] não foi possível registrar script aplicado: {e}", file=sys.stderr)
+
+
+# =================== Análise ===================
+
+def _script_history(conn, script: str, kind: str, before_id: int):
+    rows = conn.execute(
+        "select duration_s from events where script = ? and kind = ? and status = 'ok' and id < ?",
+        (script, kind, before_id),
+    ).fetchall()
+    return [r[0] for r in rows if r[0] is not None]
+
+
+def find_regressions(run_id: str = None):
+    """
+    Eventos OK do run (padrão: o atual) cujo tempo passou de fator x mediana
+    histórica: para o mesmo script/tipo (qualquer base) e, por base, da vazão
+    em bytes/s de catch-up e novo script.
+    Retorna lista de mensagens.
+    """
+    st = settings()
+    if not st["enabled"] or not st["path"].exists():
+        return []
+    run_id = run_id or RUN_ID
+    out = []
+    with _db() as conn:
+        evs = conn.execute(
+            "select id, kind, target, script, duration_s, bytes from events"
+            " where run_id = ? and status = 'ok' and kind in ('catchup', 'new')",
+            (run_id,),
+        ).fetchall()
+        for ev_id, kind, target, script, dur, nbytes in evs:
+            hist = _script_history(conn, script, kind, ev_id)
+            if len(hist) >= st["min_samples"]:
+                med = statistics.median(hist)
+                if med > 0 and dur > st["factor"] * med:
+                    out.append(f"{script} ({kind}) em {target}: {dur:.1f}s vs mediana {med:.1f}s "
+                               f"({dur / med:.1f}x)")
+            # vazão por base: bytes/s abaixo de mediana/fator
+            if nbytes and dur > 0:
+                rates = [b / d for b, d in conn.execute(
+                    "select bytes, duration_s from events where target = ? and kind = ? and status = 'ok'"
+                    " and id < ? and bytes > 0 and duration_s > 0",
+                    (target, kind, ev_id),
+                ).fetchall()]
+                if len(rates) >= st["min_samples"]:
+                    med_rate = statistics.median(rates)
+                    rate = nbytes / dur
+                    if rate * st["factor"] < med_rate:
+                        out.append(f"{target} ({kind}) {script}: {rate / 1024:.0f} KiB/s vs mediana "
+                                   f"{med_rate / 1024:.0f} KiB/s")
+    return out
+
+
+def warn_regressions(run_id: str = None):
+    for msg in find_regressions(run_id):
+        print(f"[LENTO] {msg}")
+
+
+def report(target: str = None, script: str = None, last: int = 10):
+    st = settings()
+    if not st["path"].exists():
+        print("[history] nenhum histórico ainda.")
+        return
+    with _db() as conn:
+        print("== Etapas (últimos runs) ==")
+        for stg, n, mx, lst in conn.execute(
+            "select stage, count(*), max(duration_s),"
+            "       (select duration_s from events e2 where e2.stage = e.stage and e2.kind = 'stage'"
+            "         order by id desc limit 1)"
+            "  from events e where kind = 'stage' group by stage order by stage"
+        ).fetchall():
+            durs = [r[0] for r in conn.execute(
+                "select duration_s from events where stage = ? and kind = 'stage' and status = 'ok'", (stg,))]
+            med = statistics.median(durs) if durs else 0
+            print(f"  {stg:<18} runs={n:<4} mediana={med:8.1f}s  máx={mx:8.1f}s  último={lst:8.1f}s")
+
+        print("== Por base ==")
+        where, args = "kind in ('catchup', 'new', 'analyze')", []
+        if target:
+            where += " and target = ?"
+            args.append(target)
+        for tgt, kind, n, secs, nbytes in conn.execute(
+            f"select target, kind, count(*), sum(duration_s), sum(bytes) from events"
+            f" where {where} and status = 'ok' group by target, kind order by target, kind", args
+        ).fetchall():
+            rate = (nbytes or 0) / secs / 1024 if secs else 0
+            print(f"  {tgt:<16} {kind:<8} scripts={n:<5} total={secs:9.1f}s  vazão={rate:9.0f} KiB/s")
+
+        print(f"== Scripts (últimos {last}) ==")
+        where, args = "kind in ('catchup', 'new', 'analyze')", []
+        if target:
+            where += " and target = ?"
+            args.append(target)
+        if script:
+            where += " and script = ?"
+            args.append(script)
+        for ts, tgt, kind, scr, dur, blocks, rows, status in conn.execute(
+            f"select ts, target, kind, script, duration_s, blocks, rows, status from events"
+            f" where {where} order by id desc limit ?", (*args, last)
+        ).fetchall():
+            print(f"  {ts} {tgt:<16} {kind:<8} {scr:<18} {dur:8.1f}s blocos={blocks:<6} linhas={rows:<9} {status}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Histórico de execuções do sync_scripts.")
+    sub = ap.add_subparsers(dest="cmd")
+    rp = sub.add_parser("report", help="tendências por etapa, base e script")
+    rp.add_argument("--target", help="ex.: GESTOR/TEST")
+    rp.add_argument("--script", help="ex.: 9342.0.GJO.sql")
+    rp.add_argument("--last", type=int, default=10)
+    rg = sub.add_parser("regressions", help="eventos mais lentos que a mediana histórica")
+    rg.add_argument("--run", help="SYNC_RUN_ID (padrão: o run mais recente)")
+    args = ap.parse_args()
+
+    if args.cmd == "regressions":
+        run_id = args.run
+        if not run_id and settings()["path"].exists():
+            with _db() as conn:
+                row = conn.execute("select run_id from events order by id desc limit 1").fetchone()
+            run_id = row[0] if row else None
+        msgs = find_regressions(run_id) if run_id else []
+        for m in msgs:
+            print(f"[LENTO] {m}")
+        if not msgs:
+            print("[history] nenhuma regressão detectada.")
+    else:
+        report(getattr(args, "target", None), getattr(args, "script", None), getattr(args, "last", 10))
+
+
+if __name__ == "__main__":
+    main()
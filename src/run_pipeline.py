@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Executa sync_svn + preprocess_sql + apply_db_updates em pipeline, sobrepondo
+a latência do svn com a das bases (usado pelo run_sync.sh no lugar das três
+etapas sequenciais).
+
+O que NÃO depende do svn update roda em paralelo com ele:
+  - tratamento dos arquivos fonte (o NNNN é conferido e, se preciso,
+    reescrito quando o svn termina — ver preprocess_sql.refresh_script_id);
+  - conexão com TEST/DEV, leitura de tb_sys_controle_versao e catch-up dos
+    scripts que JÁ estavam na pasta local antes do update.
+
+Quando o svn termina, cada base aplica só os scripts que chegaram com o
+update e segue para o novo script (TEST) e fn_atualiza_script (DEV) — em
+lote, para cada novo script do sistema, em ordem.
+Se o update trouxer um NNNN abaixo do último já aplicado (comitado atrasado)
+e ainda não registrado na base, o pipeline aborta em vez de pulá-lo.
+Sistemas registrados (systems.py) são independentes e correm em paralelo.
+
+Com [apply] engine = async a etapa de bases vai inteira para o
+apply_db_async (todas as bases em paralelo) depois do svn e do preprocess:
+sem o catch-up antecipado, que é do engine sync.
+
+Qualquer falha encerra com código != 0 (o trap do run_sync.sh restaura os
+backups), igual ao fluxo sequencial.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import sync_svn
+import systems
+import preprocess_sql
+import profiling
+import run_history
+import apply_db_updates as adb
+
+
+def run_svn_sync():
+    with run_history.stage("sync_svn"):
+        _run_svn_sync()
+
+
+def _run_svn_sync():
+    sync_svn.ensure_svn_installed()
+    url, user, pw = sync_svn.get_svn_settings()
+    cfg_dir = sync_svn.make_no_proxy_config_dir()
+    env = sync_svn.clean_proxy_env()
+    sync_svn.sync_scripts(url, user, pw, cfg_dir, env)
+    print("✅ Pronto! Pasta sincronizada.")
+
+
+def run_preprocess(regs):
+    with run_history.stage("preprocess_sql"):
+        _run_preprocess(regs)
+
+
+def _run_preprocess(regs):
+    author, initials = preprocess_sql.load_config()
+    with ThreadPoolExecutor(max_workers=max(1, len(regs))) as ex:
+        for f in [ex.submit(preprocess_sql.process_system, reg, author, initials) for reg in regs]:
+            f.result()
+
+
+def warm_target(pg, db_cfg: dict, base_dir, label: str, local_names: set,
+                svn_done: threading.Event, svn_ok: threading.Event):
+    """
+    Conecta, lê a versão da base e adianta o catch-up com o que já era local;
+    depois espera o svn e aplica apenas o que chegou. Retorna a conexão aberta.
+    """
+    adb.snapshot_fast_forward(pg, db_cfg, base_dir, label)
+    conn = adb.connect_db(pg, db_cfg)
+    print(f"[{label}] Catch-up antecipado (scripts já locais)...")
+    adb.apply_pending_repo_scripts(conn, base_dir, label, only_names=local_names)
+    svn_done.wait()
+    if not svn_ok.is_set():
+        return conn  # svn falhou: o erro é propagado pela thread principal
+    check_late_arrivals(conn, db_cfg, base_dir, label, local_names)
+    print(f"[{label}] Catch-up dos scripts recebidos do svn...")
+    adb.apply_pending_repo_scripts(conn, base_dir, label)
+    return conn
+
+
+def check_late_arrivals(conn, db_cfg: dict, base_dir, label: str, local_names: set):
+    """
+    O catch-up antecipado pode ter passado de um NNNN que só chegou agora com o
+    svn (comitado atrasado, ex.: renumeração de outro desenvolvedor). O
+    catch-up segue por "seq > último aplicado" e nunca o aplicaria: aborta.
+    """
+    current_seq, current_name = adb.get_last_applied_seq(conn)
+    conn.rollback()
+    late = [name for seq, _, name in adb.list_repo_scripts_for_dir(base_dir)
+            if name not in local_names and seq <= current_seq
+            and not adb.version_registered(db_cfg, name[:-4], conn)]
+    if late:
+        adb.die(f"{label.strip()}: {', '.join(late)} chegou(aram) com o svn abaixo do último aplicado "
+                f"({current_name}) e não está(ão) em sistema.tb_sys_controle_versao; o catch-up não os "
+                f"aplicaria. Aplique-os manualmente (ou restaure a base) e rode de novo.")
+
+
+def finish_system(items, f_test, f_dev):
+    """Novos scripts (em ordem) em TEST e marcação em DEV, depois do catch-up das duas bases."""
+    test_conn, dev_conn = f_test.result(), f_dev.result()
+    sys_label = items[0]["system"].upper()
+    try:
+        for item in items:
+            adb.apply_new_script_test(test_conn, item["blocks"], item["script_id"], sys_label, item["content_hash"])
+            adb.mark_script_dev(dev_conn, item["script_id"], sys_label, item["content_hash"])
+    finally:
+        adb.close_db(test_conn)
+        adb.close_db(dev_conn)
+
+
+def main():
+    cfg = adb.load_cfg()
+    adb.load_apply_opts(cfg)
+    pg, ver = adb.get_db_driver()
+    print(f"[INFO] Usando driver: {'psycopg3' if ver == 3 else 'psycopg2'}")
+
+    regs = systems.present()
+    async_engine = adb.get_apply_opt(cfg, "engine", "sync").lower() == "async"
+    svn_done = threading.Event()
+    svn_ok = threading.Event()
+
+    def on_svn_finished(f):
+        if f.exception() is None:
+            svn_ok.set()
+        svn_done.set()
+
+    with ThreadPoolExecutor(max_workers=2 + 3 * len(regs)) as ex:
+        f_svn = ex.submit(run_svn_sync)
+        f_svn.add_done_callback(on_svn_finished)
+        f_pre = ex.submit(run_preprocess, regs)
+
+        targets = {}
+        for reg in ([] if async_engine else regs):
+            system, base_dir = reg["name"], reg["scripts_dir"]
+            sys_label = system.upper()
+            local_names = {name for _, _, name in adb.list_repo_scripts_for_dir(base_dir)}
+            test_cfg, dev_cfg = adb.load_db_pair(cfg, system)
+            targets[system] = (
+                ex.submit(warm_target, pg, test_cfg, base_dir, f"{sys_label}/TEST", local_names, svn_done, svn_ok),
+                ex.submit(warm_target, pg, dev_cfg,  base_dir, f"{sys_label}/DEV ", local_names, svn_done, svn_ok),
+            )
+
+        # Falha no svn ou no preprocess propaga o erro (SystemExit incluso)
+        f_svn.result()
+        f_pre.result()
+
+        # Pós-svn: garante que o NNNN escolhido em paralelo continua livre
+        for reg in regs:
+            preprocess_sql.refresh_system(reg)
+
+        inputs = adb.load_new_inputs()
+        if async_engine and inputs:
+            import apply_db_async
+            apply_db_async.run_engine(cfg, inputs)
+        groups = adb.group_by_system(inputs)
+        finals = [ex.submit(finish_system, groups[system], f_test, f_dev)
+                  for system, (f_test, f_dev) in targets.items()]
+        for f in finals:
+            f.result()
+
+        adb.snapshot_refresh(pg, cfg, inputs)
+        run_history.warn_regressions()
+
+    if not regs:
+        print(f"[INFO] Nenhum novo arquivo tratado encontrado ({systems.describe_inputs()}).")
+        return
+    print("[OK] pipeline svn/preprocess/apply finalizado com sucesso.")
+
+
+if __name__ == "__main__":
+    with profiling.stage("pipeline"), run_history.stage("pipeline"):
+        main()
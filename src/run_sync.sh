@@ -17,20 +17,47 @@ fi
 # Python (permite sobrescrever via env var PYTHON=/caminho/do/python)
 PYTHON="${PYTHON:-python3}"
 
+# Identificador comum das etapas no histórico de execuções (run_history.py)
+export SYNC_RUN_ID="${SYNC_RUN_ID:-$(date +%Y%m%d-%H%M%S)-$$}"
+
+# --profile[=DIR]: perfil de CPU/memória de todas as etapas (profiling.py); não vai para as etapas
+ARGS=()
+for arg in "$@"; do
+  case "$arg" in
+    --profile)   export SYNC_PROFILE=1 ;;
+    --profile=*) export SYNC_PROFILE="${arg#--profile=}" ;;
+    *)           ARGS+=("$arg") ;;
+  esac
+done
+set -- ${ARGS[@]+"${ARGS[@]}"}
+
 restore_on_error() {
   echo "[ERR] falha detectada — restaurando backups, se houver..."
   "$PYTHON" "$SCRIPT_DIR/restore_backups.py" || true
 }
 trap restore_on_error ERR INT
 
-# 1) Sincroniza SVN
-"$PYTHON" "$SCRIPT_DIR/sync_svn.py" "$@"
+if [ -n "${SYNC_QUEUE_URL:-}" ]; then
+  # Modo fila: trata localmente e envia ao serviço (sync_queue.py serve), que
+  # faz catch-up, TEST/DEV e svn commit por sistema, em série
+  "$PYTHON" "$SCRIPT_DIR/preprocess_sql.py"
+  "$PYTHON" "$SCRIPT_DIR/sync_queue.py" submit "$@"
+  exit 0
+fi
+
+if [ "${SYNC_SEQUENTIAL:-0}" = "1" ]; then
+  # 1) Sincroniza SVN
+  "$PYTHON" "$SCRIPT_DIR/sync_svn.py" "$@"
 
-# 2) Preprocessa gestor.sql/supervisor.sql (gera cabeçalho, separadores, ANSI, sidecar)
-"$PYTHON" "$SCRIPT_DIR/preprocess_sql.py"
+  # 2) Preprocessa gestor.sql/supervisor.sql (gera cabeçalho, separadores, ANSI, sidecar)
+  "$PYTHON" "$SCRIPT_DIR/preprocess_sql.py"
 
-# 3) Aplica updates nas bases (usa arquivos em ANSI/cp1252)
-"$PYTHON" "$SCRIPT_DIR/apply_db_updates.py"
+  # 3) Aplica updates nas bases (usa arquivos em ANSI/cp1252)
+  "$PYTHON" "$SCRIPT_DIR/apply_db_updates.py"
+else
+  # 1-3) svn, preprocess e bases em pipeline (conexão/catch-up sobrepostos ao svn update)
+  "$PYTHON" "$SCRIPT_DIR/run_pipeline.py"
+fi
 
 # 4) Gera arquivo numerado em Scripts/<Sistema>, faz svn add/commit e limpa fontes/backup
 "$PYTHON" "$SCRIPT_DIR/post_sync_sql.py"
@@ -20,18 +20,56 @@ if not defined PYEXE (
   goto :fail
 )
 
-echo [1/4] Sincronizando Scripts (svn)...
-%PYEXE% "%SCRIPT_DIR%sync_svn.py" %* || goto :fail
+REM === Identificador comum das etapas no historico de execucoes (run_history.py) ===
+if not defined SYNC_RUN_ID set "SYNC_RUN_ID=win-%RANDOM%%RANDOM%"
 
-echo [2/4] Pre-processando gestor.sql/supervisor.sql...
-%PYEXE% "%SCRIPT_DIR%preprocess_sql.py" || goto :fail
+REM === --profile[=DIR]: perfil de CPU/memoria de todas as etapas (profiling.py); nao vai para as etapas ===
+REM O cmd separa "--profile=DIR" em dois argumentos: o seguinte, se nao comecar com "-", e o DIR
+set "ARGS="
+:parse_args
+if "%~1"=="" goto :args_done
+if /i "%~1"=="--profile" (
+  set "SYNC_PROFILE=1"
+  set "NEXT=%~2"
+  if defined NEXT if not "!NEXT:~0,1!"=="-" (
+    set "SYNC_PROFILE=!NEXT!"
+    shift
+  )
+  shift
+  goto :parse_args
+)
+set ARGS=!ARGS! %1
+shift
+goto :parse_args
+:args_done
+
+if defined SYNC_QUEUE_URL (
+  echo [1/2] Pre-processando gestor.sql/supervisor.sql...
+  %PYEXE% "%SCRIPT_DIR%preprocess_sql.py" || goto :fail
+
+  echo [2/2] Enviando para a fila ^(%SYNC_QUEUE_URL%^)...
+  %PYEXE% "%SCRIPT_DIR%sync_queue.py" submit !ARGS! || goto :fail
+  goto :ok
+)
 
-echo [3/4] Aplicando atualizacoes nas bases (teste/dev)...
-%PYEXE% "%SCRIPT_DIR%apply_db_updates.py" || goto :fail
+if "%SYNC_SEQUENTIAL%"=="1" (
+  echo [1/4] Sincronizando Scripts ^(svn^)...
+  %PYEXE% "%SCRIPT_DIR%sync_svn.py" !ARGS! || goto :fail
+
+  echo [2/4] Pre-processando gestor.sql/supervisor.sql...
+  %PYEXE% "%SCRIPT_DIR%preprocess_sql.py" || goto :fail
+
+  echo [3/4] Aplicando atualizacoes nas bases ^(teste/dev^)...
+  %PYEXE% "%SCRIPT_DIR%apply_db_updates.py" || goto :fail
+) else (
+  echo [1-3/4] svn, pre-processamento e bases em pipeline...
+  %PYEXE% "%SCRIPT_DIR%run_pipeline.py" || goto :fail
+)
 
 echo [4/4] Gerando arquivo numerado, commitando e limpando fontes...
 %PYEXE% "%SCRIPT_DIR%post_sync_sql.py" || goto :fail
 
+:ok
 echo.
 echo [OK] Fluxo concluido com sucesso.
 popd >nul
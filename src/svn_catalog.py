@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Catálogo dos scripts versionados: de onde vêm a lista (nome/revisão) e o
+conteúdo dos scripts que o catch-up precisa executar.
+
+Dois modos ([svn] catalog no config.ini ou SVN_CATALOG):
+  - wc     (padrão): working copy completa em src/Scripts, como sempre;
+  - remote : a lista vem de `svn ls --xml` na URL configurada (uma chamada por
+             pasta de sistema) e só os scripts PENDENTES de alguma base são
+             baixados com `svn cat`, para um cache local imutável chaveado por
+             caminho@revisão. O sync_svn mantém em src/Scripts apenas uma
+             working copy esparsa (pastas vazias), suficiente para o post_sync
+             fazer svn add/commit — uma máquina nova fica pronta em segundos.
+
+Configuração (config.ini):
+    [svn]
+    catalog    = remote
+    cache_dir  =          ; padrão: src/.svn_cache
+    fetch_jobs = 4        ; downloads svn cat em paralelo
+"""
+
+import os
+import threading
+import subprocess
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import sync_svn
+
+SCRIPTS_DIR = sync_svn.SCRIPTS_DIR
+DEFAULT_CACHE = sync_svn.THIS_DIR / ".svn_cache"
+
+_LISTINGS: dict = {}      # pasta -> [(nome, revisão)]
+_LOCK = threading.Lock()
+_SVN = None               # (url, opts, env)
+_MODE = None
+
+
+def remote() -> bool:
+    global _MODE
+    if _MODE is None:
+        _MODE = sync_svn.catalog_mode()
+    return _MODE == "remote"
+
+
+def cache_dir() -> Path:
+    raw = sync_svn.load_config().get("svn", "cache_dir", fallback="").strip()
+    return Path(raw) if raw else DEFAULT_CACHE
+
+
+def _svn():
+    global _SVN
+    if _SVN is None:
+        url, user, pw = sync_svn.get_svn_settings()
+        cfg_dir = sync_svn.make_no_proxy_config_dir()
+        _SVN = (url.rstrip("/"), sync_svn.svn_common_opts(user, pw, cfg_dir), sync_svn.clean_proxy_env())
+    return _SVN
+
+
+def _rel(folder: Path) -> str:
+    return folder.resolve().relative_to(SCRIPTS_DIR.resolve()).as_posix()
+
+
+def list_remote(folder: Path):
+    """
+    [(nome, revisão do último commit)] da pasta no HEAD do repositório.
+    Uma chamada por pasta e processo; vazio no modo wc.
+    """
+    if not remote():
+        return []
+    rel = _rel(folder)
+    with _LOCK:
+        if rel in _LISTINGS:
+            return _LISTINGS[rel]
+    url, opts, env = _svn()
+    res = subprocess.run(["svn", "list", "--xml", *opts, f"{url}/{rel}@HEAD"],
+                         text=True, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if res.returncode != 0:
+        raise RuntimeError(f"svn list falhou em {rel}: {(res.stderr or '').strip()}")
+    entries = []
+    for e in ET.fromstring(res.stdout).iter("entry"):
+        if e.get("kind") != "file":
+            continue
+        commit = e.find("commit")
+        entries.append(((e.findtext("name") or "").strip(),
+                        int(commit.get("revision", "0")) if commit is not None else 0))
+    with _LOCK:
+        _LISTINGS[rel] = entries
+    return entries
+
+
+def invalidate(folder: Path = None):
+    """Descarta a listagem memorizada (processos longos, ex.: sync_queue.py)."""
+    with _LOCK:
+        if folder is None:
+            _LISTINGS.clear()
+        else:
+            _LISTINGS.pop(_rel(folder), None)
+
+
+def cache_path(folder: Path, name: str, rev: int) -> Path:
+    return cache_dir() / _rel(folder) / f"{name}@{rev}"
+
+
+def fetch(path: Path) -> Path:
+    """Baixa (svn cat) o script do cache_path se ainda não estiver no cache."""
+    if path.exists():
+        return path
+    rel_dir = path.parent.relative_to(cache_dir()).as_posix()
+    name, rev = path.name.rsplit("@", 1)
+    url, opts, env = _svn()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + f".tmp{os.getpid()}-{threading.get_ident()}")
+    with open(tmp, "wb") as out:
+        res = subprocess.run(["svn", "cat", *opts, f"{url}/{rel_dir}/{name}@{rev}"],
+                             env=env, stdout=out, stderr=subprocess.PIPE)
+    if res.returncode != 0:
+        tmp.unlink(missing_ok=True)
+        raise RuntimeError(f"svn cat falhou em {rel_dir}/{name}@{rev}: "
+                           f"{res.stderr.decode('utf-8', errors='replace').strip()}")
+    os.replace(tmp, path)
+    return path
+
+
+def ensure_local(items):
+    """
+    items: [(seq, caminho, nome)] de list_repo_scripts_for_dir.
+    No modo remote baixa em paralelo os que faltam no cache; no modo wc não faz nada.
+    """
+    missing = [p for _, p, _ in items if not p.exists()]
+    if not missing or not remote():
+        return items
+    jobs = sync_svn.load_config().getint("svn", "fetch_jobs", fallback=4)
+    print(f"[svn] baixando {len(missing)} script(s) para o cache ({cache_dir()})...")
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as ex:
+        list(ex.map(fetch, missing))
+    return items
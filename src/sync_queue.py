@@ -0,0 +1,543 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fila de submissões (modo serviço): em vez de cada desenvolvedor rodar o
+catch-up de TEST/DEV e o svn commit da própria máquina (e colidir nos locks
+de TEST e no NNNN), uma máquina roda o serviço e os desenvolvedores só
+enviam o arquivo já tratado pelo preprocess.
+
+Servidor:
+    python src/sync_queue.py serve
+
+  - um worker (thread) por sistema registrado (systems.py): as etapas de
+    banco e de svn de um sistema rodam em série, uma submissão por vez;
+    sistemas diferentes correm em paralelo;
+  - conexões TEST/DEV ficam abertas entre as submissões (testadas com
+    `select 1` e reabertas se caírem);
+  - a working copy em src/Scripts é sincronizada uma vez na subida e, a cada
+    submissão, só a pasta do sistema recebe `svn update` (sob um lock da WC,
+    compartilhado pelos sistemas);
+  - cada submissão: confere/reescreve o NNNN contra a pasta atualizada,
+    catch-up de TEST e DEV, novo script em TEST, fn_atualiza_script em DEV,
+    grava o arquivo numerado em src/Scripts/<Sistema> e faz svn add/commit.
+    Se o svn falhar, o arquivo não comitado é removido da WC; reenviar o mesmo
+    conteúdo não reexecuta as bases (idempotência do apply_db_updates).
+  - snapshots ([snapshots]) e o engine async não são usados pelo serviço.
+
+Cliente (no lugar de run_pipeline + post_sync; run_sync.sh e
+run_sync_windows.cmd usam quando SYNC_QUEUE_URL estiver definido):
+    python src/sync_queue.py submit            # envia e acompanha a saída
+    python src/sync_queue.py submit --poll 2   # acompanha por consulta
+    python src/sync_queue.py submit --detach   # só enfileira
+    python src/sync_queue.py status <job>      # consulta um job
+
+  Envia cada fonte presente na raiz (gestor.sql, ...). Job OK: apaga a fonte
+  e o backup do preprocess; falha: restaura o backup e sai com código 1.
+
+API HTTP (JSON):
+    POST /jobs?system=<nome>&source=<arquivo>   corpo = bytes do arquivo tratado
+    GET  /jobs                                  jobs conhecidos
+    GET  /jobs/<id>?since=<n>                   estado + saída a partir do trecho n
+    GET  /jobs/<id>/stream                      saída em texto até o fim do job
+
+Configuração (config.ini):
+    [queue]
+    host  = 127.0.0.1   ; interface do serviço (0.0.0.0 para a rede: exige token)
+    port  = 8765
+    token =             ; exigido no cabeçalho X-Queue-Token (obrigatório fora do loopback)
+    keep  = 100         ; jobs finalizados mantidos em memória
+    url   =             ; cliente: http://servidor:8765 (ou SYNC_QUEUE_URL)
+"""
+
+import os
+import re
+import sys
+import hmac
+import json
+import time
+import queue
+import socket
+import ipaddress
+import argparse
+import threading
+import traceback
+import itertools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError, URLError
+from urllib.parse import parse_qs, quote, urlparse
+from urllib.request import Request, urlopen
+
+import apply_db_updates as adb
+import post_sync_sql as psync
+import run_history
+import svn_catalog
+import sync_svn
+import systems
+
+DEFAULT_PORT = 8765
+
+# Um sistema por vez mexe na working copy (svn update/add/commit)
+SVN_LOCK = threading.Lock()
+
+# Job em execução na thread atual (para direcionar a saída)
+_LOCAL = threading.local()
+
+ID_RE = re.compile(r"^(\d{4})\.0\.([A-Za-z])([A-Za-z]{2})$")
+
+
+def queue_opt(key: str, fallback: str = "") -> str:
+    return sync_svn.load_config().get("queue", key, fallback=fallback).strip()
+
+
+# =================== Jobs ===================
+
+class Job:
+    """Uma submissão: estado e saída (lista de trechos) acompanhados pelos clientes."""
+
+    def __init__(self, job_id: str, system: str, source: str, data: bytes):
+        self.id, self.system, self.source, self.data = job_id, system, source, data
+        self.status = "queued"
+        self.script = ""
+        self.created, self.started, self.finished = time.time(), None, None
+        self.chunks = []
+        self.cond = threading.Condition()
+
+    def write(self, text: str):
+        with self.cond:
+            self.chunks.append(text)
+            self.cond.notify_all()
+
+    def set_status(self, status: str):
+        with self.cond:
+            self.status = status
+            if status == "running":
+                self.started = time.time()
+            elif status in ("ok", "fail"):
+                self.finished = time.time()
+            self.cond.notify_all()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("ok", "fail")
+
+    def read(self, since: int, wait: float = 0):
+        """(texto a partir do trecho 'since', próximo índice, terminou?)."""
+        with self.cond:
+            if wait and since >= len(self.chunks) and not self.done:
+                self.cond.wait(wait)
+            return "".join(self.chunks[since:]), len(self.chunks), self.done
+
+    def info(self, since: int = None) -> dict:
+        out = dict(id=self.id, system=self.system, source=self.source, status=self.status,
+                   script=self.script, created=self.created, started=self.started, finished=self.finished)
+        if since is not None:
+            out["log"], out["next"], _ = self.read(since)
+        return out
+
+
+class _Router:
+    """sys.stdout/sys.stderr do serviço: copia a saída para o job da thread atual."""
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def write(self, text):
+        job = getattr(_LOCAL, "job", None)
+        if job is not None:
+            job.write(text)
+        return self._stream.write(text)
+
+    def flush(self):
+        self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+# =================== Worker por sistema ===================
+
+class SystemWorker(threading.Thread):
+    """Executa as submissões de um sistema, em série, com conexões e WC quentes."""
+
+    def __init__(self, reg: dict, pg, cfg, svn):
+        super().__init__(name=f"queue-{reg['name']}", daemon=True)
+        self.reg, self.pg, self.cfg, self.svn = reg, pg, cfg, svn
+        self.jobs = queue.Queue()
+        self.conns = {}
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            _LOCAL.job = job
+            job.set_status("running")
+            t0, status = time.monotonic(), "fail"
+            try:
+                job.script = self.process(job)
+                status = "ok"
+            except SystemExit as e:
+                status = "ok" if not e.code else "fail"
+            except Exception:
+                traceback.print_exc()
+                self.drop_conns()
+            finally:
+                print(f"[queue] {job.id}: {status}" + (f" ({job.script})" if job.script else ""))
+                _LOCAL.job = None
+                run_history.record("sync_queue", "job", time.monotonic() - t0, status=status,
+                                   system=self.reg["name"], script=job.script)
+                job.set_status(status)
+
+    # ---------- conexões quentes ----------
+
+    def conn(self, key: str, db_cfg: dict):
+        conn = self.conns.get(key)
+        if conn is not None and not conn.closed:
+            try:
+                conn.rollback()
+                with conn.cursor() as cur:
+                    cur.execute("select 1")
+                conn.rollback()
+                return conn
+            except Exception as e:
+                print(f"[queue] conexão {key} perdida ({e}); reconectando...")
+                self.drop_conns(key)
+        conn = adb.connect_db(self.pg, db_cfg)
+        self.conns[key] = conn
+        return conn
+
+    def drop_conns(self, *keys):
+        for key in keys or list(self.conns):
+            conn = self.conns.pop(key, None)
+            if conn is None:
+                continue
+            try:
+                adb.close_db(conn)
+            except Exception:
+                pass
+
+    # ---------- etapas ----------
+
+    def refresh_folder(self):
+        """svn update só da pasta do sistema (e listagem nova no catálogo remote)."""
+        user, pw, cfg_dir, env = self.svn
+        folder = self.reg["scripts_dir"]
+        if psync.is_wc(psync.SCRIPTS_DIR):
+            res = psync.run(["svn", "update", str(folder.relative_to(psync.SCRIPTS_DIR)),
+                             *psync.svn_opts_base(user, pw, cfg_dir)],
+                            cwd=psync.SCRIPTS_DIR, env=env, check=False, capture=True)
+            if res.returncode != 0:
+                adb.die(f"svn update falhou em {folder.name}.")
+        svn_catalog.invalidate(folder)
+
+    def process(self, job: Job) -> str:
+        reg = self.reg
+        sys_label, letter, folder = reg["name"].upper(), reg["letter"], reg["scripts_dir"]
+        # o conteúdo só vive enquanto a submissão roda (os jobs finalizados ficam na lista)
+        content, job.data = job.data, None
+        old_id = psync.extract_script_id(content) or ""
+        m = ID_RE.match(old_id)
+        if not m or m.group(2).upper() != letter:
+            adb.die(f"{job.source}: ID '{old_id}' inválido para {reg['label']} "
+                    f"(esperado NNNN.0.{letter}XX; o arquivo passou pelo preprocess?).")
+        initials = m.group(3).upper()
+
+        # 1) Pasta do sistema em dia; NNNN conferido antes de tocar as bases
+        with SVN_LOCK:
+            self.refresh_folder()
+            nxt = psync.next_seq_for(folder, letter)
+        script_id = old_id
+        if int(m.group(1)) < nxt:
+            name, content = psync.renumber_content(content, letter, initials, nxt)
+            script_id = name[:-4]
+
+        # 2) Bases (conexões quentes)
+        blocks = adb.split_blocks_by_endmark(adb.decode_auto(content))
+        content_hash = adb.script_content_hash(blocks)
+        test_cfg, dev_cfg = adb.load_db_pair(self.cfg, reg["name"])
+        if not adb.applied_on_both(test_cfg, dev_cfg, script_id, sys_label, content_hash):
+            adb.apply_on_connections(self.conn("test", test_cfg), self.conn("dev", dev_cfg),
+                                     [dict(script_id=script_id, blocks=blocks, content_hash=content_hash)],
+                                     folder, sys_label)
+
+        # 3) Arquivo numerado + svn add/commit
+        user, pw, cfg_dir, env = self.svn
+        with SVN_LOCK:
+            psync.CREATED_FILES.clear()
+            try:
+                created = psync.write_file_bytes(folder, letter, initials,
+                                                 psync._clean_cstyle_header_markers(content),
+                                                 user, pw, cfg_dir, env, script_id=script_id)
+                psync.svn_add_if_wc(created, user, pw, cfg_dir, env)
+                if not psync.svn_commit_if_changes(user, pw, cfg_dir, env):
+                    adb.die("nada foi comitado (src/Scripts precisa ser working copy SVN).")
+            except BaseException:
+                self.discard_uncommitted()
+                raise
+            return psync.CREATED_FILES[-1].name
+
+    def discard_uncommitted(self):
+        """Tira da WC o que a submissão criou e não foi comitado."""
+        user, pw, cfg_dir, env = self.svn
+        for path in psync.CREATED_FILES:
+            if psync.is_wc(psync.SCRIPTS_DIR):
+                psync.run(["svn", "revert", str(path.relative_to(psync.SCRIPTS_DIR)),
+                           *psync.svn_opts_base(user, pw, cfg_dir)],
+                          cwd=psync.SCRIPTS_DIR, env=env, check=False, capture=True)
+            path.unlink(missing_ok=True)
+        psync.CREATED_FILES.clear()
+
+
+# =================== Servidor HTTP ===================
+
+class QueueServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, addr, workers: dict, token: str, keep: int):
+        super().__init__(addr, QueueHandler)
+        self.workers, self.token = workers, token
+        self.jobs = {}
+        self.keep = keep
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def submit(self, system: str, source: str, data: bytes) -> Job:
+        with self.lock:
+            # descarta os finalizados mais antigos (dict preserva a ordem de chegada)
+            done = [j.id for j in self.jobs.values() if j.done]
+            for job_id in done[:max(0, len(done) - self.keep)]:
+                del self.jobs[job_id]
+            job = Job(f"{system}-{next(self.ids)}", system, source, data)
+            self.jobs[job.id] = job
+        self.workers[system].jobs.put(job)
+        return job
+
+
+class QueueHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _json(self, code: int, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self) -> bool:
+        given = self.headers.get("X-Queue-Token", "").encode("utf-8")
+        if self.server.token and not hmac.compare_digest(given, self.server.token.encode("utf-8")):
+            self._json(403, {"error": "token inválido"})
+            return False
+        return True
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/jobs":
+            return self._json(404, {"error": "rota desconhecida"})
+        if not self._authorized():
+            return
+        qs = parse_qs(url.query)
+        system = (qs.get("system") or [""])[0].lower()
+        if system not in self.server.workers:
+            return self._json(400, {"error": f"sistema não registrado: {system or '(vazio)'}"})
+        data = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if not data:
+            return self._json(400, {"error": "arquivo vazio"})
+        job = self.server.submit(system, (qs.get("source") or [""])[0], data)
+        self._json(202, dict(job.info(), position=self.server.workers[system].jobs.qsize()))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if not self._authorized():
+            return
+        parts = [p for p in url.path.split("/") if p]
+        if parts == ["jobs"]:
+            return self._json(200, [j.info() for j in list(self.server.jobs.values())])
+        if len(parts) < 2 or parts[0] != "jobs" or parts[1] not in self.server.jobs:
+            return self._json(404, {"error": "job desconhecido"})
+        job = self.server.jobs[parts[1]]
+        if parts[2:] == ["stream"]:
+            return self._stream(job)
+        since = int((parse_qs(url.query).get("since") or ["0"])[0] or 0)
+        self._json(200, job.info(since))
+
+    def _stream(self, job: Job):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.end_headers()
+        pos = 0
+        while True:
+            text, pos, done = job.read(pos, wait=15)
+            if text:
+                self.wfile.write(text.encode("utf-8"))
+                self.wfile.flush()
+            elif done:
+                return
+
+
+def is_loopback(host: str) -> bool:
+    """Só a própria máquina alcança o endereço? (nome resolvido: todos os endereços)"""
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        pass
+    try:
+        return all(ipaddress.ip_address(ai[4][0].split("%")[0]).is_loopback
+                   for ai in socket.getaddrinfo(host, None))
+    except (OSError, ValueError):
+        return False
+
+
+def serve(args):
+    # O serviço executa SQL em TEST e comita no svn: fora do loopback, só com token
+    host = args.host or queue_opt("host", "127.0.0.1")
+    port = args.port or int(queue_opt("port", str(DEFAULT_PORT)))
+    token = queue_opt("token")
+    if not token and not is_loopback(host):
+        adb.die(f"[queue] host {host or '(todas as interfaces)'} fora do loopback exige [queue] token.")
+
+    cfg = adb.load_cfg()
+    pg, ver = adb.get_db_driver()
+    adb.load_apply_opts(cfg)
+    print(f"[INFO] Usando driver: {'psycopg3' if ver == 3 else 'psycopg2'}")
+
+    # WC quente: sincroniza uma vez; depois só svn update da pasta de cada submissão
+    sync_svn.ensure_svn_installed()
+    url, user, pw = sync_svn.get_svn_settings()
+    cfg_dir = psync.make_no_proxy_config_dir()
+    env = psync.clean_proxy_env()
+    sync_svn.sync_scripts(url, user, pw, cfg_dir, env)
+    psync.ensure_dirs()
+
+    workers = {reg["name"]: SystemWorker(reg, pg, cfg, (user, pw, cfg_dir, env)) for reg in systems.load()}
+    for w in workers.values():
+        w.start()
+
+    sys.stdout, sys.stderr = _Router(sys.stdout), _Router(sys.stderr)
+    server = QueueServer((host, port), workers, token, int(queue_opt("keep", "100")))
+    print(f"[queue] ouvindo em http://{host}:{port} (sistemas: {', '.join(workers)})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("[queue] encerrando.")
+    finally:
+        server.server_close()
+        for w in workers.values():
+            w.drop_conns()
+
+
+# =================== Cliente ===================
+
+def _base_url(args) -> str:
+    url = args.url or os.environ.get("SYNC_QUEUE_URL") or queue_opt("url")
+    return (url or f"http://127.0.0.1:{queue_opt('port', str(DEFAULT_PORT))}").rstrip("/")
+
+
+def _call(args, path: str, data: bytes = None):
+    headers = {"Content-Type": "application/octet-stream"} if data is not None else {}
+    token = os.environ.get("SYNC_QUEUE_TOKEN") or queue_opt("token")
+    if token:
+        headers["X-Queue-Token"] = token
+    req = Request(_base_url(args) + path, data=data, headers=headers, method="POST" if data is not None else "GET")
+    try:
+        return urlopen(req, timeout=None if path.endswith("/stream") else 30)
+    except HTTPError as e:
+        try:
+            msg = json.loads(e.read().decode("utf-8")).get("error", "")
+        except ValueError:
+            msg = ""
+        adb.die(f"fila respondeu {e.code} em {path}: {msg or e.reason}")
+    except URLError as e:
+        adb.die(f"fila indisponível em {_base_url(args)}: {e.reason}")
+
+
+def _follow_stream(args, job_id: str) -> dict:
+    with _call(args, f"/jobs/{job_id}/stream") as resp:
+        while True:
+            chunk = resp.read1(65536)
+            if not chunk:
+                break
+            sys.stdout.write(chunk.decode("utf-8", errors="replace"))
+            sys.stdout.flush()
+    with _call(args, f"/jobs/{job_id}") as resp:
+        return json.load(resp)
+
+
+def _follow_poll(args, job_id: str) -> dict:
+    since = 0
+    while True:
+        with _call(args, f"/jobs/{job_id}?since={since}") as resp:
+            info = json.load(resp)
+        sys.stdout.write(info["log"])
+        sys.stdout.flush()
+        since = info["next"]
+        if info["status"] in ("ok", "fail"):
+            return info
+        time.sleep(args.poll)
+
+
+def submit(args) -> int:
+    present = systems.present()
+    if not present:
+        print(f"[queue] nenhum arquivo fonte ({systems.describe_inputs()}).")
+        return 0
+
+    # lote: um job por entrada, em ordem — o worker do sistema os serializa
+    jobs = []
+    for reg, src in ((reg, src) for reg in present for src in systems.inputs(reg)):
+        path = f"/jobs?system={quote(reg['name'])}&source={quote(src.name)}"
+        with _call(args, path, src.read_bytes()) as resp:
+            info = json.load(resp)
+        print(f"[queue] {src.name} -> job {info['id']} ({info['position']} na fila de {reg['label']})")
+        jobs.append((src, info["id"]))
+    if args.detach:
+        return 0
+
+    failed = False
+    for src, job_id in jobs:
+        print(f"[queue] ===== {job_id} ({src.name}) =====")
+        info = _follow_poll(args, job_id) if args.poll else _follow_stream(args, job_id)
+        if info["status"] == "ok":
+            print(f"[queue] {src.name}: comitado como {info['script']}.")
+            psync.delete_sources([src])
+            psync.clear_backup_record(src)
+        else:
+            failed = True
+            print(f"[queue] {src.name}: job {job_id} falhou.", file=sys.stderr)
+            psync.restore_backup(src)
+    return 1 if failed else 0
+
+
+def status(args) -> int:
+    with _call(args, f"/jobs/{args.job}?since=0") as resp:
+        info = json.load(resp)
+    print(info.pop("log"), end="")
+    print(json.dumps({k: v for k, v in info.items() if k != "next"}, ensure_ascii=False, indent=2))
+    return 0 if info["status"] != "fail" else 1
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Fila de submissões de scripts (serviço e cliente).")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("serve", help="roda o serviço (um worker por sistema)")
+    p.add_argument("--host")
+    p.add_argument("--port", type=int)
+    p = sub.add_parser("submit", help="envia os arquivos tratados da raiz")
+    p.add_argument("--url")
+    p.add_argument("--poll", type=float, default=0, help="consulta a cada N s em vez de stream")
+    p.add_argument("--detach", action="store_true", help="só enfileira")
+    p = sub.add_parser("status", help="estado e saída de um job")
+    p.add_argument("job")
+    p.add_argument("--url")
+    args = ap.parse_args()
+
+    if args.cmd == "serve":
+        serve(args)
+        return 0
+    return submit(args) if args.cmd == "submit" else status(args)
+
+
+if __name__ == "__main__":
+    with run_history.stage("sync_queue"):
+        sys.exit(main())
@@ -19,6 +19,10 @@ Sincroniza a working copy SVN em src/Scripts a partir da URL configurada (HTTPS
   * Credenciais (se exigidas pelo servidor):
       - Variáveis de ambiente: SVN_USERNAME / SVN_PASSWORD
       - ou seção [auth] no config.ini: svn_username / svn_password
+  * Catálogo (ver svn_catalog.py):
+      - [svn] catalog = wc (padrão, checkout/update completo) ou remote
+        (WC esparsa: só as pastas dos sistemas, sem o histórico de scripts)
+      - ou variável de ambiente SVN_CATALOG
 """
 
 import os
@@ -29,6 +33,10 @@ from pathlib import Path
 from datetime import datetime
 from configparser import ConfigParser
 
+import profiling
+import run_history
+import systems
+
 # === Caminhos (estrutura nova) ===
 THIS_DIR     = Path(__file__).resolve().parent        # src/
 PROJECT_ROOT = THIS_DIR.parent                        # raiz do projeto
@@ -62,6 +70,14 @@ def run(cmd, cwd=None, env=None, check=True, capture=False):
 def is_working_copy(path: Path) -> bool:
     return (path / ".svn").is_dir()
 
+def is_versioned(path: Path, opts, env: dict) -> bool:
+    """A pasta é um nó da working copy? (svn info; na 1.7+ só a raiz tem .svn)"""
+    if not path.exists():
+        return False
+    res = subprocess.run(["svn", "info", "--show-item", "kind", *opts, str(path)],
+                         env=env, text=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return res.returncode == 0
+
 def ensure_svn_installed():
     if not have("svn"):
         print("Erro: o cliente 'svn' não está instalado ou não está no PATH.", file=sys.stderr)
@@ -102,6 +118,14 @@ def get_svn_settings():
 
     return url, username, password
 
+def catalog_mode() -> str:
+    """wc (working copy completa) ou remote (svn ls + cache de svn cat)."""
+    mode = (os.environ.get("SVN_CATALOG") or load_config().get("svn", "catalog", fallback="wc")).strip().lower()
+    if mode not in ("wc", "remote"):
+        print(f"ERRO: [svn] catalog inválido: {mode} (use wc ou remote)", file=sys.stderr)
+        sys.exit(2)
+    return mode
+
 # --------------------------------------------------------------------
 # Config SVN local e ambiente sem proxy
 # --------------------------------------------------------------------
@@ -210,6 +234,42 @@ def checkout_or_update(repo_url: str, dest: Path, username: str, password: str,
         dest.parent.mkdir(parents=True, exist_ok=True)
         run(["svn", "checkout", *opts, repo_url, str(dest)], env=env)
 
+def prepare_sparse_wc(repo_url: str, dest: Path, username: str, password: str, cfg_dir: Path, env: dict):
+    """
+    Catálogo remote: working copy só com as pastas dos sistemas (depth empty),
+    o bastante para o post_sync adicionar/comitar o script novo. Os scripts
+    antigos não são baixados (o catch-up busca os pendentes via svn cat).
+    """
+    opts = svn_common_opts(username, password, cfg_dir)
+    if dest.exists() and not is_working_copy(dest):
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        backup = dest.parent / f"{dest.name}.backup-{stamp}"
+        print(f"Aviso: '{dest}' existe mas não é uma working copy SVN. Movendo para: {backup}")
+        dest.rename(backup)
+    if is_working_copy(dest):
+        wc_url = get_wc_url(dest)
+        if wc_url and wc_url != repo_url:
+            relocate_wc(wc_url, repo_url, dest, username, password, cfg_dir, env)
+        run(["svn", "cleanup", *opts, str(dest)], env=env)
+    else:
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        run(["svn", "checkout", "--depth", "empty", *opts, repo_url, str(dest)], env=env)
+    for reg in systems.load():
+        # só pastas que não estão versionadas: --set-depth empty numa pasta completa apagaria os arquivos.
+        # Pasta existente nem sempre é versionada (criada à mão ou por outra etapa): --force a adota
+        if not is_versioned(reg["scripts_dir"], opts, env):
+            run(["svn", "update", "--parents", "--force", "--set-depth", "empty", *opts, str(reg["scripts_dir"])],
+                env=env)
+
+def sync_scripts(url: str, user: str, pw: str, cfg_dir: Path, env: dict):
+    """Atualiza src/Scripts conforme o catálogo configurado."""
+    if catalog_mode() == "remote":
+        print(f"Preparando WC esparsa de '{url}' -> '{SCRIPTS_DIR}' (catálogo remote)")
+        prepare_sparse_wc(url, SCRIPTS_DIR, user, pw, cfg_dir, env)
+    else:
+        print(f"Sincronizando SVN '{url}' -> '{SCRIPTS_DIR}'")
+        checkout_or_update(url, SCRIPTS_DIR, user, pw, cfg_dir, env)
+
 # --------------------------------------------------------------------
 # Main
 # --------------------------------------------------------------------
@@ -219,9 +279,9 @@ def main():
     cfg_dir = make_no_proxy_config_dir()
     env = clean_proxy_env()
 
-    print(f"Sincronizando SVN '{url}' -> '{SCRIPTS_DIR}'")
-    checkout_or_update(url, SCRIPTS_DIR, user, pw, cfg_dir, env)
+    sync_scripts(url, user, pw, cfg_dir, env)
     print("✅ Pronto! Pasta sincronizada.")
 
 if __name__ == "__main__":
-    main()
+    with profiling.stage("sync_svn"), run_history.stage("sync_svn"):
+        main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Registro dos sistemas (produtos) atendidos pelo sync_scripts.
+
+Cada sistema tem: nome (chave), rótulo, letra do nome do script
+(NNNN.0.<letra><XX>.sql), arquivo fonte na raiz, caixa de entrada (lote),
+pasta em src/Scripts e as seções de conexão TEST/DEV. Sem [systems] no
+config.ini valem os dois sistemas históricos (Gestor/G e Supervisor/S).
+
+Lote: além do arquivo da raiz, cada *.sql da caixa de entrada do sistema
+(padrão <raiz>/inbox/<nome>/) é um script novo. As entradas de um sistema
+seguem a ordem de inputs(): o arquivo da raiz primeiro, depois a caixa de
+entrada em ordem de nome — é a ordem dos NNNN consecutivos e da aplicação.
+
+Configuração (config.ini):
+    [systems]
+    names = gestor, supervisor, financeiro
+
+    [system_financeiro]
+    label       = Financeiro          ; padrão: nome com inicial maiúscula
+    letter      = F                   ; obrigatório, uma letra, única
+    source      = financeiro.sql      ; padrão: <nome>.sql (na raiz)
+    scripts_dir = Financeiro          ; padrão: rótulo (dentro de src/Scripts)
+    db_test     = db_test_financeiro  ; padrão: db_test_<nome>
+    db_dev      = db_dev_financeiro   ; padrão: db_dev_<nome>
+    inbox       = inbox/financeiro    ; padrão: inbox/<nome> (na raiz)
+
+Sistemas são independentes entre si (pasta, letra e bases próprias); as
+etapas processam os sistemas presentes em paralelo.
+"""
+
+import re
+import sys
+from pathlib import Path
+from configparser import ConfigParser
+
+THIS_DIR     = Path(__file__).resolve().parent        # src/
+PROJECT_ROOT = THIS_DIR.parent                        # raiz
+SCRIPTS_DIR  = THIS_DIR / "Scripts"                   # src/Scripts
+CONFIG_PATH  = PROJECT_ROOT / "config.ini"
+
+DEFAULTS = {
+    "gestor":     {"label": "Gestor",     "letter": "G"},
+    "supervisor": {"label": "Supervisor", "letter": "S"},
+}
+
+_CACHE = None
+
+
+def _fail(msg: str):
+    print(f"ERRO: {msg}", file=sys.stderr)
+    sys.exit(2)
+
+
+def load(cfg: ConfigParser = None) -> list:
+    """
+    Retorna a lista de sistemas registrados (na ordem de [systems] names):
+      {name, label, letter, src_path, inbox, scripts_dir, db_test, db_dev}
+    """
+    global _CACHE
+    if cfg is None and _CACHE is not None:
+        return _CACHE
+    if cfg is None:
+        cfg = ConfigParser()
+        if CONFIG_PATH.exists():
+            cfg.read(CONFIG_PATH, encoding="utf-8")
+
+    raw = cfg.get("systems", "names", fallback="gestor, supervisor")
+    names = [n.strip().lower() for n in re.split(r"[,\s]+", raw) if n.strip()]
+    out, letters = [], {}
+    for name in names:
+        sec = cfg[f"system_{name}"] if cfg.has_section(f"system_{name}") else {}
+        base = DEFAULTS.get(name, {})
+        label = sec.get("label", base.get("label", name.capitalize())).strip()
+        letter = sec.get("letter", base.get("letter", "")).strip().upper()
+        if not re.fullmatch(r"[A-Z]", letter):
+            _fail(f"[system_{name}] letter deve ser UMA letra (ex.: F).")
+        if letter in letters:
+            _fail(f"Sistemas '{letters[letter]}' e '{name}' usam a mesma letra '{letter}'.")
+        letters[letter] = name
+        out.append(dict(
+            name=name,
+            label=label,
+            letter=letter,
+            src_path=PROJECT_ROOT / sec.get("source", f"{name}.sql").strip(),
+            inbox=PROJECT_ROOT / sec.get("inbox", f"inbox/{name}").strip(),
+            scripts_dir=SCRIPTS_DIR / sec.get("scripts_dir", label).strip(),
+            db_test=sec.get("db_test", f"db_test_{name}").strip(),
+            db_dev=sec.get("db_dev", f"db_dev_{name}").strip(),
+        ))
+    if not out:
+        _fail("[systems] names está vazio.")
+    _CACHE = out
+    return out
+
+
+def by_name(name: str) -> dict:
+    for s in load():
+        if s["name"] == name:
+            return s
+    _fail(f"sistema não registrado: {name}")
+
+
+def by_source(src: Path) -> dict:
+    """Sistema cujo arquivo fonte na raiz é 'src'."""
+    for s in load():
+        if s["src_path"].name.lower() == src.name.lower():
+            return s
+    names = ", ".join(s["src_path"].name for s in load())
+    _fail(f"arquivo não suportado: {src.name} (use {names})")
+
+
+def inputs(reg: dict) -> list:
+    """Scripts novos do sistema, em ordem: arquivo da raiz e depois a caixa de entrada (por nome)."""
+    out = [reg["src_path"]] if reg["src_path"].exists() else []
+    if reg["inbox"].is_dir():
+        out += sorted((p for p in reg["inbox"].glob("*.sql") if p.is_file()), key=lambda p: p.name.lower())
+    return out
+
+
+def input_key(reg: dict, path: Path) -> str:
+    """Chave da entrada (manifesto src/.target_<chave>.json): o nome do sistema para o arquivo da raiz."""
+    if path.resolve() == reg["src_path"].resolve():
+        return reg["name"]
+    return f"{reg['name']}__{path.stem}"
+
+
+def for_input(path: Path) -> dict:
+    """Sistema dono da entrada: arquivo fonte da raiz ou arquivo na caixa de entrada."""
+    for s in load():
+        if path.resolve().parent == s["inbox"].resolve():
+            return s
+    return by_source(path)
+
+
+def present() -> list:
+    """Sistemas com alguma entrada (arquivo fonte na raiz ou caixa de entrada não vazia)."""
+    return [s for s in load() if inputs(s)]
+
+
+def describe_inputs() -> str:
+    """Para mensagens de 'nada a fazer'."""
+    return "/".join(s["src_path"].name for s in load()) + " na raiz ou *.sql em inbox/<sistema>"
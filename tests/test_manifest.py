@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Manifesto do preprocess (src/.target_<chave>.json): o ManifestScan, que o
+calcula enquanto o arquivo é escrito (ou lido em pedaços), tem de dar o mesmo
+resultado da varredura do arquivo inteiro em memória.
+"""
+
+import hashlib
+import io
+import re
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import preprocess_sql as pp  # noqa: E402
+
+MARK = pp.END_MARK.encode("ascii")
+
+
+def full_scan(data: bytes) -> dict:
+    """Varredura de referência: o arquivo inteiro em memória."""
+    blocks, pos = [], 0
+    while True:
+        nxt = data.find(MARK, pos)
+        start, stop = pos, len(data) if nxt < 0 else nxt
+        while start < stop and data[start] in b" \t\r\n\f\v":
+            start += 1
+        while stop > start and data[stop - 1] in b" \t\r\n\f\v":
+            stop -= 1
+        if stop > start:
+            blocks.append([start, stop])
+        if nxt < 0:
+            break
+        pos = nxt + len(MARK)
+    head = re.search(rb"fn_verifica_script\s*\(", data, flags=re.IGNORECASE)
+    return {"sha256": hashlib.sha256(data).hexdigest(), "bytes": len(data),
+            "header_end": head.start() if head else None, "blocks": blocks}
+
+
+def scan(data: bytes, chunk: int) -> dict:
+    s = pp.ManifestScan()
+    for i in range(0, len(data), chunk):
+        s.write(data[i:i + chunk])
+    return s.layout()
+
+
+SAMPLES = [
+    b"",
+    b"   \n\t",
+    MARK + MARK,
+    b"/*\n--#AUTOR...: X\n*/\n\nselect * from sistema.fn_verifica_script('0001.0.GJO');\n\n" + MARK + b"\n\n"
+    b"create table t (id int);\n" + MARK + b"\n\n  \n" + MARK + b"\n\n"
+    b"select * from sistema.fn_atualiza_script('0001.0.GJO');\n\n" + MARK + b"\n",
+    b"select 1; ------------" + MARK + b"select 2;\r\n" + MARK[:-3] + b"\r\n  select 3  ",
+    b"FN_VERIFICA_SCRIPT  ('x')" + MARK,
+]
+
+
+@pytest.mark.parametrize("data", SAMPLES)
+@pytest.mark.parametrize("chunk", [1, 5, 36, 37, 1 << 20])
+def test_scan_matches_full_scan(data, chunk):
+    got = scan(data, chunk)
+    assert got.pop("encoding") == "cp1252"
+    assert got == full_scan(data)
+
+
+def test_scan_detects_encoding():
+    assert scan("ação".encode("utf-8") + b"\x81", 2)["encoding"] == "latin-1"
+    assert scan("coração".encode("utf-8"), 1)["encoding"] == "cp1252"   # utf-8 também decodifica em cp1252
+    assert scan("ÁGUA".encode("utf-8"), 1)["encoding"] == "utf-8"   # 0x81 não existe em cp1252
+
+
+def test_build_output_layout_matches_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(pp, "get_local_ip", lambda: "127.0.0.1")
+    text = "create table t (id int);\n\ninsert into t values (1); -- ç\n"
+    spans = [0, text.index("\n\n"), text.index("insert"), len(text)]
+    out = tmp_path / "gestor.sql"
+    with out.open("wb") as f:
+        s = pp.ManifestScan(f)
+        with io.TextIOWrapper(io.BufferedWriter(s), encoding=pp.TARGET_ENCODING, errors="replace") as w:
+            pp.build_output(w, "0001.0.GJO", "0001.0.GJO.sql", "GESTOR", "X", text, spans)
+    got = s.layout()
+    data = out.read_bytes()
+    assert got.pop("encoding") == "cp1252"
+    assert got == full_scan(data)
+    assert len(got["blocks"]) == 4
+
+
+@pytest.fixture
+def treated(tmp_path, monkeypatch):
+    """Arquivo tratado com ID 0001.0.GJO e o manifesto dele; o próximo NNNN livre é 0005."""
+    monkeypatch.setattr(pp, "get_local_ip", lambda: "127.0.0.1")
+    monkeypatch.setattr(pp, "manifest_path", lambda key: tmp_path / f".target_{key}.json")
+    monkeypatch.setattr(pp.systems, "for_input", lambda src: {"name": "GESTOR"})
+    monkeypatch.setattr(pp.systems, "input_key", lambda reg, src: "GESTOR")
+    monkeypatch.setattr(pp, "detect_system_and_letter", lambda src: ("GESTOR", "G", tmp_path / "Scripts"))
+    monkeypatch.setattr(pp, "next_seq_for", lambda folder, letter: 5)
+    text = "create table t (id int);\n"
+    src = tmp_path / "gestor.sql"
+    with src.open("w", encoding=pp.TARGET_ENCODING) as out:
+        pp.build_output(out, "0001.0.GJO", "0001.0.GJO.sql", "GESTOR", "X", text, [0, len(text)])
+    return src
+
+
+def test_refresh_rewrites_id_in_place(treated):
+    pp.write_manifest(treated, "0001.0.GJO")
+    before = treated.read_bytes()
+    assert pp.refresh_script_id(treated) == "0005.0.GJO"
+    after = treated.read_bytes()
+    assert after == before.replace(b"0001.0.GJO", b"0005.0.GJO")
+    man = pp._own_manifest(treated)
+    assert man["script_id"] == "0005.0.GJO"
+    assert man["sha256"] == hashlib.sha256(after).hexdigest()
+    assert man["blocks"] == full_scan(after)["blocks"]
+
+
+def test_refresh_keeps_free_id_and_falls_back_without_manifest(treated):
+    assert pp.refresh_script_id(treated, 0) == "0005.0.GJO"   # sem manifesto: lê o arquivo inteiro
+    assert pp._own_manifest(treated)["sha256"] == hashlib.sha256(treated.read_bytes()).hexdigest()
+    assert pp.refresh_script_id(treated, 0) == "0005.0.GJO"
+
+
+def test_refresh_ignores_stale_manifest(treated):
+    pp.write_manifest(treated, "0001.0.GJO")
+    edited = treated.read_bytes().replace(b"id int", b"nr int")   # mesmo tamanho, sha256 diferente
+    treated.write_bytes(edited)
+    assert pp.refresh_script_id(treated) == "0005.0.GJO"
+    after = treated.read_bytes()
+    assert after == edited.replace(b"0001.0.GJO", b"0005.0.GJO")
+    assert pp._own_manifest(treated)["blocks"] == full_scan(after)["blocks"]
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Reserva otimista de NNNN no post_sync (desenvolvedores concorrentes), sem svn
+nem PostgreSQL: svn_list_remote e run são trocados por um repositório falso.
+O fluxo completo contra svn + initdb de verdade é o `replay_harness.py race`.
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import post_sync_sql as ps  # noqa: E402
+
+
+def script(seq: int, initials: str = "JO", letter: str = "G") -> str:
+    return f"{seq:04d}.0.{letter}{initials}"
+
+
+def body(script_id: str) -> bytes:
+    return (f"select * from sistema.fn_verifica_script('{script_id}');\n"
+            f"create table t_{script_id[:4]} (id int);\n"
+            f"select * from sistema.fn_atualiza_script('{script_id}');\n").encode("cp1252")
+
+
+class FakeSvn:
+    """HEAD remoto por pasta ({nome: revisão}) e os comandos svn que o post_sync roda."""
+
+    def __init__(self, scripts_dir: Path):
+        self.scripts_dir = scripts_dir
+        self.remote = {}
+        self.commands = []
+
+    def list_remote(self, folder, *args, **kwargs):
+        return sorted(self.remote.get(folder, {}).items())
+
+    def run(self, cmd, cwd=None, check=True, capture=False, env=None):
+        self.commands.append(cmd[:2])
+        if cmd[:2] == ["svn", "move"]:
+            src, dst = (Path(cwd) / cmd[2]), (Path(cwd) / cmd[3])
+            src.rename(dst)
+
+        class Res:
+            returncode, stdout = 0, ""
+        return Res()
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    scripts = tmp_path / "Scripts"
+    folder = scripts / "Gestor"
+    folder.mkdir(parents=True)
+    (scripts / ".svn").mkdir()
+    svn = FakeSvn(scripts)
+    monkeypatch.setattr(ps, "SCRIPTS_DIR", scripts)
+    monkeypatch.setattr(ps, "svn_list_remote", svn.list_remote)
+    monkeypatch.setattr(ps, "run", svn.run)
+    monkeypatch.setattr(ps, "CREATED_FILES", [])
+    monkeypatch.setattr(ps, "RENUMBERED", [])
+    return svn, folder
+
+
+def created(folder: Path, *seqs: int):
+    paths = []
+    for seq in seqs:
+        path = folder / f"{script(seq)}.sql"
+        path.write_bytes(body(script(seq)))
+        paths.append(path)
+    ps.CREATED_FILES.extend(paths)
+    return paths
+
+
+def opts():
+    return ("", "", Path("."), {})
+
+
+# ----------------------------- reserve_seq -----------------------------
+
+def test_reserve_seq_keeps_free_number(repo):
+    svn, folder = repo
+    svn.remote[folder] = {f"{script(9)}.sql": 3}
+    assert ps.reserve_seq(folder, "G", 10, f"{script(10)}.sql", *opts()) == 10
+
+
+def test_reserve_seq_skips_past_remote_and_local_numbers(repo):
+    svn, folder = repo
+    svn.remote[folder] = {f"{script(10, 'MA')}.sql": 4}
+    (folder / f"{script(11, 'AN')}.sql").write_bytes(b"")
+    assert ps.reserve_seq(folder, "G", 10, f"{script(10)}.sql", *opts()) == 12
+
+
+def test_reserve_seq_ignores_other_letters_and_own_name(repo):
+    svn, folder = repo
+    svn.remote[folder] = {f"{script(10)}.sql": 4, f"{script(10, letter='S')}.sql": 4}
+    assert ps.reserve_seq(folder, "G", 10, f"{script(10)}.sql", *opts()) == 10
+
+
+# -------------------------- lost_reservations --------------------------
+
+def test_lost_reservations_first_commit_keeps_number(repo):
+    svn, folder = repo
+    ours, later = created(folder, 10, 11)
+    svn.remote[folder] = {ours.name: 7, f"{script(10, 'MA')}.sql": 6,   # o outro comitou antes
+                          later.name: 7, f"{script(11, 'MA')}.sql": 8}  # e este, depois
+    assert ps.lost_reservations(*opts()) == [ours]
+
+
+def test_lost_reservations_none_without_collision(repo):
+    svn, folder = repo
+    paths = created(folder, 10, 11)
+    svn.remote[folder] = {p.name: 7 for p in paths}
+    assert ps.lost_reservations(*opts()) == []
+
+
+# ------------------------- renumeração em lote -------------------------
+
+@pytest.mark.parametrize("seqs, taken, must, expected", [
+    ([10, 11], {10}, (), [11, 12]),          # N perdido: N -> N+1 e N+1 -> N+2 (ordem mantida)
+    ([10, 11], {9}, (), [10, 11]),           # sem colisão: nada muda
+    ([10, 11], {11}, (), [10, 12]),          # só o segundo colidiu
+    ([10, 11], {10, 30}, (), [31, 32]),      # colidido vai para depois de tudo o que é conhecido
+])
+def test_plan_batch_renumber(seqs, taken, must, expected):
+    assert ps.plan_batch_renumber(seqs, taken, must) == expected
+
+
+def test_plan_batch_renumber_must_move_goes_after_known():
+    assert ps.plan_batch_renumber([10, 11], {10, 11}, {0}) == [12, 13]
+
+
+def test_committed_batch_keeps_order_after_renumber(repo):
+    svn, folder = repo
+    first, second = created(folder, 10, 11)
+    svn.remote[folder] = {first.name: 7, second.name: 7, f"{script(10, 'MA')}.sql": 6}
+    lost = ps.lost_reservations(*opts())
+    assert lost == [first]
+
+    renamed = ps.renumber_batch(True, *opts(), lost=set(lost))
+
+    assert [p.name for p in ps.CREATED_FILES] == [f"{script(11)}.sql", f"{script(12)}.sql"]
+    # o conteúdo de cada arquivo segue com o ID novo, na ordem original do lote
+    assert ps.extract_script_id(ps.CREATED_FILES[0].read_bytes()) == script(11)
+    assert b"t_0010" in ps.CREATED_FILES[0].read_bytes()
+    assert ps.extract_script_id(ps.CREATED_FILES[1].read_bytes()) == script(12)
+    assert b"t_0011" in ps.CREATED_FILES[1].read_bytes()
+    # de trás para frente: N+1 -> N+2 antes de N -> N+1 (sem pisar em registro existente)
+    assert [(old, new) for _, old, new in ps.RENUMBERED] == [(script(11), script(12)), (script(10), script(11))]
+    assert renamed == [f"{script(11)}.sql -> {script(12)}.sql", f"{script(10)}.sql -> {script(11)}.sql"]
+
+
+def test_uncommitted_batch_moves_only_collisions(repo):
+    svn, folder = repo
+    first, second = created(folder, 10, 11)
+    svn.remote[folder] = {f"{script(11, 'MA')}.sql": 6}
+
+    ps.renumber_batch(False, *opts())
+
+    assert [p.name for p in ps.CREATED_FILES] == [f"{script(10)}.sql", f"{script(12)}.sql"]
+    assert first.exists() and not second.exists()
+    assert [(old, new) for _, old, new in ps.RENUMBERED] == [(script(11), script(12))]
+    assert ["svn", "revert"] in svn.commands
+
+
+def test_no_collision_records_no_renames(repo):
+    svn, folder = repo
+    created(folder, 10, 11)
+    svn.remote[folder] = {f"{script(9, 'MA')}.sql": 6}
+
+    assert ps.renumber_batch(False, *opts()) == []
+    assert ps.RENUMBERED == []
+    assert svn.commands == []